@@ -5,8 +5,10 @@ from .models import (
     Cart,
     CartItem,
     Category,
+    EmailOutbox,
     Order,
     OrderItem,
+    PaymentEvent,
     Product,
     ProductImage,
     ProductPriceTier,
@@ -73,6 +75,7 @@ class CartItemAdmin(admin.ModelAdmin):
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
+    readonly_fields = ("is_preorder",)
 
 
 @admin.action(description="Mark selected orders as processing")
@@ -108,6 +111,24 @@ class OrderAdmin(admin.ModelAdmin):
     actions = [mark_processing, mark_fulfilled, mark_cancelled]
 
 
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "event", "reference", "status", "attempts", "received_at", "processed_at")
+    list_filter = ("status", "event")
+    search_fields = ("reference",)
+    readonly_fields = ("received_at", "processed_at")
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "subject", "recipient", "status", "attempts", "created_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("recipient", "subject")
+    readonly_fields = ("created_at", "sent_at")
+    # Queued bodies can hold a new customer's temporary password.
+    exclude = ("body", "html_body")
+
+
 @admin.register(WholesaleInquiry)
 class WholesaleInquiryAdmin(admin.ModelAdmin):
     list_display = ['company_name', 'contact_name', 'email', 'business_type', 'expected_volume', 'status', 'created_at']
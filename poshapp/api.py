@@ -1,21 +1,55 @@
 from django.db import transaction
 import logging
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db.models import Q
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from ninja import NinjaAPI
 from ninja.errors import HttpError
 
-from .models import CartItem, Category, Order, OrderItem, Product
-from .cart import add_item, cart_summary, get_cart as get_cart_for_request
+from .models import Category, Product
+from .checkout import (
+    InsufficientStock,
+    create_pending_order,
+    fail_order_payment,
+    start_order_payment,
+)
+from .idempotency import (
+    IdempotencyConflict,
+    claim_idempotency_key,
+    complete_idempotency_key,
+    release_idempotency_key,
+)
+from .cart import (
+    add_item,
+    cart_summary,
+    clear_cart,
+    get_cart as get_cart_for_request,
+    materialize_cart,
+    reconcile_cart,
+    remove_item,
+    update_item,
+)
+from .catalog import (
+    CATALOG_KEYSET_ORDERING,
+    CATALOG_ORDERING,
+    cached_catalog_read,
+    decode_catalog_cursor,
+    encode_catalog_cursor,
+    keyset_filter,
+    keyset_order_by,
+)
+from .facets import compute_facets
+from .search import product_suggestions, search_products
+from .snapshot import get_catalog_snapshot, products_in_order
 from .payments import (
     PaystackError,
+    ainitialize_paystack_transaction,
     build_paystack_metadata,
     get_paystack_callback_url,
     initialize_paystack_transaction,
 )
 from .emails import send_order_received_email, send_welcome_new_user_email
-from .views import _get_or_create_user_from_checkout
 from .schemas import (
     CartItemIn,
     CartItemOut,
@@ -26,9 +60,11 @@ from .schemas import (
     OrderItemOut,
     OrderOut,
     PaymentInitOut,
+    ProductFacetsOut,
     ProductImageOut,
     ProductOut,
     ProductPriceTierOut,
+    ProductSuggestionOut,
 )
 
 
@@ -111,9 +147,79 @@ def get_cart(request):
     return _serialize_cart(cart)
 
 
+def _load_product_page(
+    category, featured, q, min_price, max_price, ordering, position, offset, limit
+):
+    queryset = Product.objects.filter(is_active=True).prefetch_related(
+        "images", "price_tiers", "categories"
+    )
+    snapshot = None if q else get_catalog_snapshot()
+    if snapshot is not None:
+        ids = snapshot.select(
+            ordering,
+            category=category or None,
+            featured=featured,
+            min_price=min_price,
+            max_price=max_price,
+            after=position,
+        )
+        if position is not None:
+            offset = 0
+        paged = products_in_order(queryset, ids[offset : offset + limit + 1])
+    else:
+        paged = _query_product_page(
+            queryset,
+            category,
+            featured,
+            q,
+            min_price,
+            max_price,
+            ordering,
+            position,
+            offset,
+            limit,
+        )
+    next_cursor = None
+    if len(paged) > limit:
+        paged = paged[:limit]
+        if ordering in CATALOG_KEYSET_ORDERING:
+            next_cursor = encode_catalog_cursor(ordering, paged[-1])
+    return {
+        "items": [_serialize_product(product).dict() for product in paged],
+        "next_cursor": next_cursor,
+    }
+
+
+def _query_product_page(
+    queryset, category, featured, q, min_price, max_price, ordering, position, offset,
+    limit,
+):
+    if category:
+        queryset = queryset.filter(categories__slug=category)
+    if featured is not None:
+        queryset = queryset.filter(is_featured=featured)
+    if q:
+        queryset = search_products(queryset, q)
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+    if ordering == "relevance":
+        queryset = queryset.order_by("-search_rank", "-updated_at", "-id")
+    elif ordering in CATALOG_KEYSET_ORDERING:
+        queryset = queryset.order_by(*keyset_order_by(ordering))
+    else:
+        queryset = queryset.order_by(CATALOG_ORDERING[ordering])
+    if position is not None:
+        queryset = queryset.filter(keyset_filter(ordering, *position))
+        offset = 0
+    return list(queryset[offset : offset + limit + 1])
+
+
 @api.get("/products", response=list[ProductOut])
 def list_products(
     request,
+    response: HttpResponse,
     category: str | None = None,
     featured: bool | None = None,
     q: str | None = None,
@@ -122,38 +228,60 @@ def list_products(
     max_price: int | None = None,
     limit: int = 20,
     offset: int = 0,
+    cursor: str | None = None,
 ):
-    queryset = (
-        Product.objects.filter(is_active=True)
-        .prefetch_related("images", "price_tiers", "categories")
-        .order_by("-updated_at", "name")
-    )
-    if category:
-        queryset = queryset.filter(categories__slug=category)
-    if featured is not None:
-        queryset = queryset.filter(is_featured=featured)
-    if q:
-        queryset = queryset.filter(Q(name__icontains=q) | Q(sku__icontains=q))
-    if min_price is not None:
-        queryset = queryset.filter(price__gte=min_price)
-    if max_price is not None:
-        queryset = queryset.filter(price__lte=max_price)
-    if ordering:
-        ordering_map = {
-            "updated": "-updated_at",
-            "updated_asc": "updated_at",
-            "price": "price",
-            "-price": "-price",
-            "name": "name",
-            "-name": "-name",
-        }
-        order_by = ordering_map.get(ordering)
-        if order_by:
-            queryset = queryset.order_by(order_by)
+    """List active products.
+
+    Offset pagination by default. When the ordering supports it (updated or
+    price), the ``X-Next-Cursor`` response header carries an opaque cursor;
+    passing it back as ``cursor`` switches to keyset pagination and ignores
+    ``offset``.
+    """
     safe_limit = max(1, min(int(limit), 100))
     safe_offset = max(0, int(offset))
-    paged = queryset[safe_offset : safe_offset + safe_limit]
-    return [_serialize_product(product) for product in paged]
+    if ordering not in CATALOG_ORDERING:
+        # Without an explicit ordering, searches rank by relevance.
+        ordering = "relevance" if q else "updated"
+    position = None
+    if cursor:
+        if ordering not in CATALOG_KEYSET_ORDERING:
+            raise HttpError(400, "Cursor pagination is not supported for this ordering.")
+        try:
+            position = decode_catalog_cursor(cursor, ordering)
+        except ValueError as exc:
+            raise HttpError(400, str(exc)) from exc
+    cache_params = (
+        category or "",
+        featured,
+        q or "",
+        min_price,
+        max_price,
+        ordering,
+        position,
+        safe_offset,
+        safe_limit,
+    )
+    page = cached_catalog_read(
+        "api_products", cache_params, lambda: _load_product_page(*cache_params)
+    )
+    if page["next_cursor"]:
+        response["X-Next-Cursor"] = page["next_cursor"]
+    return page["items"]
+
+
+@api.get("/products/facets", response=ProductFacetsOut)
+def product_facets(
+    request,
+    category: str | None = None,
+    q: str | None = None,
+    min_price: int | None = None,
+    max_price: int | None = None,
+    in_stock: bool = False,
+):
+    filters = (category or "", (q or "").strip(), min_price, max_price, in_stock)
+    return cached_catalog_read(
+        "facets", filters + (None,), lambda: compute_facets(*filters)
+    )
 
 
 @api.get("/products/{product_id}", response=ProductOut)
@@ -166,6 +294,17 @@ def get_product(request, product_id: int):
     return _serialize_product(product)
 
 
+@api.get("/search/suggest", response=list[ProductSuggestionOut])
+def suggest_products(request, q: str = "", limit: int = 8):
+    """Autocomplete, from the per-process suggest index when enabled (no DB
+    per keystroke)."""
+    safe_limit = max(1, min(int(limit), 20))
+    return [
+        ProductSuggestionOut(id=product_id, slug=slug, name=name)
+        for product_id, slug, name in product_suggestions(q, safe_limit)
+    ]
+
+
 @api.get("/categories", response=list[CategoryOut])
 def list_categories(request):
     categories = Category.objects.filter(is_active=True).order_by("name")
@@ -182,57 +321,30 @@ def list_categories(request):
 
 @api.post("/checkout", response=OrderOut)
 def create_order(request, payload: CheckoutIn):
-    cart = get_cart_for_request(request)
-    summary = cart_summary(cart)
+    cart = materialize_cart(request)
+    summary = reconcile_cart(cart)
     if not summary["items"]:
         raise HttpError(400, "Cart is empty.")
 
-    with transaction.atomic():
-        user_for_order = request.user if request.user.is_authenticated else None
-        order = Order.objects.create(
-            user=user_for_order,
-            full_name=payload.full_name,
-            email=payload.email,
-            phone=payload.phone,
-            address=payload.address,
-            notes=payload.notes or "",
-            subtotal=summary["subtotal"],
-            amount=summary["subtotal"],
-            currency=summary["currency"],
-            payment_status="pending",
-            payment_method="paystack",
-        )
-        items_out = []
-        for item in cart.items.select_related("product"):
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                unit_price=item.unit_price,
-                currency=item.currency,
-            )
-            items_out.append(
-                OrderItemOut(
-                    product_id=item.product_id,
-                    name=item.product.name,
-                    quantity=item.quantity,
-                    unit_price=int(item.unit_price),
-                    currency=item.currency,
-                    line_total=int(item.line_total),
-                )
-            )
-        cart.items.all().delete()
-        temp_password = None
-        password_reset_url = None
-        is_new_user = False
-        if not request.user.is_authenticated:
-            user_for_order, is_new_user, temp_password, password_reset_url = _get_or_create_user_from_checkout(
-                payload.email,
-                payload.full_name,
-                payload.phone,
+    try:
+        with transaction.atomic():
+            order, is_new_user, temp_password, password_reset_url = create_pending_order(
+                request, payload.dict(), summary
             )
-            order.user = user_for_order
-            order.save(update_fields=["user"])
+            clear_cart(cart)
+    except InsufficientStock as exc:
+        raise HttpError(400, str(exc)) from exc
+    items_out = [
+        OrderItemOut(
+            product_id=line["product_id"],
+            name=line["name"],
+            quantity=line["quantity"],
+            unit_price=line["unit_price"],
+            currency=line["currency"],
+            line_total=line["line_total"],
+        )
+        for line in summary["items"]
+    ]
 
     # Send welcome email for new users or standard order email
     if is_new_user and temp_password:
@@ -256,80 +368,103 @@ def create_order(request, payload: CheckoutIn):
 
 @api.post("/payments/init", response=PaymentInitOut)
 def init_payment(request, payload: CheckoutIn):
-    cart = get_cart_for_request(request)
-    summary = cart_summary(cart)
-    if not summary["items"]:
-        raise HttpError(400, "Cart is empty.")
+    """Create a pending order and start a Paystack transaction.
+
+    Send an ``Idempotency-Key`` header to make retries safe: a replay of a
+    completed request returns the original order and authorization URL, and
+    one that is still running gets a 409.
+    """
+    key = request.headers.get("Idempotency-Key", "").strip()
+    if not key:
+        return _initialize_payment(request, payload)
+    claim = _claim_payment_key(request, key)
+    if claim.response:
+        return PaymentInitOut(**claim.response)
+    try:
+        result = _initialize_payment(request, payload)
+    except Exception:
+        release_idempotency_key(claim)
+        raise
+    complete_idempotency_key(claim, result.order_id, result.dict())
+    return result
+
+
+@api.post("/payments/init-async", response=PaymentInitOut)
+async def init_payment_async(request, payload: CheckoutIn):
+    """``init_payment`` for ASGI deployments.
+
+    The Paystack call is awaited on the event loop; only the ORM work runs
+    in ``sync_to_async``, so a slow gateway does not hold a worker thread.
+    """
+    key = request.headers.get("Idempotency-Key", "").strip()
+    claim = None
+    if key:
+        claim = await sync_to_async(_claim_payment_key)(request, key)
+        if claim.response:
+            return PaymentInitOut(**claim.response)
+    try:
+        pending = await sync_to_async(_prepare_payment)(request, payload)
+        try:
+            payment = await ainitialize_paystack_transaction(**pending["paystack"])
+        except PaystackError as exc:
+            raise await sync_to_async(_payment_failed)(pending, exc) from exc
+        result = await sync_to_async(_payment_started)(pending, payment)
+    except Exception:
+        if claim:
+            await sync_to_async(release_idempotency_key)(claim)
+        raise
+    if claim:
+        await sync_to_async(complete_idempotency_key)(claim, result.order_id, result.dict())
+    return result
+
+
+def _claim_payment_key(request, key):
+    try:
+        return claim_idempotency_key(request, key)
+    except IdempotencyConflict as exc:
+        raise HttpError(409, str(exc)) from exc
 
-    with transaction.atomic():
-        user_for_order = request.user if request.user.is_authenticated else None
-        order = Order.objects.create(
-            user=user_for_order,
-            full_name=payload.full_name,
-            email=payload.email,
-            phone=payload.phone,
-            address=payload.address,
-            notes=payload.notes or "",
-            subtotal=summary["subtotal"],
-            amount=summary["subtotal"],
-            currency=summary["currency"],
-            payment_status="pending",
-            payment_method="paystack",
-        )
-        for item in cart.items.select_related("product"):
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                unit_price=item.unit_price,
-                currency=item.currency,
-            )
-        temp_password = None
-        password_reset_url = None
-        is_new_user = False
-        if not request.user.is_authenticated:
-            user_for_order, is_new_user, temp_password, password_reset_url = _get_or_create_user_from_checkout(
-                payload.email,
-                payload.full_name,
-                payload.phone,
-            )
-            order.user = user_for_order
-            order.save(update_fields=["user"])
 
+def _initialize_payment(request, payload):
+    pending = _prepare_payment(request, payload)
     try:
-        callback_url = get_paystack_callback_url(request)
-        payment = initialize_paystack_transaction(
-            order,
-            payload.email,
-            summary["subtotal"],
-            summary["currency"],
-            callback_url,
-            metadata=build_paystack_metadata(order),
-        )
-        order.payment_reference = payment["reference"]
-        order.save(update_fields=["payment_reference"])
-        
-        # Send welcome email for new users or standard order email
-        if is_new_user and temp_password:
-            send_welcome_new_user_email(
-                order.user,
-                order,
-                temp_password,
-                password_reset_url,
-            )
-        else:
-            send_order_received_email(order)
+        payment = initialize_paystack_transaction(**pending["paystack"])
     except PaystackError as exc:
-        logger.exception("Paystack initialization failed: %s", exc)
-        order.payment_status = "failed"
-        order.save(update_fields=["payment_status"])
-        message = (
-            f"Payment initialization failed: {exc}"
-            if settings.DEBUG
-            else "Payment initialization failed."
+        raise _payment_failed(pending, exc) from exc
+    return _payment_started(pending, payment)
+
+
+def _prepare_payment(request, payload):
+    """Create the pending order and the Paystack initialize arguments."""
+    cart = materialize_cart(request)
+    summary = reconcile_cart(cart)
+    if not summary["items"]:
+        raise HttpError(400, "Cart is empty.")
+
+    try:
+        order, is_new_user, temp_password, password_reset_url = create_pending_order(
+            request, payload.dict(), summary
         )
-        raise HttpError(400, message)
+    except InsufficientStock as exc:
+        raise HttpError(400, str(exc)) from exc
 
+    return {
+        "order": order,
+        "signup": (is_new_user, temp_password, password_reset_url),
+        "paystack": {
+            "order": order,
+            "email": payload.email,
+            "amount": summary["subtotal"],
+            "currency": summary["currency"],
+            "callback_url": get_paystack_callback_url(request),
+            "metadata": build_paystack_metadata(order),
+        },
+    }
+
+
+def _payment_started(pending, payment):
+    order = pending["order"]
+    start_order_payment(order, payment["reference"], *pending["signup"])
     return PaymentInitOut(
         order_id=order.id,
         reference=order.payment_reference,
@@ -337,6 +472,18 @@ def init_payment(request, payload: CheckoutIn):
     )
 
 
+def _payment_failed(pending, exc):
+    """Fail the pending order and return the ``HttpError`` to raise."""
+    logger.error("Paystack initialization failed: %s", exc, exc_info=exc)
+    fail_order_payment(pending["order"])
+    message = (
+        f"Payment initialization failed: {exc}"
+        if settings.DEBUG
+        else "Payment initialization failed."
+    )
+    return HttpError(400, message)
+
+
 @api.post("/payments/initialize", response=PaymentInitOut)
 def init_payment_alias(request, payload: CheckoutIn):
     return init_payment(request, payload)
@@ -358,25 +505,19 @@ def add_to_cart(request, payload: CartItemIn):
 @api.patch("/cart/items/{item_id}", response=CartOut)
 def update_cart_item(request, item_id: int, payload: CartItemUpdate):
     cart = get_cart_for_request(request)
-    item = get_object_or_404(CartItem, id=item_id, cart=cart)
-    if payload.quantity <= 0:
-        item.delete()
-        return _serialize_cart(cart)
-    item.quantity = payload.quantity
-    item.save(update_fields=["quantity", "updated_at"])
+    update_item(cart, item_id, payload.quantity)
     return _serialize_cart(cart)
 
 
 @api.delete("/cart/items/{item_id}", response=CartOut)
 def remove_cart_item(request, item_id: int):
     cart = get_cart_for_request(request)
-    item = get_object_or_404(CartItem, id=item_id, cart=cart)
-    item.delete()
+    remove_item(cart, item_id)
     return _serialize_cart(cart)
 
 
 @api.delete("/cart", response=CartOut)
-def clear_cart(request):
+def clear_cart_items(request):
     cart = get_cart_for_request(request)
-    cart.items.all().delete()
+    clear_cart(cart)
     return _serialize_cart(cart)
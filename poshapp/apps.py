@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PoshappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'poshapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -1,7 +1,18 @@
+from django.conf import settings
 from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
-from poshapp.models import Cart, CartItem, Product
+from poshapp.models import Cart, CartItem, Product, primary_image_path
+from poshapp.pricing import PricingEngine
+
+
+# Session keys for guest carts kept in the session payload (``GUEST_CART_STORAGE
+# = "session"``): product id -> quantity, and the id of a guest ``Cart`` once
+# the lines have been materialized for checkout.
+SESSION_CART_KEY = "cart"
+SESSION_CART_ID_KEY = "cart_id"
 
 
 def ensure_session_key(request):
@@ -11,90 +22,159 @@ def ensure_session_key(request):
     return request.session.session_key
 
 
+class SessionCart:
+    """Guest cart stored in the session instead of ``Cart``/``CartItem`` rows.
+
+    Lines are ``{product_id: quantity}``; the product id doubles as the line
+    id in API responses. Reading an empty cart never touches the database or
+    creates a session.
+    """
+
+    id = None
+
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def lines(self):
+        stored = self.request.session.get(SESSION_CART_KEY) or {}
+        return {int(product_id): quantity for product_id, quantity in stored.items()}
+
+    def save(self, lines):
+        if lines:
+            self.request.session[SESSION_CART_KEY] = {
+                str(product_id): quantity for product_id, quantity in lines.items()
+            }
+        else:
+            self.request.session.pop(SESSION_CART_KEY, None)
+
+
+def _uses_session_storage():
+    return getattr(settings, "GUEST_CART_STORAGE", "db") == "session"
+
+
 def get_cart(request):
     if request.user.is_authenticated:
         cart, _ = Cart.objects.get_or_create(user=request.user)
         return cart
+    if _uses_session_storage():
+        cart_id = request.session.get(SESSION_CART_ID_KEY)
+        if cart_id:
+            cart = Cart.objects.filter(id=cart_id, user=None).first()
+            if cart:
+                return cart
+        return SessionCart(request)
     session_key = ensure_session_key(request)
     cart, _ = Cart.objects.get_or_create(session_key=session_key, user=None)
+    # Login cycles the session key; the id lets the login merge find this cart.
+    if request.session.get(SESSION_CART_ID_KEY) != cart.id:
+        request.session[SESSION_CART_ID_KEY] = cart.id
     return cart
 
 
-def _is_d2pro(product):
-    """Lightweight matcher for D2Pro products when tiers are missing."""
-    slug = (getattr(product, "slug", "") or "").lower()
-    name = (getattr(product, "name", "") or "").lower()
-    return "d2pro" in slug or "d2pro" in name
+@transaction.atomic
+def materialize_cart(request):
+    """Return the request's ``Cart`` row, creating it from session lines.
 
+    Checkout needs real rows to copy into the order; browsing never does.
+    An empty session cart is returned as is.
+    """
+    cart = get_cart(request)
+    if not isinstance(cart, SessionCart):
+        return cart
+    lines = cart.lines
+    if not lines:
+        return cart
+    session_cart = cart
+    cart = Cart.objects.create(session_key=ensure_session_key(request), user=None)
+    products = Product.objects.filter(id__in=list(lines), is_active=True)
+    pricing = PricingEngine(products)
+    items = []
+    for product in products:
+        unit_price = pricing.unit_price(product, lines[product.id])
+        if unit_price is None:
+            continue
+        items.append(
+            CartItem(
+                cart=cart,
+                product=product,
+                quantity=lines[product.id],
+                unit_price=unit_price,
+                currency=product.currency,
+            )
+        )
+    CartItem.objects.bulk_create(items)
+    session_cart.save({})
+    request.session[SESSION_CART_ID_KEY] = cart.id
+    return cart
 
-def price_for_product(product, quantity=None):
-    tiers = product.price_tiers.order_by("min_quantity")
-    if tiers.exists():
-        if quantity:
-            eligible = [tier for tier in tiers if tier.min_quantity <= quantity]
-            if eligible:
-                return eligible[-1].price
-        return tiers.first().price
 
-    if product.price:
-        return product.price
+def _cart_lines(cart):
+    """Return the cart's lines as ``CartItem`` objects with ``product`` set.
 
-    # Fallback tiering for D2Pro when no tiers are configured in DB
-    if _is_d2pro(product):
-        qty = quantity or 1
-        return 280000 if qty >= 20 else 320000
-    return None
+    Session lines are unsaved items whose ``id`` is the product id and whose
+    ``unit_price`` is unset.
+    """
+    if isinstance(cart, SessionCart):
+        lines = cart.lines
+        if not lines:
+            return []
+        products = Product.objects.filter(id__in=list(lines)).annotate(
+            primary_image_path=primary_image_path()
+        )
+        items = []
+        for product in products:
+            item = CartItem(
+                id=product.id,
+                product=product,
+                quantity=lines[product.id],
+                currency=product.currency,
+            )
+            item.primary_image_path = product.primary_image_path
+            items.append(item)
+        position = {product_id: index for index, product_id in enumerate(lines)}
+        return sorted(items, key=lambda item: position[item.product_id])
+    return list(
+        cart.items.select_related("product").annotate(
+            primary_image_path=primary_image_path("product_id")
+        )
+    )
 
 
-def cart_summary(cart):
+def _summarize(cart):
+    """Price ``cart`` without writing.
+
+    Returns ``(summary, drifted, stale)``: the lines whose stored price or
+    currency no longer matches, and the ids of lines that cannot be sold
+    (product gone, inactive or unpriced). Stale lines are left out of the
+    summary.
+    """
     items = []
     subtotal = 0
     currency = "NGN"
-    cart_items = (
-        cart.items.select_related("product")
-        .prefetch_related("product__images")
-        .all()
-    )
+    drifted = []
+    stale = []
+    cart_items = _cart_lines(cart)
+    pricing = PricingEngine(item.product for item in cart_items if item.product)
     for item in cart_items:
         product = item.product
         if not product or not getattr(product, "is_active", True):
-            item.delete()
+            stale.append(item.id)
             continue
-
-        unit_price = price_for_product(product, item.quantity)
-        if unit_price is not None and unit_price != item.unit_price:
-            item.unit_price = unit_price
-            item.currency = item.currency or product.currency
-            item.save(update_fields=["unit_price", "currency", "updated_at"])
+        unit_price = pricing.unit_price(product, item.quantity)
         if unit_price is None:
-            unit_price = price_for_product(product, item.quantity)
-            if unit_price is None:
-                item.delete()
-                continue
+            stale.append(item.id)
+            continue
+        product.primary_image_path = item.primary_image_path
+        line_currency = item.currency or product.currency
+        if unit_price != item.unit_price or line_currency != item.currency:
             item.unit_price = unit_price
-            item.currency = item.currency or product.currency
-            item.save(update_fields=["unit_price", "currency", "updated_at"])
-
-        try:
-            unit_price_value = int(unit_price)
-        except (TypeError, ValueError):
-            fallback_price = price_for_product(product, item.quantity)
-            if fallback_price is None:
-                item.delete()
-                continue
-            item.unit_price = fallback_price
-            item.currency = item.currency or product.currency
-            item.save(update_fields=["unit_price", "currency", "updated_at"])
-            unit_price_value = int(fallback_price)
-
-        raw_line_total = getattr(item, "line_total", None)
-        try:
-            line_total_value = int(raw_line_total)
-        except (TypeError, ValueError):
-            line_total_value = unit_price_value * item.quantity
-
-        image = product.images.first()
-        currency = item.currency or product.currency or currency
+            item.currency = line_currency
+            drifted.append(item)
+
+        unit_price_value = int(unit_price)
+        line_total_value = unit_price_value * item.quantity
+        currency = line_currency or currency
         subtotal += line_total_value
         items.append(
             {
@@ -105,15 +185,42 @@ def cart_summary(cart):
                 "unit_price": unit_price_value,
                 "currency": currency,
                 "line_total": line_total_value,
-                "image": image.image.url if image else None,
+                "image": product.primary_image_url or None,
             }
         )
-    return {
+    summary = {
         "id": cart.id,
         "items": items,
         "subtotal": subtotal,
         "currency": currency,
     }
+    return summary, drifted, stale
+
+
+def cart_summary(cart):
+    """Read-only cart view priced at current prices; see ``reconcile_cart``."""
+    summary, _, _ = _summarize(cart)
+    return summary
+
+
+@transaction.atomic
+def reconcile_cart(cart):
+    """Summarize ``cart`` and persist current prices before an order is made.
+
+    Drifted lines are written with one ``bulk_update`` and stale lines are
+    removed with one ``delete()``.
+    """
+    summary, drifted, stale = _summarize(cart)
+    if isinstance(cart, SessionCart):
+        return summary
+    if drifted:
+        now = timezone.now()
+        for item in drifted:
+            item.updated_at = now
+        CartItem.objects.bulk_update(drifted, ["unit_price", "currency", "updated_at"])
+    if stale:
+        CartItem.objects.filter(id__in=stale).delete()
+    return summary
 
 
 @transaction.atomic
@@ -121,9 +228,15 @@ def add_item(cart, product_id, quantity):
     if quantity < 1:
         raise ValueError("Quantity must be at least 1.")
     product = get_object_or_404(Product, id=product_id, is_active=True)
-    unit_price = price_for_product(product, quantity)
+    pricing = PricingEngine([product])
+    unit_price = pricing.unit_price(product, quantity)
     if unit_price is None:
         raise ValueError("Pricing not available for this product.")
+    if isinstance(cart, SessionCart):
+        lines = cart.lines
+        lines[product.id] = lines.get(product.id, 0) + quantity
+        cart.save(lines)
+        return None
     item, created = CartItem.objects.get_or_create(
         cart=cart,
         product=product,
@@ -135,7 +248,92 @@ def add_item(cart, product_id, quantity):
     )
     if not created:
         item.quantity += quantity
-        item.unit_price = unit_price
+        # Price the whole line so adding units can cross into a cheaper tier.
+        item.unit_price = pricing.unit_price(product, item.quantity)
         item.currency = product.currency
         item.save(update_fields=["quantity", "unit_price", "currency", "updated_at"])
     return item
+
+
+def update_item(cart, item_id, quantity):
+    """Set a line's quantity; zero or less removes it. 404s on unknown lines."""
+    if isinstance(cart, SessionCart):
+        lines = cart.lines
+        if item_id not in lines:
+            raise Http404("No CartItem matches the given query.")
+        if quantity <= 0:
+            del lines[item_id]
+        else:
+            lines[item_id] = quantity
+        cart.save(lines)
+        return
+    item = get_object_or_404(CartItem, id=item_id, cart=cart)
+    if quantity <= 0:
+        item.delete()
+        return
+    item.quantity = quantity
+    item.save(update_fields=["quantity", "updated_at"])
+
+
+def remove_item(cart, item_id):
+    update_item(cart, item_id, 0)
+
+
+def clear_cart(cart):
+    if isinstance(cart, SessionCart):
+        cart.save({})
+        return
+    cart.items.all().delete()
+
+
+@transaction.atomic
+def merge_guest_cart(request, user):
+    """Fold the guest cart (session lines and/or guest ``Cart`` rows) into
+    ``user``'s cart after login.
+
+    Quantities are summed per product, every merged line is re-priced through
+    the tiers for its new quantity, and the result is written with one bulk
+    upsert. The guest cart is deleted in the same transaction.
+    """
+    quantities = SessionCart(request).lines
+    guest_cart = None
+    guest_cart_id = request.session.get(SESSION_CART_ID_KEY)
+    if guest_cart_id:
+        guest_cart = Cart.objects.filter(id=guest_cart_id, user=None).first()
+    if guest_cart:
+        for product_id, quantity in guest_cart.items.values_list("product_id", "quantity"):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    request.session.pop(SESSION_CART_KEY, None)
+    request.session.pop(SESSION_CART_ID_KEY, None)
+    if not quantities:
+        if guest_cart:
+            guest_cart.delete()
+        return
+
+    cart, _ = Cart.objects.get_or_create(user=user)
+    existing = dict(cart.items.values_list("product_id", "quantity"))
+    products = list(Product.objects.filter(id__in=list(quantities), is_active=True))
+    pricing = PricingEngine(products)
+    merged = []
+    for product in products:
+        quantity = existing.get(product.id, 0) + quantities[product.id]
+        unit_price = pricing.unit_price(product, quantity)
+        if unit_price is None:
+            continue
+        merged.append(
+            CartItem(
+                cart=cart,
+                product=product,
+                quantity=quantity,
+                unit_price=unit_price,
+                currency=product.currency,
+            )
+        )
+    CartItem.objects.bulk_create(
+        merged,
+        update_conflicts=True,
+        unique_fields=["cart", "product"],
+        update_fields=["quantity", "unit_price", "currency", "updated_at"],
+    )
+    if guest_cart:
+        guest_cart.delete()
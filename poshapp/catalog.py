@@ -0,0 +1,159 @@
+import hashlib
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+CATALOG_GENERATION_KEY = "catalog:generation"
+# Stock moves on every checkout, so it has its own token: bumping it leaves
+# cached catalog pages and the search index alone and only refreshes the
+# snapshot's stock column. Cached pages may show stale stock for up to
+# ``CATALOG_CACHE_TIMEOUT``; checkout re-checks stock with a guarded UPDATE.
+CATALOG_STOCK_KEY = "catalog:stock"
+
+CATALOG_ORDERING = {
+    "updated": "-updated_at",
+    "updated_asc": "updated_at",
+    "price": "price",
+    "-price": "-price",
+    "name": "name",
+    "-name": "-name",
+}
+
+
+def _get_generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def get_catalog_generation():
+    """Return the current catalog generation token, creating one if missing."""
+    return _get_generation(CATALOG_GENERATION_KEY)
+
+
+def get_stock_generation():
+    """Return the current stock generation token, creating one if missing."""
+    return _get_generation(CATALOG_STOCK_KEY)
+
+
+def bump_catalog_generation():
+    """Invalidate every cached catalog read by moving to a new generation."""
+    cache.set(CATALOG_GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_catalog(**kwargs):
+    """Signal receiver for catalog writes.
+
+    Bumps immediately so the writer sees fresh data, and again on commit so a
+    reader that cached the pre-commit rows in between cannot keep them.
+    """
+    bump_catalog_generation()
+    transaction.on_commit(bump_catalog_generation)
+
+
+def bump_stock_generation():
+    cache.set(CATALOG_STOCK_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_stock():
+    """Like ``invalidate_catalog`` but for stock-only writes (checkout)."""
+    bump_stock_generation()
+    transaction.on_commit(bump_stock_generation)
+
+
+def catalog_cache_key(namespace, params):
+    digest = hashlib.md5(repr(params).encode("utf-8")).hexdigest()
+    return f"catalog:{get_catalog_generation()}:{namespace}:{digest}"
+
+
+def cached_catalog_read(namespace, params, builder):
+    """Return ``builder()`` cached under the normalized ``params`` tuple.
+
+    ``params`` must be a hashable tuple of already-normalized filter values so
+    equivalent requests share one entry. Set ``CATALOG_CACHE_TIMEOUT`` to 0 to
+    bypass the cache entirely.
+    """
+    timeout = getattr(settings, "CATALOG_CACHE_TIMEOUT", 0)
+    if not timeout:
+        return builder()
+    key = catalog_cache_key(namespace, params)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    value = builder()
+    cache.set(key, value, timeout)
+    return value
+
+
+# Orderings that support keyset (cursor) pagination: key -> (field, descending).
+# ``id`` is always the tiebreaker and NULL prices sort last in both directions.
+CATALOG_KEYSET_ORDERING = {
+    "updated": ("updated_at", True),
+    "updated_asc": ("updated_at", False),
+    "price": ("price", False),
+    "-price": ("price", True),
+}
+CATALOG_CURSOR_SALT = "poshapp.catalog.cursor"
+
+
+def keyset_order_by(ordering):
+    field, descending = CATALOG_KEYSET_ORDERING[ordering]
+    if descending:
+        return [F(field).desc(nulls_last=True), F("id").desc()]
+    return [F(field).asc(nulls_last=True), F("id").asc()]
+
+
+def keyset_filter(ordering, value, last_id):
+    """Return a Q matching rows strictly after ``(value, last_id)``."""
+    field, descending = CATALOG_KEYSET_ORDERING[ordering]
+    beyond = "lt" if descending else "gt"
+    if value is None:
+        return Q(**{f"{field}__isnull": True, f"id__{beyond}": last_id})
+    return (
+        Q(**{f"{field}__{beyond}": value})
+        | Q(**{field: value, f"id__{beyond}": last_id})
+        | Q(**{f"{field}__isnull": True})
+    )
+
+
+def encode_catalog_cursor(ordering, product):
+    field, _ = CATALOG_KEYSET_ORDERING[ordering]
+    value = getattr(product, field)
+    if value is not None:
+        value = value.isoformat() if field == "updated_at" else str(value)
+    return signing.dumps([ordering, value, product.id], salt=CATALOG_CURSOR_SALT)
+
+
+def decode_catalog_cursor(cursor, ordering):
+    """Return the ``(value, id)`` position encoded in ``cursor``.
+
+    Raises ``ValueError`` when the cursor is malformed, tampered with or was
+    issued for a different ordering.
+    """
+    try:
+        cursor_ordering, value, last_id = signing.loads(
+            cursor, salt=CATALOG_CURSOR_SALT
+        )
+    except (signing.BadSignature, TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor.") from exc
+    if cursor_ordering != ordering or not isinstance(last_id, int):
+        raise ValueError("Cursor does not match the requested ordering.")
+    field, _ = CATALOG_KEYSET_ORDERING[ordering]
+    if value is not None:
+        try:
+            value = (
+                parse_datetime(value) if field == "updated_at" else Decimal(value)
+            )
+        except (TypeError, ValueError, InvalidOperation) as exc:
+            raise ValueError("Invalid cursor.") from exc
+        if value is None:
+            raise ValueError("Invalid cursor.")
+    return value, last_id
@@ -0,0 +1,246 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.db import transaction
+from django.db.models import Case, F, TextField, Value, When
+from django.db.models.functions import Concat
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from poshapp.catalog import invalidate_stock
+from poshapp.emails import send_order_received_email, send_welcome_new_user_email
+from poshapp.models import Order, OrderItem, Product, User
+
+logger = logging.getLogger(__name__)
+
+# Paystack transaction statuses that mean the charge will never succeed, and
+# the one for a customer who left the payment page. Anything else but
+# "success" (ongoing, pending, processing, queued) may still settle.
+FAILED_STATUSES = {"failed", "reversed"}
+EXPIRED_STATUSES = {"abandoned"}
+
+LATE_PAYMENT_NOTE = (
+    "Paystack reported a successful charge after this order was closed and its "
+    "stock released. Refund the customer or re-reserve stock and fulfil manually."
+)
+
+
+class InsufficientStock(Exception):
+    """Raised when a checkout line asks for more units than are in stock."""
+
+    def __init__(self, product_name):
+        super().__init__(f"Not enough stock left for {product_name}.")
+        self.product_name = product_name
+
+
+def reserve_stock(lines):
+    """Take each line's quantity out of stock with a conditional UPDATE.
+
+    No row is locked up front: the ``stock_quantity >= n`` guard makes each
+    decrement atomic, and a zero row count means another checkout got there
+    first. A product that is out of stock is sold as a pre-order, as the
+    storefront offers: its line reserves nothing. Must run inside the
+    order's transaction so a shortage rolls the whole order back. Products
+    are updated in id order to avoid deadlocks. Returns the ids of the
+    pre-order products.
+    """
+    preorders = set()
+    for line in sorted(lines, key=lambda line: line["product_id"]):
+        reserved = Product.objects.filter(
+            id=line["product_id"], stock_quantity__gte=line["quantity"]
+        ).update(stock_quantity=F("stock_quantity") - line["quantity"])
+        if reserved:
+            continue
+        if Product.objects.filter(id=line["product_id"], stock_quantity__lte=0).exists():
+            preorders.add(line["product_id"])
+            continue
+        raise InsufficientStock(line["name"])
+    invalidate_stock()
+    return preorders
+
+
+def release_order_stock(order):
+    """Return a pending order's reserved stock. Safe to call repeatedly."""
+    with transaction.atomic():
+        released = Order.objects.filter(id=order.id, stock_reserved=True).update(
+            stock_reserved=False
+        )
+        if not released:
+            return False
+        reserved_items = order.items.filter(is_preorder=False)
+        for product_id, quantity in reserved_items.values_list("product_id", "quantity"):
+            Product.objects.filter(id=product_id).update(
+                stock_quantity=F("stock_quantity") + quantity
+            )
+        invalidate_stock()
+    order.stock_reserved = False
+    return True
+
+
+def fail_order_payment(order):
+    """Mark a still-pending ``order`` as failed and give its reserved stock
+    back. Returns False if the order had already left ``pending``."""
+    return close_pending_order(order, "failed")
+
+
+def close_pending_order(order, payment_status):
+    """Move a still-pending ``order`` to ``payment_status`` and release its
+    stock. Returns False if the order had already left ``pending``."""
+    closed = Order.objects.filter(id=order.id, payment_status="pending").update(
+        payment_status=payment_status, updated_at=timezone.now()
+    )
+    if not closed:
+        return False
+    order.payment_status = payment_status
+    release_order_stock(order)
+    return True
+
+
+def mark_order_paid(reference, data):
+    """Record a successful Paystack charge (``data`` from verify or webhook)
+    for the order with payment ``reference``.
+
+    The transition is one conditional UPDATE on the indexed reference, so
+    when the callback, the webhook and the sweeper race only one of them
+    sees a row change. Returns True for that caller alone; it is the one
+    that should send the confirmation email.
+
+    Only ``pending`` orders move to ``paid``: an expired or failed order has
+    already given its stock back, so a late success is flagged for staff
+    through ``internal_note`` instead.
+    """
+    if not reference:
+        return False
+    now = timezone.now()
+    updates = {
+        "payment_status": "paid",
+        "paid_at": now,
+        "updated_at": now,
+        "status": Case(When(status="new", then=Value("processing")), default=F("status")),
+        "payment_method": Case(
+            When(payment_method="", then=Value("paystack")), default=F("payment_method")
+        ),
+    }
+    amount_kobo = int(data.get("amount") or 0)
+    if amount_kobo:
+        updates["amount"] = amount_kobo // 100
+    if data.get("currency"):
+        updates["currency"] = data["currency"]
+    orders = Order.objects.filter(payment_reference=reference)
+    if orders.filter(payment_status="pending").update(**updates):
+        return True
+    flagged = (
+        orders.exclude(payment_status__in=["pending", "paid"])
+        .exclude(internal_note__contains=LATE_PAYMENT_NOTE)
+        .update(
+            internal_note=Case(
+                When(internal_note="", then=Value(LATE_PAYMENT_NOTE)),
+                default=Concat(F("internal_note"), Value("\n" + LATE_PAYMENT_NOTE)),
+                output_field=TextField(),
+            ),
+            updated_at=now,
+        )
+    )
+    if flagged:
+        logger.warning("Late Paystack success for closed order with reference %s", reference)
+    return False
+
+
+def start_order_payment(order, reference, is_new_user, temp_password, password_reset_url):
+    """Store the Paystack ``reference`` on ``order`` and send the order email:
+    the welcome email (with login details) for a new account, the standard
+    order-received email otherwise."""
+    order.payment_reference = reference
+    order.save(update_fields=["payment_reference"])
+    if is_new_user and temp_password:
+        send_welcome_new_user_email(order.user, order, temp_password, password_reset_url)
+    else:
+        send_order_received_email(order)
+
+
+def get_or_create_checkout_user(email, full_name, phone):
+    """
+    Get existing user by email or create a new one.
+    Returns (user, is_new_user, temp_password, password_reset_url)
+    """
+    user = User.objects.filter(email__iexact=email).first()
+    if user:
+        return user, False, None, None
+
+    # Create new user using email as username (consistent with signup form)
+    username = email
+
+    # Parse full name into first and last
+    name_parts = full_name.strip().split(maxsplit=1)
+    first_name = name_parts[0] if name_parts else ""
+    last_name = name_parts[1] if len(name_parts) > 1 else ""
+
+    temp_password = get_random_string(length=12)
+    user = User.objects.create_user(
+        username=username,
+        email=email,
+        first_name=first_name,
+        last_name=last_name,
+        phone_number=phone,
+        password=temp_password,
+    )
+
+    uid = urlsafe_base64_encode(force_bytes(user.pk))
+    token = default_token_generator.make_token(user)
+    password_reset_url = f"{settings.SITE_URL}/accounts/reset/{uid}/{token}/"
+
+    return user, True, temp_password, password_reset_url
+
+
+def create_pending_order(request, customer, summary):
+    """Create a pending Paystack order from an already-priced cart summary.
+
+    ``customer`` holds the checkout fields (full_name, email, phone, address,
+    notes). Order lines are copied from ``summary["items"]`` with a single
+    ``bulk_create``; guests get an account matched or created by email.
+    Stock for every line is reserved first (out-of-stock products become
+    pre-order lines); ``InsufficientStock`` aborts the whole order. Returns (order, is_new_user, temp_password,
+    password_reset_url).
+    """
+    with transaction.atomic():
+        preorders = reserve_stock(summary["items"])
+        temp_password = None
+        password_reset_url = None
+        is_new_user = False
+        if request.user.is_authenticated:
+            user_for_order = request.user
+        else:
+            user_for_order, is_new_user, temp_password, password_reset_url = (
+                get_or_create_checkout_user(
+                    customer["email"], customer["full_name"], customer["phone"]
+                )
+            )
+        order = Order.objects.create(
+            user=user_for_order,
+            full_name=customer["full_name"],
+            email=customer["email"],
+            phone=customer["phone"],
+            address=customer["address"],
+            notes=customer.get("notes") or "",
+            subtotal=summary["subtotal"],
+            amount=summary["subtotal"],
+            currency=summary["currency"],
+            payment_status="pending",
+            payment_method="paystack",
+            stock_reserved=True,
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product_id=line["product_id"],
+                quantity=line["quantity"],
+                unit_price=line["unit_price"],
+                currency=line["currency"],
+                is_preorder=line["product_id"] in preorders,
+            )
+            for line in summary["items"]
+        )
+    return order, is_new_user, temp_password, password_reset_url
@@ -1,5 +1,11 @@
 from django.conf import settings
+from django.urls import reverse
 
 
 def static_asset_version(request):
     return {"STATIC_ASSET_VERSION": settings.STATIC_ASSET_VERSION}
+
+
+def payment_initialize_url(request):
+    name = "payment_initialize_async" if settings.PAYMENT_INIT_ASYNC else "payment_initialize"
+    return {"PAYMENT_INITIALIZE_URL": reverse(name)}
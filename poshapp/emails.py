@@ -1,37 +1,253 @@
+import logging
+from datetime import timedelta
+
 from django.conf import settings
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.core.mail import EmailMultiAlternatives, get_connection, send_mail
+from django.db import transaction
+from django.template import Context
+from django.template.loader import get_template
 from django.utils import timezone
 
+from .models import EmailOutbox, Order
+
+logger = logging.getLogger(__name__)
+
+
+def render_email(name, context):
+    """Render ``emails/<name>.txt`` and ``emails/<name>.html``.
+
+    The text part is rendered without autoescaping so names with ``&`` or
+    quotes come out as typed. Returns ``(text, html)``.
+    """
+    text = get_template(f"emails/{name}.txt").template.render(
+        Context(context, autoescape=False)
+    )
+    html = get_template(f"emails/{name}.html").render(context)
+    return text.strip(), html
+
+
+def order_email_context(order, items=None, **extra):
+    """Context for the order emails, with the order lines loaded once.
+
+    ``items`` defaults to ``order.items.all()``, which reuses the lines when
+    the order came from ``prefetch_related("items__product")``. Callers
+    without a prefetch should pass ``order.items.select_related("product")``
+    to fetch the lines and products in one query. Both email parts then
+    share the list.
+    """
+    if items is None:
+        items = order.items.all()
+    return {"order": order, "items": list(items), "site_url": settings.SITE_URL, **extra}
 
-def _send_email(subject, template_name, context, recipient):
+
+def _send_email(subject, name, context, recipient, order=None):
+    """Render an email and queue it in ``EmailOutbox`` for ``send_outbox``.
+
+    With ``EMAIL_OUTBOX`` off the message is sent inline instead. Returns
+    whether the email was queued (or sent).
+    """
     try:
-        body = render_to_string(template_name, context).strip()
-        send_mail(
-            subject,
-            body,
-            settings.DEFAULT_FROM_EMAIL,
-            [recipient],
-            fail_silently=False,
-        )
+        body, html_body = render_email(name, context)
+        if settings.EMAIL_OUTBOX:
+            EmailOutbox.objects.create(
+                order=order,
+                subject=subject,
+                body=body,
+                html_body=html_body,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                recipient=recipient,
+            )
+        else:
+            send_mail(
+                subject,
+                body,
+                settings.DEFAULT_FROM_EMAIL,
+                [recipient],
+                fail_silently=False,
+                html_message=html_body,
+            )
         return True
     except Exception:
+        logger.exception("Could not send %r to %s", subject, recipient)
         return False
 
 
+def deliver_outbox(batch_size=50, max_attempts=5, backoff=60):
+    """Send one batch of due ``EmailOutbox`` rows over a single connection.
+
+    Rows are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the
+    database supports it, so several workers can share the queue. A failed
+    row is retried after ``backoff * 2 ** (attempts - 1)`` seconds and is
+    marked failed after ``max_attempts``. A sent row keeps only its
+    headers: the bodies are cleared because some (the welcome email) carry a
+    temporary password and reset link. Returns the claimed rows.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            EmailOutbox.objects.filter(status="pending", next_attempt_at__lte=now)
+            .select_for_update(skip_locked=True)
+            .order_by("id")[:batch_size]
+        )
+        if not rows:
+            return rows
+        try:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+        except Exception as exc:
+            for row in rows:
+                _record_failure(row, exc, max_attempts, backoff, now)
+        else:
+            try:
+                for row in rows:
+                    message = EmailMultiAlternatives(
+                        row.subject,
+                        row.body,
+                        row.from_email,
+                        [row.recipient],
+                        connection=connection,
+                    )
+                    if row.html_body:
+                        message.attach_alternative(row.html_body, "text/html")
+                    try:
+                        connection.send_messages([message])
+                    except Exception as exc:
+                        _record_failure(row, exc, max_attempts, backoff, now)
+                    else:
+                        row.status = "sent"
+                        row.sent_at = timezone.now()
+                        row.last_error = ""
+                        row.body = row.html_body = ""
+            finally:
+                connection.close()
+        EmailOutbox.objects.bulk_update(
+            rows,
+            ["status", "attempts", "last_error", "next_attempt_at", "sent_at", "body", "html_body"],
+        )
+    return rows
+
+
+def purge_outbox(days=30):
+    """Delete sent and failed ``EmailOutbox`` rows older than ``days``.
+
+    Returns how many rows went.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = EmailOutbox.objects.filter(
+        status__in=["sent", "failed"], created_at__lt=cutoff
+    ).delete()
+    return deleted
+
+
+def _record_failure(row, exc, max_attempts, backoff, now):
+    row.attempts += 1
+    row.last_error = str(exc) or exc.__class__.__name__
+    if row.attempts >= max_attempts:
+        row.status = "failed"
+    else:
+        row.next_attempt_at = now + timedelta(seconds=backoff * 2 ** (row.attempts - 1))
+
+
+# Emails staff can resend, with their subject, the Order field that records
+# when they went out and the payment_status an order needs (None for any).
+RESENDABLE_EMAILS = {
+    "order_received": ("Order #{id} received", "confirmation_sent_at", None),
+    "order_paid": (
+        "Payment confirmed for order #{id}",
+        "payment_confirmation_sent_at",
+        "paid",
+    ),
+}
+
+
+def resend_order_emails(orders, name="order_received"):
+    """Send the ``name`` email again for every order in ``orders``.
+
+    Orders should come with ``items__product`` prefetched. Messages are
+    queued with one ``bulk_create`` (or, with ``EMAIL_OUTBOX`` off, sent
+    over one SMTP connection). Returns ``{order_id: {"status": ...}}`` with
+    ``queued``, ``sent`` or ``failed`` (plus ``error``) per order, or
+    ``skipped`` for an order whose payment status does not fit the email.
+    """
+    subject_template, sent_field, payment_status = RESENDABLE_EMAILS[name]
+    results = {}
+    messages = []
+    for order in orders:
+        if payment_status and order.payment_status != payment_status:
+            results[order.id] = {
+                "status": "skipped",
+                "error": f"Order payment status is {order.payment_status}.",
+            }
+            continue
+        try:
+            body, html_body = render_email(name, order_email_context(order))
+        except Exception as exc:
+            logger.exception("Could not render %s for order #%s", name, order.id)
+            results[order.id] = {"status": "failed", "error": str(exc)}
+            continue
+        messages.append((order, subject_template.format(id=order.id), body, html_body))
+
+    if settings.EMAIL_OUTBOX:
+        EmailOutbox.objects.bulk_create(
+            EmailOutbox(
+                order=order,
+                subject=subject,
+                body=body,
+                html_body=html_body,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                recipient=order.email,
+            )
+            for order, subject, body, html_body in messages
+        )
+        for order, *_ in messages:
+            results[order.id] = {"status": "queued"}
+    elif messages:
+        try:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+        except Exception as exc:
+            logger.exception("Could not open the email connection")
+            for order, *_ in messages:
+                results[order.id] = {"status": "failed", "error": str(exc)}
+        else:
+            try:
+                for order, subject, body, html_body in messages:
+                    message = EmailMultiAlternatives(
+                        subject,
+                        body,
+                        settings.DEFAULT_FROM_EMAIL,
+                        [order.email],
+                        connection=connection,
+                    )
+                    message.attach_alternative(html_body, "text/html")
+                    try:
+                        connection.send_messages([message])
+                    except Exception as exc:
+                        results[order.id] = {"status": "failed", "error": str(exc)}
+                    else:
+                        results[order.id] = {"status": "sent"}
+            finally:
+                connection.close()
+
+    delivered = [
+        order_id
+        for order_id, result in results.items()
+        if result["status"] in {"queued", "sent"}
+    ]
+    if delivered:
+        Order.objects.filter(id__in=delivered).update(**{sent_field: timezone.now()})
+    return results
+
+
 def send_order_received_email(order):
     if order.confirmation_sent_at:
         return False
-    context = {
-        "order": order,
-        "items": order.items.select_related("product"),
-        "site_url": settings.SITE_URL,
-    }
     sent = _send_email(
         f"Order #{order.id} received",
-        "emails/order_received.txt",
-        context,
+        "order_received",
+        order_email_context(order, order.items.select_related("product")),
         order.email,
+        order=order,
     )
     if sent:
         order.confirmation_sent_at = timezone.now()
@@ -42,16 +258,12 @@ def send_order_received_email(order):
 def send_payment_confirmed_email(order):
     if order.payment_confirmation_sent_at:
         return False
-    context = {
-        "order": order,
-        "items": order.items.select_related("product"),
-        "site_url": settings.SITE_URL,
-    }
     sent = _send_email(
         f"Payment confirmed for order #{order.id}",
-        "emails/order_paid.txt",
-        context,
+        "order_paid",
+        order_email_context(order, order.items.select_related("product")),
         order.email,
+        order=order,
     )
     if sent:
         order.payment_confirmation_sent_at = timezone.now()
@@ -61,19 +273,19 @@ def send_payment_confirmed_email(order):
 
 def send_welcome_new_user_email(user, order, temp_password, password_reset_url):
     """Send welcome email to auto-created users with temporary password and reset link."""
-    context = {
-        "user": user,
-        "order": order,
-        "items": order.items.select_related("product"),
-        "site_url": settings.SITE_URL,
-        "temp_password": temp_password,
-        "password_reset_url": password_reset_url,
-    }
+    context = order_email_context(
+        order,
+        order.items.select_related("product"),
+        user=user,
+        temp_password=temp_password,
+        password_reset_url=password_reset_url,
+    )
     sent = _send_email(
         f"Welcome to PoshPearl - Order #{order.id} Received",
-        "emails/welcome_new_user.txt",
+        "welcome_new_user",
         context,
         user.email,
+        order=order,
     )
     if sent:
         order.confirmation_sent_at = timezone.now()
@@ -0,0 +1,87 @@
+from django.db.models import Count, Q
+
+from .models import Category, Product
+from .search import search_products
+
+# Upper bounds of the shop price histogram buckets; the last bucket is open.
+FACET_PRICE_EDGES = (100000, 200000, 300000, 400000, 500000)
+
+
+def price_buckets():
+    lower = 0
+    for upper in FACET_PRICE_EDGES:
+        yield lower, upper
+        lower = upper
+    yield lower, None
+
+
+def _price_range_q(low, high):
+    condition = Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+def compute_facets(category_slug, query, min_price, max_price, in_stock, exclude_id=None):
+    """Count active products per category, price bucket and availability.
+
+    Each facet is counted under every *other* active filter, so picking a
+    category still shows how many products the sibling categories hold. All
+    counts come from one conditional-aggregation query.
+    """
+    base = Product.objects.filter(is_active=True)
+    if exclude_id:
+        base = base.exclude(id=exclude_id)
+    if query:
+        base = base.filter(
+            id__in=search_products(Product.objects.all(), query).values("id")
+        )
+
+    category_q = Q(categories__slug=category_slug) if category_slug else Q()
+    price_q = Q()
+    if min_price is not None:
+        price_q &= Q(price__gte=min_price)
+    if max_price is not None:
+        price_q &= Q(price__lte=max_price)
+    stock_q = Q(stock_quantity__gt=0) if in_stock else Q()
+
+    categories = list(Category.objects.filter(is_active=True).order_by("name"))
+    buckets = list(price_buckets())
+    aggregates = {
+        "total": Count("id", distinct=True, filter=category_q & price_q & stock_q),
+        "all_categories": Count("id", distinct=True, filter=price_q & stock_q),
+        "in_stock": Count(
+            "id", distinct=True, filter=Q(stock_quantity__gt=0) & category_q & price_q
+        ),
+    }
+    for category in categories:
+        aggregates[f"category_{category.id}"] = Count(
+            "id",
+            distinct=True,
+            filter=Q(categories__id=category.id) & price_q & stock_q,
+        )
+    for index, (low, high) in enumerate(buckets):
+        aggregates[f"bucket_{index}"] = Count(
+            "id",
+            distinct=True,
+            filter=_price_range_q(low, high) & category_q & stock_q,
+        )
+    counts = base.aggregate(**aggregates)
+
+    return {
+        "total": counts["total"],
+        "all_categories": counts["all_categories"],
+        "in_stock": counts["in_stock"],
+        "categories": [
+            {
+                "slug": category.slug,
+                "name": category.name,
+                "count": counts[f"category_{category.id}"],
+            }
+            for category in categories
+        ],
+        "price_buckets": [
+            {"min": low, "max": high, "count": counts[f"bucket_{index}"]}
+            for index, (low, high) in enumerate(buckets)
+        ],
+    }
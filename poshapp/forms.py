@@ -4,6 +4,7 @@ from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 
 import re
+import uuid
 
 
 class CheckoutForm(forms.Form):
@@ -25,6 +26,13 @@ class CheckoutForm(forms.Form):
         required=False,
         widget=forms.Textarea(attrs={"rows": 3, "class": "pp-textarea", "placeholder": "Order notes (optional)"}),
     )
+    # Fresh per rendered form so a double submit replays the first attempt.
+    idempotency_key = forms.CharField(
+        required=False,
+        max_length=64,
+        widget=forms.HiddenInput,
+        initial=lambda: uuid.uuid4().hex,
+    )
 
     def clean_phone(self):
         value = self.cleaned_data.get("phone", "")
@@ -0,0 +1,73 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from poshapp.cart import ensure_session_key
+from poshapp.models import IdempotencyKey
+
+
+class IdempotencyConflict(Exception):
+    """Raised when the same key is still being processed by another request."""
+
+
+def _scoped_key(request, key):
+    if request.user.is_authenticated:
+        scope = f"user:{request.user.pk}"
+    else:
+        scope = f"session:{ensure_session_key(request)}"
+    return hashlib.sha256(f"{scope}:{key}".encode("utf-8")).hexdigest()
+
+
+def _expired_claims():
+    now = timezone.now()
+    ttl = getattr(settings, "IDEMPOTENCY_KEY_TTL", 86400)
+    lease = getattr(settings, "IDEMPOTENCY_LEASE_SECONDS", 300)
+    # An in-flight claim has no response yet.
+    return Q(created_at__lt=now - timedelta(seconds=ttl)) | Q(
+        response={}, created_at__lt=now - timedelta(seconds=lease)
+    )
+
+
+def claim_idempotency_key(request, key):
+    """Claim ``key`` for this client, or return the finished earlier claim.
+
+    The unique constraint on ``IdempotencyKey.key`` decides the race: the
+    first request inserts the row, replays find it. A replay whose original
+    has a stored ``response`` should return it; one whose original is still
+    running raises ``IdempotencyConflict``. An unfinished claim older than
+    ``IDEMPOTENCY_LEASE_SECONDS`` belongs to a request that died, and a
+    finished one older than ``IDEMPOTENCY_KEY_TTL`` has been replayed long
+    enough; either is discarded and the key starts over.
+    """
+    scoped = _scoped_key(request, key)
+    IdempotencyKey.objects.filter(_expired_claims(), key=scoped).delete()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=scoped)
+    except IntegrityError:
+        claim = IdempotencyKey.objects.filter(key=scoped).first()
+        if claim is None or not claim.response:
+            raise IdempotencyConflict("This checkout request is already in progress.")
+        return claim
+
+
+def complete_idempotency_key(claim, order_id, response):
+    """Store the finished request's ``response`` for replays."""
+    claim.order_id = order_id
+    claim.response = response
+    claim.save(update_fields=["order", "response"])
+
+
+def release_idempotency_key(claim):
+    """Forget a claim whose request failed so the client can retry it."""
+    claim.delete()
+
+
+def purge_idempotency_keys():
+    """Delete every expired claim; returns how many rows went."""
+    deleted, _ = IdempotencyKey.objects.filter(_expired_claims()).delete()
+    return deleted
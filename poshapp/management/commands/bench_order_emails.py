@@ -0,0 +1,92 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+
+from poshapp.emails import order_email_context, render_email
+from poshapp.models import Order, OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Render order emails (text + HTML) for in-memory orders and report the "
+        "per-message cost. Nothing is written to the database or sent."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=1000,
+            help="Emails to render (default: 1000).",
+        )
+        parser.add_argument(
+            "--lines",
+            type=int,
+            default=5,
+            help="Order lines per email (default: 5).",
+        )
+        parser.add_argument(
+            "--template",
+            default="order_paid",
+            choices=["order_received", "order_paid"],
+            help="Email to render (default: order_paid).",
+        )
+
+    def handle(self, *args, **options):
+        count = options["count"]
+        if count < 1:
+            raise CommandError("--count must be at least 1.")
+        contexts = [
+            order_email_context(*self._order(index, options["lines"]))
+            for index in range(count)
+        ]
+        name = options["template"]
+
+        # Warm the template caches so the timings measure steady state.
+        render_email(name, contexts[0])
+
+        started = time.perf_counter()
+        for context in contexts:
+            render_email(name, context)
+        multipart = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for context in contexts:
+            render_to_string(f"emails/{name}.txt", context)
+        text_only = time.perf_counter() - started
+
+        self.stdout.write(
+            f"Rendered {count} {name} emails ({options['lines']} lines each):"
+        )
+        self.stdout.write(
+            f"  text + html: {multipart:.3f}s total, {multipart / count * 1e6:.0f}us per email"
+        )
+        self.stdout.write(
+            f"  text via render_to_string: {text_only:.3f}s total, "
+            f"{text_only / count * 1e6:.0f}us per email"
+        )
+
+    @staticmethod
+    def _order(index, lines):
+        order = Order(
+            id=index + 1,
+            full_name=f"Bench Buyer {index}",
+            email=f"bench{index}@example.com",
+            address="12 Admiralty Way, Lekki, Lagos",
+            subtotal=Decimal(280000 * lines),
+            amount=Decimal(280000 * lines),
+            payment_status="paid",
+        )
+        items = [
+            OrderItem(
+                id=line + 1,
+                order=order,
+                product=Product(id=line + 1, name=f"Smart Lock {line}", price=280000),
+                quantity=line + 1,
+                unit_price=Decimal(280000),
+            )
+            for line in range(lines)
+        ]
+        return order, items
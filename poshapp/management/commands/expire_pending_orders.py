@@ -0,0 +1,101 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from poshapp.checkout import (
+    EXPIRED_STATUSES,
+    FAILED_STATUSES,
+    close_pending_order,
+    mark_order_paid,
+)
+from poshapp.emails import send_payment_confirmed_email
+from poshapp.models import Order
+from poshapp.payments import PaystackError, verify_paystack_transaction
+
+# Verify answers an unknown reference with one of these.
+UNKNOWN_REFERENCE_STATUSES = {400, 404}
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-verify pending orders older than a TTL with Paystack and mark them "
+        "paid, failed or expired, releasing reserved stock."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--minutes",
+            type=int,
+            default=60,
+            help="Only sweep orders pending for longer than this (default: 60).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Orders loaded per batch (default: 100).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report how many orders would be swept without contacting Paystack.",
+        )
+
+    def handle(self, *args, **options):
+        minutes = options["minutes"]
+        batch_size = options["batch_size"]
+        if minutes < 1:
+            raise CommandError("--minutes must be at least 1.")
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        cutoff = timezone.now() - timedelta(minutes=minutes)
+        # Served by the (payment_status, created_at) index.
+        pending = Order.objects.filter(payment_status="pending", created_at__lt=cutoff)
+        order_ids = list(pending.order_by("created_at", "id").values_list("id", flat=True))
+        if options["dry_run"]:
+            self.stdout.write(f"Would sweep {len(order_ids)} pending orders.")
+            return
+
+        counts = {"paid": 0, "failed": 0, "expired": 0, "skipped": 0}
+        for start in range(0, len(order_ids), batch_size):
+            batch = pending.filter(id__in=order_ids[start : start + batch_size])
+            for order in batch.order_by("created_at", "id"):
+                counts[self._sweep(order)] += 1
+            self.stdout.write(f"Swept {min(start + batch_size, len(order_ids))} orders...")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Paid {paid}, failed {failed}, expired {expired}, skipped {skipped}.".format(
+                    **counts
+                )
+            )
+        )
+
+    def _sweep(self, order):
+        if not order.payment_reference:
+            # Never reached Paystack.
+            return "expired" if close_pending_order(order, "expired") else "skipped"
+        try:
+            data = verify_paystack_transaction(order.payment_reference).get("data") or {}
+        except PaystackError as exc:
+            if exc.status_code in UNKNOWN_REFERENCE_STATUSES:
+                # Paystack never saw this reference.
+                return "expired" if close_pending_order(order, "expired") else "skipped"
+            self.stderr.write(f"Order #{order.id}: verification failed: {exc}")
+            return "skipped"
+        status = data.get("status")
+        if status == "success":
+            if not mark_order_paid(order.payment_reference, data):
+                return "skipped"
+            order.refresh_from_db()
+            send_payment_confirmed_email(order)
+            return "paid"
+        if status in FAILED_STATUSES:
+            return "failed" if close_pending_order(order, "failed") else "skipped"
+        if status in EXPIRED_STATUSES:
+            return "expired" if close_pending_order(order, "expired") else "skipped"
+        # ongoing, pending, processing, queued: the charge may still land, so
+        # leave the order pending for a later sweep.
+        return "skipped"
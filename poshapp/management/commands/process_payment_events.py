@@ -0,0 +1,82 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from poshapp.models import PaymentEvent
+from poshapp.webhooks import process_payment_events
+
+
+class Command(BaseCommand):
+    help = "Apply pending Paystack webhook events from the PaymentEvent inbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Events claimed per transaction (default: 100).",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Mark an event failed after this many errors (default: 5).",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Move failed events back to pending before draining.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep draining, sleeping --interval seconds when the inbox is empty.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to sleep between drains with --loop (default: 5).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_attempts = options["max_attempts"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if max_attempts < 1:
+            raise CommandError("--max-attempts must be at least 1.")
+
+        if options["retry_failed"]:
+            retried = PaymentEvent.objects.filter(status="failed").update(
+                status="pending", attempts=0
+            )
+            self.stdout.write(f"Requeued {retried} failed events.")
+
+        while True:
+            self._drain(batch_size, max_attempts)
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def _drain(self, batch_size, max_attempts):
+        counts = {"processed": 0, "pending": 0, "failed": 0}
+        last_id = 0
+        while True:
+            events, last_id = process_payment_events(batch_size, max_attempts, last_id)
+            if not events:
+                break
+            for payment_event in events:
+                counts[payment_event.status] += 1
+                if payment_event.status != "processed":
+                    self.stderr.write(
+                        f"Event #{payment_event.id} ({payment_event}): {payment_event.last_error}"
+                    )
+        if any(counts.values()):
+            self.stdout.write(
+                self.style.SUCCESS(
+                    "Processed {processed}, will retry {pending}, failed {failed}.".format(
+                        **counts
+                    )
+                )
+            )
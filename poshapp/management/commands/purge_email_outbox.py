@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from poshapp.emails import purge_outbox
+
+
+class Command(BaseCommand):
+    help = "Delete sent and failed EmailOutbox messages older than a number of days."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="Purge sent and failed messages older than this many days (default: 30).",
+        )
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        if days < 1:
+            raise CommandError("--days must be at least 1.")
+        purged = purge_outbox(days)
+        self.stdout.write(
+            self.style.SUCCESS(f"Purged {purged} outbox messages older than {days} days.")
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from poshapp.idempotency import purge_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete checkout Idempotency-Key claims past IDEMPOTENCY_KEY_TTL, and "
+        "unfinished ones past IDEMPOTENCY_LEASE_SECONDS."
+    )
+
+    def handle(self, *args, **options):
+        purged = purge_idempotency_keys()
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} idempotency keys."))
@@ -0,0 +1,79 @@
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from poshapp.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned guest carts (and optionally expired sessions) in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="Purge guest carts untouched for this many days (default: 30).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Carts deleted per transaction (default: 1000).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report how many carts would be purged without deleting anything.",
+        )
+        parser.add_argument(
+            "--clear-sessions",
+            action="store_true",
+            help="Also delete expired sessions via the session engine.",
+        )
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        batch_size = options["batch_size"]
+        if days < 1:
+            raise CommandError("--days must be at least 1.")
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        cutoff = timezone.now() - timedelta(days=days)
+        # A cart is stale when neither it nor any of its lines changed since
+        # the cutoff; adding items does not touch Cart.updated_at.
+        recent_items = CartItem.objects.filter(cart=OuterRef("pk"), updated_at__gte=cutoff)
+        stale = Cart.objects.filter(user__isnull=True, updated_at__lt=cutoff).exclude(
+            Exists(recent_items)
+        )
+
+        if options["dry_run"]:
+            self.stdout.write(
+                f"Would purge {stale.count()} guest carts older than {days} days."
+            )
+            return
+
+        purged = 0
+        while True:
+            batch = list(stale.order_by("id").values_list("id", flat=True)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                CartItem.objects.filter(cart_id__in=batch).delete()
+                Cart.objects.filter(id__in=batch).delete()
+            purged += len(batch)
+            self.stdout.write(f"Purged {purged} guest carts...")
+        self.stdout.write(
+            self.style.SUCCESS(f"Purged {purged} guest carts older than {days} days.")
+        )
+
+        if options["clear_sessions"]:
+            engine = import_module(settings.SESSION_ENGINE)
+            engine.SessionStore.clear_expired()
+            self.stdout.write(self.style.SUCCESS("Cleared expired sessions."))
@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from poshapp.emails import deliver_outbox
+from poshapp.models import EmailOutbox
+
+
+class Command(BaseCommand):
+    help = "Send queued EmailOutbox messages in batches over one SMTP connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Messages claimed and sent per connection (default: 50).",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Mark a message failed after this many errors (default: 5).",
+        )
+        parser.add_argument(
+            "--backoff",
+            type=int,
+            default=60,
+            help="Seconds before the first retry; doubles per attempt (default: 60).",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Move failed messages back to pending before sending.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep sending, sleeping --interval seconds when nothing is due.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds to sleep between runs with --loop (default: 5).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_attempts = options["max_attempts"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if max_attempts < 1:
+            raise CommandError("--max-attempts must be at least 1.")
+
+        if options["retry_failed"]:
+            retried = EmailOutbox.objects.filter(status="failed").update(
+                status="pending", attempts=0
+            )
+            self.stdout.write(f"Requeued {retried} failed messages.")
+
+        while True:
+            self._send(batch_size, max_attempts, options["backoff"])
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def _send(self, batch_size, max_attempts, backoff):
+        counts = {"sent": 0, "pending": 0, "failed": 0}
+        while True:
+            rows = deliver_outbox(batch_size, max_attempts, backoff)
+            if not rows:
+                break
+            for row in rows:
+                counts[row.status] += 1
+                if row.status != "sent":
+                    self.stderr.write(f"Email #{row.id} to {row.recipient}: {row.last_error}")
+        if any(counts.values()):
+            self.stdout.write(
+                self.style.SUCCESS(
+                    "Sent {sent}, will retry {pending}, failed {failed}.".format(**counts)
+                )
+            )
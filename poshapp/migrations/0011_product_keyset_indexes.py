@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-17 02:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poshapp', '0010_alter_sitesettings_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', '-updated_at', '-id'], name='product_active_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'price', 'id'], name='product_active_price_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 6.0.1 on 2026-10-17 02:57
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    "CREATE INDEX product_search_vector_gin ON poshapp_product USING gin (search_vector)",
+    """
+    UPDATE poshapp_product AS p SET search_vector =
+        setweight(to_tsvector('english', coalesce(p.name, '') || ' ' || coalesce(p.sku, '')), 'A')
+        || setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(c.name, ' ')
+            FROM poshapp_category c
+            JOIN poshapp_product_categories pc ON pc.category_id = c.id
+            WHERE pc.product_id = p.id
+        ), '')), 'B')
+        || setweight(to_tsvector('english', coalesce(p.short_description, '')), 'B')
+        || setweight(to_tsvector('english', coalesce(p.description, '')), 'C')
+    """,
+]
+POSTGRES_REVERSE = ["DROP INDEX IF EXISTS product_search_vector_gin"]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE poshapp_product_fts USING fts5(
+        name, sku, short_description, description, categories,
+        tokenize = 'porter unicode61'
+    )
+    """,
+    """
+    INSERT INTO poshapp_product_fts
+        (rowid, name, sku, short_description, description, categories)
+    SELECT p.id, p.name, p.sku, p.short_description, p.description, coalesce((
+        SELECT group_concat(c.name, ' ')
+        FROM poshapp_category c
+        JOIN poshapp_product_categories pc ON pc.category_id = c.id
+        WHERE pc.product_id = p.id
+    ), '')
+    FROM poshapp_product p
+    """,
+]
+SQLITE_REVERSE = ["DROP TABLE IF EXISTS poshapp_product_fts"]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        statements = statements_by_vendor.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poshapp', '0011_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            _run({"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD}),
+            _run({"postgresql": POSTGRES_REVERSE, "sqlite": SQLITE_REVERSE}),
+        ),
+    ]
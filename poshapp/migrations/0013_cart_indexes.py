@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-17 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poshapp', '0012_product_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['session_key', 'user'], name='cart_session_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['updated_at'], name='cart_updated_idx'),
+        ),
+    ]
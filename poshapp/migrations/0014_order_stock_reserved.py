@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poshapp', '0013_cart_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stock_reserved',
+            field=models.BooleanField(default=False),
+        ),
+    ]
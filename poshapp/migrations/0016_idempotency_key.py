@@ -0,0 +1,27 @@
+# Generated by Django 6.0.1 on 2026-10-17 03:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poshapp', '0015_order_expiry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('response', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='poshapp.order')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('key',), name='idempotency_key_unique')],
+            },
+        ),
+    ]
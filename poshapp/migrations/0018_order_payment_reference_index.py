@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-17 03:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poshapp', '0017_payment_event'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_reference'], name='order_payment_reference_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poshapp', '0019_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='html_body',
+            field=models.TextField(blank=True),
+        ),
+    ]
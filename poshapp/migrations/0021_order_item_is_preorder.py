@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poshapp', '0020_email_outbox_html_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='is_preorder',
+            field=models.BooleanField(default=False),
+        ),
+    ]
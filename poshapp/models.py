@@ -1,9 +1,25 @@
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.text import slugify
 
 
+class JSONArrayAgg(models.Aggregate):
+    """Collect grouped values into a JSON array on SQLite and PostgreSQL."""
+
+    function = "JSON_GROUP_ARRAY"
+    output_field = models.JSONField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, function="JSONB_AGG", **extra_context
+        )
+
+
 class User(AbstractUser):
     phone_number = models.CharField(max_length=32, blank=True)
     company_name = models.CharField(max_length=120, blank=True)
@@ -28,6 +44,52 @@ class Category(models.Model):
         return self.name
 
 
+def primary_image_path(product_ref="pk"):
+    """Subquery for the storage path of a product's card image.
+
+    ``product_ref`` names the outer product id, e.g. ``"product_id"`` when
+    annotating rows that point at a product.
+    """
+    images = ProductImage.objects.filter(product=OuterRef(product_ref)).order_by(
+        "-is_primary", "display_order"
+    )
+    return Subquery(images.values("image")[:1])
+
+
+class ProductQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Annotate everything a product card needs so a page is one query.
+
+        Adds ``primary_image_path``, ``tier_count``, ``tier_min_price``,
+        ``tier_max_price``, ``category_slugs`` and ``category_names`` as
+        correlated subqueries instead of prefetching images/tiers/categories.
+        """
+        tiers = (
+            ProductPriceTier.objects.filter(product=OuterRef("pk"))
+            .order_by()
+            .values("product")
+        )
+        categories = (
+            Category.objects.filter(products=OuterRef("pk"))
+            .order_by()
+            .values("products")
+        )
+        return self.annotate(
+            primary_image_path=primary_image_path(),
+            tier_count=Coalesce(
+                Subquery(tiers.annotate(n=Count("id")).values("n")), 0
+            ),
+            tier_min_price=Subquery(tiers.annotate(p=Min("price")).values("p")),
+            tier_max_price=Subquery(tiers.annotate(p=Max("price")).values("p")),
+            category_slugs=Subquery(
+                categories.annotate(v=JSONArrayAgg("slug")).values("v")
+            ),
+            category_names=Subquery(
+                categories.annotate(v=JSONArrayAgg("name")).values("v")
+            ),
+        )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(max_length=220, unique=True, blank=True)
@@ -49,13 +111,39 @@ class Product(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by poshapp.search on PostgreSQL; unused (NULL) elsewhere.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         ordering = ["-is_featured", "-created_at"]
+        indexes = [
+            # Keyset pagination for /api/products: (updated_at, id) and (price, id).
+            models.Index(
+                fields=["is_active", "-updated_at", "-id"],
+                name="product_active_updated_idx",
+            ),
+            models.Index(
+                fields=["is_active", "price", "id"], name="product_active_price_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def primary_image_url(self):
+        """URL of the card image, from the listing annotation when present."""
+        if hasattr(self, "primary_image_path"):
+            path = self.primary_image_path
+        else:
+            image = self.images.first()
+            path = image.image.name if image else None
+        if not path:
+            return ""
+        return ProductImage._meta.get_field("image").storage.url(path)
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
@@ -117,6 +205,13 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # get_cart's guest lookup and purge_stale_carts' age scan.
+            models.Index(fields=["session_key", "user"], name="cart_session_user_idx"),
+            models.Index(fields=["updated_at"], name="cart_updated_idx"),
+        ]
+
     def __str__(self):
         if self.user:
             return f"Cart for {self.user.username}"
@@ -155,6 +250,7 @@ class Order(models.Model):
         ("pending", "Pending"),
         ("paid", "Paid"),
         ("failed", "Failed"),
+        ("expired", "Expired"),
         ("refunded", "Refunded"),
     ]
 
@@ -187,6 +283,8 @@ class Order(models.Model):
     )
     payment_reference = models.CharField(max_length=255, blank=True)
     payment_method = models.CharField(max_length=64, blank=True)
+    # True while this order holds stock taken at checkout; cleared on release.
+    stock_reserved = models.BooleanField(default=False)
 
     notes = models.TextField(blank=True)
 
@@ -200,6 +298,15 @@ class Order(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # expire_pending_orders scans pending orders by age.
+            models.Index(
+                fields=["payment_status", "created_at"],
+                name="order_payment_created_idx",
+            ),
+            # Callback, webhook and sweeper look orders up by reference.
+            models.Index(fields=["payment_reference"], name="order_payment_reference_idx"),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.full_name}"
@@ -215,6 +322,8 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=12, decimal_places=0)
     currency = models.CharField(max_length=3, default="NGN")
+    # Ordered while the product was out of stock: no stock was reserved.
+    is_preorder = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -335,3 +444,95 @@ class WishlistItem(models.Model):
     
     def __str__(self):
         return f"{self.product.name} in {self.wishlist.user.username}'s wishlist"
+
+
+class IdempotencyKey(models.Model):
+    """A claimed checkout request key and, once done, the response to replay."""
+
+    # sha256 of the client's key scoped to its user or session.
+    key = models.CharField(max_length=64)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True)
+    response = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["key"], name="idempotency_key_unique"),
+        ]
+
+    def __str__(self):
+        return self.key
+
+
+class PaymentEvent(models.Model):
+    """A verified Paystack webhook event waiting for, or done with, processing.
+
+    Paystack redelivers events until it gets a 2xx, so the (event, reference)
+    constraint turns retries into no-ops.
+    """
+
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("processed", "Processed"),
+        ("failed", "Failed"),
+    ]
+
+    event = models.CharField(max_length=64)
+    reference = models.CharField(max_length=255, blank=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["event", "reference"], name="payment_event_unique"
+            ),
+        ]
+        indexes = [
+            # process_payment_events drains pending events oldest first.
+            models.Index(fields=["status", "id"], name="payment_event_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.event} {self.reference}"
+
+
+class EmailOutbox(models.Model):
+    """A rendered email waiting for the ``send_outbox`` worker."""
+
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    ]
+
+    order = models.ForeignKey(
+        Order, on_delete=models.SET_NULL, null=True, blank=True, related_name="emails"
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    # Optional text/html alternative sent alongside ``body``.
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    recipient = models.EmailField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            # send_outbox claims due pending rows.
+            models.Index(fields=["status", "next_attempt_at"], name="email_outbox_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipient}"
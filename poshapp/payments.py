@@ -1,20 +1,28 @@
 ﻿import hashlib
 import hmac
+import http.client
 import json
 import logging
+import os
+import random
+import threading
+import time
 import uuid
-from urllib.error import HTTPError, URLError
 from urllib.parse import urlparse
-from urllib.request import Request, urlopen
 
+import httpx
 from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
 
 logger = logging.getLogger(__name__)
 
 
 class PaystackError(RuntimeError):
-    pass
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        # HTTP status of the Paystack response, when there was one.
+        self.status_code = status_code
 
 
 def get_paystack_callback_url(request):
@@ -38,54 +46,278 @@ def _headers():
     }
 
 
-def _request(method, path, payload=None):
-    base = settings.PAYSTACK_BASE_URL.rstrip("/")
-    url = f"{base}{path}"
-    data = json.dumps(payload).encode("utf-8") if payload else None
-    request = Request(url, data=data, headers=_headers(), method=method)
+def _error_detail(status, raw_detail):
+    detail = None
+    if raw_detail:
+        try:
+            parsed = json.loads(raw_detail)
+        except json.JSONDecodeError:
+            parsed = None
+
+        if isinstance(parsed, dict):
+            message = parsed.get("message") or parsed.get("error")
+            error_code = parsed.get("code") or parsed.get("error_code")
+            meta = parsed.get("meta")
+            detail = message or "Paystack API error"
+            if error_code:
+                detail = f"{detail} (code {error_code})"
+            if isinstance(meta, dict):
+                reason = meta.get("reason") or meta.get("message")
+                if reason:
+                    detail = f"{detail}: {reason}"
+        else:
+            detail = raw_detail
+
+    if not detail:
+        detail = f"HTTP Error {status}"
+
+    if status and "HTTP" not in detail:
+        detail = f"{detail} (HTTP {status})"
+    return detail
+
+
+def _record_call(metrics, name, elapsed, retries, failed):
+    stats = metrics.setdefault(
+        name,
+        {"calls": 0, "errors": 0, "retries": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+    )
+    stats["calls"] += 1
+    stats["errors"] += int(failed)
+    stats["retries"] += retries
+    stats["total_seconds"] += elapsed
+    stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+    logger.debug("Paystack %s took %.1fms (%d retries)", name, elapsed * 1000, retries)
+
+
+def _decode_response(status, raw):
+    if status >= 400:
+        logger.debug("Paystack HTTP %s response: %s", status, raw)
+        raise PaystackError(_error_detail(status, raw), status_code=status)
     try:
-        with urlopen(request, timeout=20) as response:
-            body = response.read().decode("utf-8")
-            return json.loads(body)
-    except HTTPError as exc:
-        status = getattr(exc, "code", None)
-        raw_detail = None
-        detail = None
+        return json.loads(raw)
+    except json.JSONDecodeError as exc:
+        raise PaystackError("Invalid response from Paystack.") from exc
+
+
+class PaystackClient:
+    """Keep-alive HTTP client for the Paystack API.
+
+    Holds up to ``pool_size`` idle connections so initialize and verify calls
+    skip the TCP and TLS handshakes. Connections are not shared between
+    threads: each call checks one out and returns it when done. Only calls
+    made with ``retry=True`` (verify, a GET) are retried on connection
+    errors, timeouts, 429 and 5xx, with jittered exponential backoff.
+    ``metrics`` keeps per-operation call, error, retry and latency totals.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        base_url,
+        connect_timeout=5.0,
+        read_timeout=20.0,
+        max_retries=2,
+        retry_backoff=0.25,
+        pool_size=4,
+    ):
+        parsed = urlparse(base_url)
+        self.scheme = parsed.scheme or "https"
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.pool_size = pool_size
+        self.metrics = {}
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection_class = (
+            http.client.HTTPConnection if self.scheme == "http" else http.client.HTTPSConnection
+        )
+        connection = connection_class(self.host, self.port, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        return connection
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _checkin(self, connection):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def _send(self, method, path, body, headers):
+        connection, reused = self._checkout()
         try:
-            raw_detail = exc.read().decode("utf-8")
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed an idle keep-alive connection; the
+                # request never reached it, so resend once on a fresh one.
+                if not reused:
+                    raise
+                connection.close()
+                connection = self._connect()
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            raw = response.read().decode("utf-8")
         except Exception:
-            raw_detail = None
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(connection)
+        return response.status, raw
+
+    def request(self, method, path, payload=None, retry=False, name=None):
+        """Call the API and return the decoded JSON body.
+
+        Raises ``PaystackError`` for non-2xx responses and network failures.
+        """
+        name = name or f"{method} {path}"
+        body = json.dumps(payload).encode("utf-8") if payload else None
+        headers = _headers()
+        attempts = 1 + (self.max_retries if retry else 0)
+        started = time.monotonic()
+        failed = True
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                try:
+                    status, raw = self._send(method, f"{self.base_path}{path}", body, headers)
+                except (OSError, http.client.HTTPException) as exc:
+                    if attempt < attempts:
+                        self._backoff(attempt)
+                        continue
+                    raise PaystackError(str(exc) or exc.__class__.__name__) from exc
+                if status in self.RETRY_STATUSES and attempt < attempts:
+                    self._backoff(attempt)
+                    continue
+                break
+            result = _decode_response(status, raw)
+            failed = False
+            return result
+        finally:
+            _record_call(self.metrics, name, time.monotonic() - started, attempt - 1, failed)
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, self.retry_backoff * 2 ** (attempt - 1)))
+
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+
+def get_paystack_client():
+    """Return this process's ``PaystackClient``.
 
-        if raw_detail:
+    Rebuilt when the Paystack settings change or after a fork, so workers
+    never share sockets inherited from the master process.
+    """
+    global _client, _client_key
+    key = (
+        os.getpid(),
+        settings.PAYSTACK_BASE_URL,
+        settings.PAYSTACK_CONNECT_TIMEOUT,
+        settings.PAYSTACK_READ_TIMEOUT,
+        settings.PAYSTACK_MAX_RETRIES,
+        settings.PAYSTACK_RETRY_BACKOFF,
+        settings.PAYSTACK_POOL_SIZE,
+    )
+    with _client_lock:
+        if _client_key != key:
+            if _client is not None and _client_key[0] == key[0]:
+                _client.close()
+            _client = PaystackClient(
+                settings.PAYSTACK_BASE_URL,
+                connect_timeout=settings.PAYSTACK_CONNECT_TIMEOUT,
+                read_timeout=settings.PAYSTACK_READ_TIMEOUT,
+                max_retries=settings.PAYSTACK_MAX_RETRIES,
+                retry_backoff=settings.PAYSTACK_RETRY_BACKOFF,
+                pool_size=settings.PAYSTACK_POOL_SIZE,
+            )
+            _client_key = key
+        return _client
+
+
+class AsyncPaystackClient:
+    """``httpx``-based async counterpart of ``PaystackClient`` for the async
+    checkout views, so a slow gateway parks a coroutine instead of a worker
+    thread.
+
+    A fresh ``httpx.AsyncClient`` is opened per call: async views may run on
+    a new event loop per request, and pooled connections cannot outlive
+    their loop. Nothing is retried; it is only used for initialize, which is
+    not idempotent.
+    """
+
+    def __init__(self, base_url, connect_timeout=5.0, read_timeout=20.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.metrics = {}
+
+    async def request(self, method, path, payload=None, name=None):
+        name = name or f"{method} {path}"
+        body = json.dumps(payload).encode("utf-8") if payload else None
+        headers = _headers()
+        started = time.monotonic()
+        failed = True
+        try:
             try:
-                parsed = json.loads(raw_detail)
-            except json.JSONDecodeError:
-                parsed = None
-
-            if isinstance(parsed, dict):
-                message = parsed.get("message") or parsed.get("error")
-                error_code = parsed.get("code") or parsed.get("error_code")
-                meta = parsed.get("meta")
-                detail = message or "Paystack API error"
-                if error_code:
-                    detail = f"{detail} (code {error_code})"
-                if isinstance(meta, dict):
-                    reason = meta.get("reason") or meta.get("message")
-                    if reason:
-                        detail = f"{detail}: {reason}"
-            else:
-                detail = raw_detail
-
-        if not detail:
-            detail = str(exc)
-
-        if status and "HTTP" not in detail:
-            detail = f"{detail} (HTTP {status})"
-
-        logger.debug("Paystack HTTPError %s response: %s", status, raw_detail or str(exc))
-        raise PaystackError(detail) from exc
-    except URLError as exc:
-        raise PaystackError(str(exc)) from exc
+                async with httpx.AsyncClient(timeout=self.timeout) as client:
+                    response = await client.request(
+                        method, f"{self.base_url}{path}", content=body, headers=headers
+                    )
+            except httpx.HTTPError as exc:
+                raise PaystackError(str(exc) or exc.__class__.__name__) from exc
+            result = _decode_response(response.status_code, response.text)
+            failed = False
+            return result
+        finally:
+            _record_call(self.metrics, name, time.monotonic() - started, 0, failed)
+
+
+_async_client = None
+_async_client_key = None
+
+
+def get_async_paystack_client():
+    """Return this process's ``AsyncPaystackClient`` for the current settings."""
+    global _async_client, _async_client_key
+    key = (
+        settings.PAYSTACK_BASE_URL,
+        settings.PAYSTACK_CONNECT_TIMEOUT,
+        settings.PAYSTACK_READ_TIMEOUT,
+    )
+    if _async_client_key != key:
+        _async_client = AsyncPaystackClient(
+            settings.PAYSTACK_BASE_URL,
+            connect_timeout=settings.PAYSTACK_CONNECT_TIMEOUT,
+            read_timeout=settings.PAYSTACK_READ_TIMEOUT,
+        )
+        _async_client_key = key
+    return _async_client
 
 
 def build_paystack_metadata(order):
@@ -132,18 +364,20 @@ def build_paystack_metadata(order):
     }
 
 
-def initialize_paystack_transaction(order, email, amount, currency, callback_url, metadata=None):
-    amount_kobo = int(amount) * 100
+def _initialize_payload(order, email, amount, currency, callback_url, metadata):
     reference = order.payment_reference or f"POSH-{order.id}-{uuid.uuid4().hex[:8]}"
     payload = {
         "email": email,
-        "amount": amount_kobo,
+        "amount": int(amount) * 100,
         "currency": currency,
         "reference": reference,
         "callback_url": callback_url,
         "metadata": metadata or {"order_id": order.id},
     }
-    response = _request("POST", "/transaction/initialize", payload=payload)
+    return payload, reference
+
+
+def _initialize_result(response, reference):
     if not response.get("status"):
         raise PaystackError(response.get("message") or "Payment initialization failed.")
     data = response.get("data") or {}
@@ -154,8 +388,74 @@ def initialize_paystack_transaction(order, email, amount, currency, callback_url
     }
 
 
-def verify_paystack_transaction(reference):
-    response = _request("GET", f"/transaction/verify/{reference}")
+def initialize_paystack_transaction(order, email, amount, currency, callback_url, metadata=None):
+    payload, reference = _initialize_payload(
+        order, email, amount, currency, callback_url, metadata
+    )
+    response = get_paystack_client().request(
+        "POST", "/transaction/initialize", payload=payload, name="initialize"
+    )
+    return _initialize_result(response, reference)
+
+
+async def ainitialize_paystack_transaction(
+    order, email, amount, currency, callback_url, metadata=None
+):
+    """Async ``initialize_paystack_transaction``; touches no ORM state."""
+    payload, reference = _initialize_payload(
+        order, email, amount, currency, callback_url, metadata
+    )
+    response = await get_async_paystack_client().request(
+        "POST", "/transaction/initialize", payload=payload, name="initialize"
+    )
+    return _initialize_result(response, reference)
+
+
+# reference -> in-flight verify shared by this process's callers:
+# {"lock", "waiters", "response"}. An entry is dropped with its last waiter.
+_verify_inflight = {}
+_verify_inflight_guard = threading.Lock()
+
+
+def verify_paystack_transaction(reference, cached=False):
+    """Verify ``reference`` with Paystack.
+
+    With ``cached=True`` a ``success`` answer is reused for
+    ``PAYSTACK_VERIFY_CACHE_TIMEOUT`` seconds, and concurrent callers in this
+    process wait for the one request already in flight instead of sending
+    their own. Errors and unsettled statuses are never cached.
+    """
+    if not cached:
+        return _verify(reference)
+    key = f"paystack:verify:{reference}"
+    response = cache.get(key)
+    if response is not None:
+        return response
+    with _verify_inflight_guard:
+        inflight = _verify_inflight.setdefault(
+            reference, {"lock": threading.Lock(), "waiters": 0, "response": None}
+        )
+        inflight["waiters"] += 1
+    try:
+        with inflight["lock"]:
+            response = inflight["response"] or cache.get(key)
+            if response is None:
+                response = _verify(reference)
+                inflight["response"] = response
+                if (response.get("data") or {}).get("status") == "success":
+                    cache.set(key, response, settings.PAYSTACK_VERIFY_CACHE_TIMEOUT)
+    finally:
+        with _verify_inflight_guard:
+            inflight["waiters"] -= 1
+            if not inflight["waiters"]:
+                del _verify_inflight[reference]
+    return response
+
+
+def _verify(reference):
+    response = get_paystack_client().request(
+        "GET", f"/transaction/verify/{reference}", retry=True, name="verify"
+    )
     if not response.get("status"):
         raise PaystackError(response.get("message") or "Payment verification failed.")
     return response
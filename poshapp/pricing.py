@@ -0,0 +1,101 @@
+import bisect
+
+from poshapp.models import ProductPriceTier
+
+# Volume pricing for products that have no tiers configured in the database,
+# keyed by a token looked up in the product slug or name:
+# token -> (currency, ((min_quantity, price), ...)).
+DEFAULT_PRICE_TIERS = {
+    "d2pro": ("NGN", ((1, 320000), (20, 280000))),
+}
+
+
+def default_tiers_for(product):
+    """Return ``(min_quantities, prices, currencies)`` from ``DEFAULT_PRICE_TIERS``."""
+    text = f"{product.slug or ''} {product.name or ''}".lower()
+    for token, (currency, tiers) in DEFAULT_PRICE_TIERS.items():
+        if token in text:
+            return (
+                [min_quantity for min_quantity, _ in tiers],
+                [price for _, price in tiers],
+                [currency] * len(tiers),
+            )
+    return None
+
+
+class PricingEngine:
+    """Resolve unit prices and tier ranges for a batch of products.
+
+    All tiers for the batch are loaded in one query (or taken from a
+    ``price_tiers`` prefetch) into per-product arrays sorted by
+    ``min_quantity``, so each lookup is a bisect with no further queries.
+    """
+
+    def __init__(self, products):
+        self.products = {product.id: product for product in products}
+        self.tiers = {}
+        prefetched = [
+            product
+            for product in self.products.values()
+            if "price_tiers" in getattr(product, "_prefetched_objects_cache", {})
+        ]
+        if len(prefetched) == len(self.products):
+            rows = (
+                (tier.product_id, tier.min_quantity, tier.price, tier.currency)
+                for product in prefetched
+                for tier in product.price_tiers.all()
+            )
+        else:
+            rows = ProductPriceTier.objects.filter(
+                product_id__in=list(self.products)
+            ).values_list("product_id", "min_quantity", "price", "currency")
+        for product_id, min_quantity, price, currency in sorted(
+            rows, key=lambda row: (row[0], row[1])
+        ):
+            mins, prices, currencies = self.tiers.setdefault(product_id, ([], [], []))
+            mins.append(min_quantity)
+            prices.append(price)
+            currencies.append(currency)
+
+    def _tiers(self, product):
+        tiers = self.tiers.get(product.id)
+        if tiers is None:
+            tiers = default_tiers_for(product)
+        return tiers
+
+    def unit_price(self, product, quantity=None):
+        """Unit price for ``quantity`` units, or ``None`` if unpriced.
+
+        Configured tiers win, then the product's own price, then the
+        ``DEFAULT_PRICE_TIERS`` fallback.
+        """
+        if product.id in self.tiers:
+            tiers = self.tiers[product.id]
+        elif product.price:
+            return product.price
+        else:
+            tiers = default_tiers_for(product)
+            if tiers is None:
+                return None
+        mins, prices, _ = tiers
+        index = bisect.bisect_right(mins, quantity or 1) - 1
+        return prices[max(index, 0)]
+
+    def tier_ranges(self, product):
+        """Return ``(ranges, savings, first_tier_max)`` for the detail page."""
+        tiers = self._tiers(product)
+        if not tiers:
+            return [], None, None
+        mins, prices, currencies = tiers
+        ranges = [
+            {
+                "min": min_quantity,
+                "max": mins[index + 1] - 1 if index + 1 < len(mins) else None,
+                "price": prices[index],
+                "currency": currencies[index],
+            }
+            for index, min_quantity in enumerate(mins)
+        ]
+        if len(prices) > 1 and prices[1] < prices[0]:
+            return ranges, prices[0] - prices[1], ranges[0]["max"]
+        return ranges, None, None
@@ -40,6 +40,32 @@ class ProductOut(Schema):
     price_tiers: List[ProductPriceTierOut]
 
 
+class ProductSuggestionOut(Schema):
+    id: int
+    slug: str
+    name: str
+
+
+class CategoryFacetOut(Schema):
+    slug: str
+    name: str
+    count: int
+
+
+class PriceBucketOut(Schema):
+    min: int
+    max: Optional[int] = None
+    count: int
+
+
+class ProductFacetsOut(Schema):
+    total: int
+    all_categories: int
+    in_stock: int
+    categories: List[CategoryFacetOut]
+    price_buckets: List[PriceBucketOut]
+
+
 class CartItemIn(Schema):
     product_id: int
     quantity: int = 1
@@ -61,7 +87,7 @@ class CartItemOut(Schema):
 
 
 class CartOut(Schema):
-    id: int
+    id: Optional[int] = None
     items: List[CartItemOut]
     subtotal: int
     currency: str
@@ -0,0 +1,328 @@
+import bisect
+import heapq
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .catalog import get_catalog_generation
+from .models import Product
+
+SEARCH_CONFIG = "english"
+SQLITE_FTS_TABLE = "poshapp_product_fts"
+
+
+def search_terms(query):
+    """Split free text into lowercase word tokens safe for any backend."""
+    return re.findall(r"\w+", (query or "").lower())
+
+
+class BasicSearchBackend:
+    """Portable ``icontains`` fallback for databases without full-text search."""
+
+    def search(self, queryset, query):
+        terms = search_terms(query)
+        if not terms:
+            return queryset.none()
+        condition = Q()
+        for term in terms:
+            condition &= (
+                Q(name__icontains=term)
+                | Q(sku__icontains=term)
+                | Q(short_description__icontains=term)
+                | Q(description__icontains=term)
+                | Q(categories__name__icontains=term)
+            )
+        matches = Product.objects.filter(condition).values("id")
+        return queryset.filter(id__in=matches).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+
+    def index_products(self, product_ids):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+
+class PostgresSearchBackend:
+    """Ranked search over the GIN-indexed ``Product.search_vector`` column."""
+
+    def search(self, queryset, query):
+        terms = search_terms(query)
+        if not terms:
+            return queryset.none()
+        search_query = SearchQuery(
+            " & ".join(f"{term}:*" for term in terms),
+            search_type="raw",
+            config=SEARCH_CONFIG,
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F("search_vector"), search_query)
+        )
+
+    def index_products(self, product_ids):
+        products = Product.objects.filter(id__in=product_ids).prefetch_related(
+            "categories"
+        )
+        for product in products:
+            categories = " ".join(c.name for c in product.categories.all())
+            vector = (
+                SearchVector("name", "sku", weight="A", config=SEARCH_CONFIG)
+                + SearchVector(Value(categories), weight="B", config=SEARCH_CONFIG)
+                + SearchVector("short_description", weight="B", config=SEARCH_CONFIG)
+                + SearchVector("description", weight="C", config=SEARCH_CONFIG)
+            )
+            Product.objects.filter(id=product.id).update(search_vector=vector)
+
+    def remove_products(self, product_ids):
+        # The vector lives on the product row and is deleted with it.
+        pass
+
+
+class SQLiteSearchBackend:
+    """Ranked prefix search over the FTS5 shadow table used in dev and tests."""
+
+    def search(self, queryset, query):
+        terms = search_terms(query)
+        if not terms:
+            return queryset.none()
+        match = " ".join(f'"{term}"*' for term in terms)
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s",
+                (match,),
+            )
+        ).annotate(
+            # bm25() is lower-is-better; negate so higher means more relevant
+            # like SearchRank.
+            search_rank=RawSQL(
+                f"SELECT -bm25({SQLITE_FTS_TABLE}, 10.0, 10.0, 5.0, 1.0, 5.0) "
+                f"FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s "
+                f"AND rowid = {Product._meta.db_table}.id",
+                (match,),
+                output_field=FloatField(),
+            )
+        )
+
+    def index_products(self, product_ids):
+        products = Product.objects.filter(id__in=product_ids).prefetch_related(
+            "categories"
+        )
+        rows = [
+            (
+                product.id,
+                product.name,
+                product.sku,
+                product.short_description,
+                product.description,
+                " ".join(c.name for c in product.categories.all()),
+            )
+            for product in products
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = %s",
+                [(product_id,) for product_id in product_ids],
+            )
+            cursor.executemany(
+                f"INSERT INTO {SQLITE_FTS_TABLE} "
+                "(rowid, name, sku, short_description, description, categories) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                rows,
+            )
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = %s",
+                [(product_id,) for product_id in product_ids],
+            )
+
+
+SEARCH_BACKENDS = {
+    "basic": BasicSearchBackend,
+    "postgres": PostgresSearchBackend,
+    "sqlite": SQLiteSearchBackend,
+}
+
+
+def get_search_backend():
+    """Return the backend named by ``SEARCH_BACKEND``.
+
+    ``auto`` picks the native full-text backend for the default database,
+    falling back to ``basic``. A dotted path to a custom class also works.
+    """
+    name = getattr(settings, "SEARCH_BACKEND", "auto") or "auto"
+    if name == "auto":
+        name = {"postgresql": "postgres", "sqlite": "sqlite"}.get(
+            connection.vendor, "basic"
+        )
+    backend_class = SEARCH_BACKENDS.get(name) or import_string(name)
+    return backend_class()
+
+
+def search_products(queryset, query):
+    """Filter ``queryset`` to products matching ``query``, annotated with
+    ``search_rank`` (higher is more relevant)."""
+    return get_search_backend().search(queryset, query)
+
+
+def _trigrams(token):
+    padded = f"  {token} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class SuggestIndex:
+    """In-memory prefix + trigram index for typo-tolerant autocomplete.
+
+    Tokens are kept sorted so prefix lookups are a bisect, and each token's
+    trigrams map back to it so misspellings still find close matches. Every
+    query term must match; entries are ranked by summed field-weighted scores.
+    """
+
+    FIELD_WEIGHTS = {"name": 3.0, "sku": 3.0, "categories": 1.5, "short_description": 1.0}
+    MIN_SIMILARITY = 0.35
+
+    def __init__(self, entries):
+        # entries: iterable of (id, slug, name, {field: text})
+        self.entries = []
+        postings = {}
+        for position, (product_id, slug, name, fields) in enumerate(entries):
+            self.entries.append((product_id, slug, name))
+            for field, text in fields.items():
+                weight = self.FIELD_WEIGHTS[field]
+                for token in search_terms(text):
+                    weights = postings.setdefault(token, {})
+                    weights[position] = max(weights.get(position, 0.0), weight)
+        self.tokens = sorted(postings)
+        self.postings = [postings[token] for token in self.tokens]
+        self.trigram_tokens = {}
+        for token_id, token in enumerate(self.tokens):
+            for trigram in _trigrams(token):
+                self.trigram_tokens.setdefault(trigram, []).append(token_id)
+
+    def _matching_tokens(self, term):
+        """Yield ``(token_id, score)`` for prefix and fuzzy matches of ``term``."""
+        start = bisect.bisect_left(self.tokens, term)
+        matched = set()
+        for token_id in range(start, len(self.tokens)):
+            token = self.tokens[token_id]
+            if not token.startswith(term):
+                break
+            matched.add(token_id)
+            yield token_id, 1.0 if token == term else 0.9
+        if len(term) < 3:
+            return
+        term_trigrams = _trigrams(term)
+        shared = {}
+        for trigram in term_trigrams:
+            for token_id in self.trigram_tokens.get(trigram, ()):
+                shared[token_id] = shared.get(token_id, 0) + 1
+        for token_id, count in shared.items():
+            if token_id in matched:
+                continue
+            total = len(term_trigrams) + len(_trigrams(self.tokens[token_id])) - count
+            similarity = count / total
+            if similarity >= self.MIN_SIMILARITY:
+                yield token_id, similarity * 0.8
+
+    def suggest(self, query, limit=8):
+        terms = search_terms(query)
+        if not terms:
+            return []
+        totals = None
+        for term in terms:
+            term_scores = {}
+            for token_id, score in self._matching_tokens(term):
+                for position, weight in self.postings[token_id].items():
+                    value = score * weight
+                    if value > term_scores.get(position, 0.0):
+                        term_scores[position] = value
+            if totals is None:
+                totals = term_scores
+            else:
+                totals = {
+                    position: totals[position] + value
+                    for position, value in term_scores.items()
+                    if position in totals
+                }
+            if not totals:
+                return []
+        ranked = heapq.nsmallest(
+            limit,
+            totals.items(),
+            key=lambda item: (-item[1], self.entries[item[0]][2]),
+        )
+        return [self.entries[position] for position, _ in ranked]
+
+
+def build_suggest_index():
+    category_names = {}
+    memberships = Product.categories.through.objects.filter(
+        product__is_active=True
+    ).values_list("product_id", "category__name")
+    for product_id, category_name in memberships:
+        category_names.setdefault(product_id, []).append(category_name)
+    products = Product.objects.filter(is_active=True).values_list(
+        "id", "slug", "name", "sku", "short_description"
+    )
+    return SuggestIndex(
+        (
+            product_id,
+            slug,
+            name,
+            {
+                "name": name,
+                "sku": sku,
+                "short_description": short_description,
+                "categories": " ".join(category_names.get(product_id, [])),
+            },
+        )
+        for product_id, slug, name, sku, short_description in products
+    )
+
+
+_suggest_lock = threading.Lock()
+_suggest_state = {"generation": None, "index": None}
+
+
+def get_suggest_index():
+    """Return this process's suggest index, or ``None`` when disabled.
+
+    The index is rebuilt when the catalog generation has moved on since it
+    was built, so it needs a cache shared by every worker (``SUGGEST_INDEX``
+    defaults to on only when ``CACHE_BACKEND`` is set).
+    """
+    if not getattr(settings, "SUGGEST_INDEX", False):
+        return None
+    generation = get_catalog_generation()
+    if _suggest_state["generation"] != generation:
+        with _suggest_lock:
+            if _suggest_state["generation"] != generation:
+                _suggest_state["index"] = build_suggest_index()
+                _suggest_state["generation"] = generation
+    return _suggest_state["index"]
+
+
+def product_suggestions(query, limit=8):
+    """Return up to ``limit`` ``(id, slug, name)`` autocomplete matches.
+
+    Served from the in-memory suggest index when enabled; otherwise one
+    search-backend query (prefix matches only, no typo tolerance).
+    """
+    index = get_suggest_index()
+    if index is not None:
+        return index.suggest(query, limit)
+    if not search_terms(query):
+        return []
+    return list(
+        search_products(Product.objects.filter(is_active=True), query)
+        .order_by("-search_rank", "name")
+        .values_list("id", "slug", "name")[:limit]
+    )
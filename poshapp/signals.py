@@ -0,0 +1,75 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cart import merge_guest_cart
+from .catalog import invalidate_catalog
+from .models import Category, Product, ProductImage, ProductPriceTier
+from .search import get_search_backend
+
+CATALOG_MODELS = (Product, ProductImage, ProductPriceTier, Category)
+
+
+for _model in CATALOG_MODELS:
+    post_save.connect(
+        invalidate_catalog, sender=_model, dispatch_uid=f"catalog_save_{_model.__name__}"
+    )
+    post_delete.connect(
+        invalidate_catalog, sender=_model, dispatch_uid=f"catalog_delete_{_model.__name__}"
+    )
+
+
+@receiver(m2m_changed, sender=Product.categories.through, dispatch_uid="catalog_categories")
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        # Remember which products lose this category before the rows go.
+        instance._search_product_ids = list(instance.products.values_list("id", flat=True))
+    if action not in {"post_add", "post_remove", "post_clear"}:
+        return
+    invalidate_catalog()
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == "post_clear":
+        product_ids = getattr(instance, "_search_product_ids", [])
+    else:
+        product_ids = list(pk_set or [])
+    if product_ids:
+        get_search_backend().index_products(product_ids)
+
+
+@receiver(post_save, sender=Product, dispatch_uid="search_index_product")
+def index_saved_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_search_backend().index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product, dispatch_uid="search_remove_product")
+def remove_deleted_product(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category, dispatch_uid="search_index_category")
+def index_category_products(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    product_ids = list(instance.products.values_list("id", flat=True))
+    if product_ids:
+        get_search_backend().index_products(product_ids)
+
+
+@receiver(pre_delete, sender=Category, dispatch_uid="search_collect_category")
+def collect_category_products(sender, instance, **kwargs):
+    instance._search_product_ids = list(instance.products.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Category, dispatch_uid="search_reindex_category")
+def reindex_category_products(sender, instance, **kwargs):
+    product_ids = getattr(instance, "_search_product_ids", [])
+    if product_ids:
+        get_search_backend().index_products(product_ids)
+
+
+@receiver(user_logged_in, dispatch_uid="cart_merge_on_login")
+def merge_cart_on_login(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, "session"):
+        merge_guest_cart(request, user)
@@ -0,0 +1,212 @@
+import bisect
+import threading
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+
+from .catalog import CATALOG_ORDERING, get_catalog_generation, get_stock_generation
+from .models import Product
+
+# Shop ``order_by`` field -> snapshot ordering; unordered shop pages use "newest".
+SNAPSHOT_ORDERING = {field: key for key, field in CATALOG_ORDERING.items()}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def _timestamp(value):
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+class CatalogSnapshot:
+    """Columnar, read-only copy of the active catalog for filter and sort.
+
+    Row ``i`` of every parallel array describes one active product. Category
+    membership is a bitmask per row, so a category filter is a single AND.
+    Sort permutations are built lazily per ordering and kept for the
+    snapshot's lifetime; keyset orderings match ``catalog.keyset_order_by``
+    (NULL prices last, ``id`` tiebreak) so cursors can be resumed by bisect.
+    """
+
+    def __init__(self, rows, memberships):
+        # rows: iterable of (id, price, stock_quantity, updated_at, is_featured, name)
+        # memberships: iterable of (product_id, category_slug)
+        self.ids = array("q")
+        self.prices = array("q")
+        self.has_price = array("b")
+        self.stock = array("q")
+        self.updated = array("q")
+        self.featured = array("b")
+        self.names = []
+        for product_id, price, stock, updated_at, is_featured, name in rows:
+            self.ids.append(product_id)
+            self.prices.append(int(price) if price is not None else 0)
+            self.has_price.append(price is not None)
+            self.stock.append(stock)
+            self.updated.append(_timestamp(updated_at))
+            self.featured.append(is_featured)
+            self.names.append(name)
+        self.category_bits = {}
+        self.category_masks = [0] * len(self.ids)
+        self.row_by_id = {product_id: row for row, product_id in enumerate(self.ids)}
+        for product_id, slug in memberships:
+            row = self.row_by_id.get(product_id)
+            if row is None:
+                continue
+            bit = self.category_bits.setdefault(slug, 1 << len(self.category_bits))
+            self.category_masks[row] |= bit
+        self._orders = {}
+
+    def refresh_stock(self, pairs):
+        """Replace the stock column from ``(id, stock_quantity)`` pairs.
+
+        No ordering depends on stock, so the sort permutations stay valid.
+        """
+        stock = array("q", self.stock)
+        for product_id, quantity in pairs:
+            row = self.row_by_id.get(product_id)
+            if row is not None:
+                stock[row] = quantity
+        self.stock = stock
+
+    def sort_key(self, ordering):
+        """Return ``row -> key`` whose ascending order is ``ordering``."""
+        ids, prices, has_price = self.ids, self.prices, self.has_price
+        updated, names = self.updated, self.names
+        if ordering == "updated":
+            return lambda row: (-updated[row], -ids[row])
+        if ordering == "updated_asc":
+            return lambda row: (updated[row], ids[row])
+        if ordering == "price":
+            return lambda row: (not has_price[row], prices[row], ids[row])
+        if ordering == "-price":
+            return lambda row: (not has_price[row], -prices[row], -ids[row])
+        if ordering in ("name", "-name"):
+            return lambda row: (names[row], ids[row])
+        if ordering == "newest":
+            # The shop's default: newest first, then by name.
+            return lambda row: (-updated[row], names[row], ids[row])
+        raise KeyError(ordering)
+
+    def order(self, ordering):
+        rows = self._orders.get(ordering)
+        if rows is None:
+            rows = array(
+                "q",
+                sorted(
+                    range(len(self.ids)),
+                    key=self.sort_key(ordering),
+                    reverse=ordering == "-name",
+                ),
+            )
+            self._orders[ordering] = rows
+        return rows
+
+    def position_key(self, ordering, value, last_id):
+        """Sort key of a decoded keyset cursor position."""
+        if ordering in ("updated", "updated_asc"):
+            stamp = _timestamp(value)
+            if ordering == "updated":
+                return (-stamp, -last_id)
+            return (stamp, last_id)
+        if ordering == "price":
+            return (value is None, int(value or 0), last_id)
+        if ordering == "-price":
+            return (value is None, -int(value or 0), -last_id)
+        raise KeyError(ordering)
+
+    def select(
+        self,
+        ordering,
+        category=None,
+        featured=None,
+        min_price=None,
+        max_price=None,
+        in_stock=False,
+        exclude_id=None,
+        after=None,
+    ):
+        """Return the ordered ids of every product matching the filters.
+
+        ``after`` is a ``(value, last_id)`` keyset position; only rows
+        strictly beyond it are returned.
+        """
+        mask = 0
+        if category:
+            mask = self.category_bits.get(category)
+            if mask is None:
+                return []
+        order = self.order(ordering)
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right(
+                order,
+                self.position_key(ordering, *after),
+                key=self.sort_key(ordering),
+            )
+        ids, prices, has_price = self.ids, self.prices, self.has_price
+        matches = []
+        for row in order[start:] if start else order:
+            if mask and not self.category_masks[row] & mask:
+                continue
+            if featured is not None and bool(self.featured[row]) != featured:
+                continue
+            if min_price is not None and not (has_price[row] and prices[row] >= min_price):
+                continue
+            if max_price is not None and not (has_price[row] and prices[row] <= max_price):
+                continue
+            if in_stock and self.stock[row] <= 0:
+                continue
+            if exclude_id is not None and ids[row] == exclude_id:
+                continue
+            matches.append(ids[row])
+        return matches
+
+
+def build_catalog_snapshot():
+    rows = Product.objects.filter(is_active=True).values_list(
+        "id", "price", "stock_quantity", "updated_at", "is_featured", "name"
+    )
+    memberships = Product.categories.through.objects.filter(
+        product__is_active=True
+    ).values_list("product_id", "category__slug")
+    return CatalogSnapshot(rows, memberships)
+
+
+_snapshot_lock = threading.Lock()
+_snapshot_state = {"generation": None, "stock": None, "snapshot": None}
+
+
+def get_catalog_snapshot():
+    """Return this process's catalog snapshot, or ``None`` when disabled.
+
+    The snapshot is rebuilt whenever the catalog generation has moved on; a
+    stock-only change just reloads the stock column.
+    """
+    if not getattr(settings, "CATALOG_SNAPSHOT", False):
+        return None
+    generation = get_catalog_generation()
+    stock = get_stock_generation()
+    if _snapshot_state["generation"] != generation:
+        with _snapshot_lock:
+            if _snapshot_state["generation"] != generation:
+                _snapshot_state["snapshot"] = build_catalog_snapshot()
+                _snapshot_state["generation"] = generation
+                _snapshot_state["stock"] = stock
+    elif _snapshot_state["stock"] != stock:
+        with _snapshot_lock:
+            if _snapshot_state["stock"] != stock:
+                _snapshot_state["snapshot"].refresh_stock(
+                    Product.objects.filter(is_active=True).values_list("id", "stock_quantity")
+                )
+                _snapshot_state["stock"] = stock
+    return _snapshot_state["snapshot"]
+
+
+def products_in_order(queryset, ids):
+    """Fetch ``ids`` from ``queryset`` and return them in the given order."""
+    if not ids:
+        return []
+    by_id = {product.id: product for product in queryset.filter(id__in=ids)}
+    return [by_id[product_id] for product_id in ids if product_id in by_id]
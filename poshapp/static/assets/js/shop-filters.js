@@ -343,13 +343,87 @@
         }
     };
 
+    /**
+     * Search box autocomplete backed by /api/search/suggest
+     */
+    const SearchSuggest = {
+        debounceMs: 120,
+        minLength: 2,
+
+        init(input) {
+            const list = document.createElement('ul');
+            list.className = 'pp-search-suggest';
+            list.setAttribute('role', 'listbox');
+            list.hidden = true;
+            input.setAttribute('autocomplete', 'off');
+            input.insertAdjacentElement('afterend', list);
+
+            let timer = null;
+            let lastQuery = '';
+            let controller = null;
+
+            input.addEventListener('input', () => {
+                clearTimeout(timer);
+                timer = setTimeout(async () => {
+                    const query = input.value.trim();
+                    if (query === lastQuery) return;
+                    lastQuery = query;
+                    if (query.length < this.minLength) {
+                        this.render(list, []);
+                        return;
+                    }
+                    if (controller) controller.abort();
+                    controller = new AbortController();
+                    try {
+                        const response = await fetch(
+                            `/api/search/suggest?q=${encodeURIComponent(query)}`,
+                            { signal: controller.signal }
+                        );
+                        if (!response.ok) throw new Error('Suggest failed');
+                        this.render(list, await response.json());
+                    } catch (error) {
+                        if (error.name !== 'AbortError') this.render(list, []);
+                    }
+                }, this.debounceMs);
+            });
+
+            input.addEventListener('keydown', (event) => {
+                if (event.key === 'Escape') this.render(list, []);
+            });
+
+            document.addEventListener('click', (event) => {
+                if (event.target !== input && !list.contains(event.target)) {
+                    this.render(list, []);
+                }
+            });
+        },
+
+        render(list, suggestions) {
+            list.innerHTML = '';
+            suggestions.forEach((item) => {
+                const option = document.createElement('li');
+                option.setAttribute('role', 'option');
+                const link = document.createElement('a');
+                link.href = `/products/${encodeURIComponent(item.slug)}/`;
+                link.textContent = item.name;
+                option.appendChild(link);
+                list.appendChild(option);
+            });
+            list.hidden = suggestions.length === 0;
+        }
+    };
+
     // Initialize on DOM ready
     document.addEventListener('DOMContentLoaded', () => {
         if (document.querySelector('[data-shop-filters]')) {
             ShopFilters.init();
         }
+        document.querySelectorAll('[data-search-suggest]').forEach((input) => {
+            SearchSuggest.init(input);
+        });
     });
 
     window.ShopFilters = ShopFilters;
+    window.SearchSuggest = SearchSuggest;
 
 })();
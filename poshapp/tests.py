@@ -1,11 +1,55 @@
 import hashlib
 import hmac
 import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from .models import Category, Order, Product, ProductPriceTier
+from .cart import cart_summary, reconcile_cart
+from .checkout import (
+    LATE_PAYMENT_NOTE,
+    close_pending_order,
+    fail_order_payment,
+    mark_order_paid,
+    release_order_stock,
+    reserve_stock,
+)
+from .emails import order_email_context, render_email, send_order_received_email
+from .payments import (
+    AsyncPaystackClient,
+    PaystackClient,
+    PaystackError,
+    _verify_inflight,
+    initialize_paystack_transaction,
+    verify_paystack_transaction,
+)
+from .models import (
+    Cart,
+    CartItem,
+    Category,
+    EmailOutbox,
+    IdempotencyKey,
+    Order,
+    OrderItem,
+    PaymentEvent,
+    Product,
+    ProductImage,
+    ProductPriceTier,
+)
+from .catalog import get_catalog_generation, keyset_order_by
+from .pricing import PricingEngine
+from .snapshot import get_catalog_snapshot
 
 
 class ApiTests(TestCase):
@@ -209,6 +253,10 @@ class ApiTests(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         order.refresh_from_db()
+        self.assertEqual(order.payment_status, "pending")
+
+        call_command("process_payment_events", stdout=StringIO())
+        order.refresh_from_db()
         self.assertEqual(order.payment_status, "paid")
 
     @override_settings(PAYSTACK_SECRET_KEY="test_secret")
@@ -264,3 +312,1504 @@ class ApiTests(TestCase):
 
         order = Order.objects.get(payment_reference="ref-checkout")
         self.assertEqual(order.payment_status, "pending")
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=300)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(
+            name="Cached Lock",
+            sku="CACHED-LOCK",
+            price=150000,
+            currency="NGN",
+            stock_quantity=5,
+            is_active=True,
+        )
+
+    def test_repeat_listing_is_served_from_cache(self):
+        response = self.client.get("/api/products", {"q": "cached"})
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/products", {"q": "cached"})
+        self.assertEqual([item["id"] for item in response.json()], [self.product.id])
+
+    def test_product_save_invalidates_listing(self):
+        self.client.get("/api/products", {"q": "cached"})
+        self.product.name = "Cached Lock v2"
+        self.product.save()
+        response = self.client.get("/api/products", {"q": "cached"})
+        self.assertEqual(response.json()[0]["name"], "Cached Lock v2")
+
+    def test_shop_page_is_served_from_cache(self):
+        self.client.get("/products/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/products/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Cached Lock")
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0, CATALOG_SNAPSHOT=False)
+class ProductListingQueryTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Smart Locks", slug="locks")
+        for index in range(24):
+            product = Product.objects.create(
+                name=f"Listing Lock {index}",
+                sku=f"LIST-{index}",
+                currency="NGN",
+                stock_quantity=index,
+                is_active=True,
+            )
+            product.categories.add(category)
+            ProductImage.objects.create(
+                product=product, image=f"products/lock-{index}.jpg", is_primary=True
+            )
+            ProductPriceTier.objects.create(product=product, min_quantity=1, price=320000)
+            ProductPriceTier.objects.create(product=product, min_quantity=20, price=280000)
+
+    def test_listing_page_is_single_query(self):
+        with self.assertNumQueries(1):
+            products = list(Product.objects.for_listing()[:24])
+            for product in products:
+                product.primary_image_url
+                product.tier_count
+                product.category_names
+        self.assertEqual(len(products), 24)
+        product = products[0]
+        self.assertTrue(product.primary_image_url.endswith(".jpg"))
+        self.assertEqual(product.tier_count, 2)
+        self.assertEqual(product.tier_min_price, 280000)
+        self.assertEqual(product.tier_max_price, 320000)
+        self.assertEqual(product.category_slugs, ["locks"])
+        self.assertEqual(product.category_names, ["Smart Locks"])
+
+    def test_products_page_query_count_is_constant(self):
+        # Categories, count, the annotated page, then the facet categories
+        # and their single aggregate.
+        with self.assertNumQueries(5):
+            response = self.client.get("/products/", {"per_page": 24})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "20+ units: NGN 280,000", count=24)
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductCursorPaginationTests(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(
+                name=f"Cursor Lock {index}",
+                sku=f"CURSOR-{index}",
+                price=100000 + (index % 3) * 1000 if index else None,
+                currency="NGN",
+                is_active=True,
+            )
+            for index in range(7)
+        ]
+
+    def _walk(self, ordering):
+        seen = []
+        response = self.client.get("/api/products", {"ordering": ordering, "limit": 3})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item["id"] for item in response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return seen
+            response = self.client.get(
+                "/api/products", {"ordering": ordering, "limit": 3, "cursor": cursor}
+            )
+
+    def test_cursor_walks_every_product_once(self):
+        for ordering in ("updated", "updated_asc", "price", "-price"):
+            seen = self._walk(ordering)
+            self.assertEqual(sorted(seen), sorted(p.id for p in self.products))
+
+    def test_update_mid_scroll_does_not_duplicate(self):
+        response = self.client.get("/api/products", {"limit": 3})
+        first_page = [item["id"] for item in response.json()]
+        moved = Product.objects.get(id=first_page[0])
+        moved.save()
+        response = self.client.get(
+            "/api/products", {"limit": 10, "cursor": response.headers["X-Next-Cursor"]}
+        )
+        rest = [item["id"] for item in response.json()]
+        self.assertFalse(set(first_page) & set(rest))
+        self.assertEqual(len(first_page) + len(rest), len(self.products))
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get("/api/products", {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/products", {"ordering": "name", "cursor": "x"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.cameras = Category.objects.create(name="Security Cameras", slug="cameras")
+        self.lock = Product.objects.create(
+            name="D2Pro Smart Lock",
+            sku="D2PRO-LOCK",
+            short_description="Biometric door lock",
+            is_active=True,
+        )
+        self.camera = Product.objects.create(
+            name="Outdoor Camera",
+            sku="CAM-1",
+            description="Weatherproof and pairs with any smart lock.",
+            is_active=True,
+        )
+        self.camera.categories.add(self.cameras)
+
+    def _api_ids(self, q):
+        response = self.client.get("/api/products", {"q": q})
+        self.assertEqual(response.status_code, 200)
+        return [item["id"] for item in response.json()]
+
+    def test_prefix_and_description_matches_ranked_by_relevance(self):
+        self.assertEqual(self._api_ids("lock"), [self.lock.id, self.camera.id])
+        self.assertEqual(self._api_ids("biometr"), [self.lock.id])
+
+    def test_category_names_are_searchable_and_kept_in_sync(self):
+        self.assertEqual(self._api_ids("security"), [self.camera.id])
+        self.cameras.name = "CCTV"
+        self.cameras.save()
+        self.assertEqual(self._api_ids("security"), [])
+        self.assertEqual(self._api_ids("cctv"), [self.camera.id])
+
+    def test_shop_uses_search_backend(self):
+        response = self.client.get("/products/", {"q": "weatherproof"})
+        self.assertContains(response, "Outdoor Camera")
+        self.assertNotContains(response, "D2Pro Smart Lock")
+
+    @override_settings(SEARCH_BACKEND="basic")
+    def test_basic_backend(self):
+        self.assertEqual(set(self._api_ids("lock")), {self.lock.id, self.camera.id})
+
+
+@override_settings(SUGGEST_INDEX=True)
+class ProductSuggestTests(TestCase):
+    def setUp(self):
+        locks = Category.objects.create(name="Smart Locks", slug="locks")
+        self.lock = Product.objects.create(
+            name="D2Pro Smart Lock", sku="D2PRO-LOCK", is_active=True
+        )
+        self.lock.categories.add(locks)
+        self.camera = Product.objects.create(
+            name="Outdoor Camera",
+            sku="CAM-1",
+            short_description="Weatherproof security camera",
+            is_active=True,
+        )
+
+    def _suggest(self, q):
+        response = self.client.get("/api/search/suggest", {"q": q})
+        self.assertEqual(response.status_code, 200)
+        return [item["slug"] for item in response.json()]
+
+    def test_prefix_typo_and_category_matches(self):
+        self.assertEqual(self._suggest("d2p"), [self.lock.slug])
+        self.assertEqual(self._suggest("camra"), [self.camera.slug])
+        self.assertEqual(self._suggest("smart loks"), [self.lock.slug])
+        self.assertEqual(self._suggest(""), [])
+
+    def test_served_from_memory_and_rebuilt_on_catalog_change(self):
+        self._suggest("cam")
+        with self.assertNumQueries(0):
+            self._suggest("cam")
+        doorbell = Product.objects.create(name="Video Doorbell Cam", is_active=True)
+        self.assertIn(doorbell.slug, self._suggest("cam"))
+
+    @override_settings(SUGGEST_INDEX=False)
+    def test_query_fallback_without_shared_cache(self):
+        self.assertEqual(self._suggest("d2p"), [self.lock.slug])
+        self.lock.is_active = False
+        self.lock.save()
+        self.assertEqual(self._suggest("d2p"), [])
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        self.locks = Category.objects.create(name="Smart Locks", slug="locks")
+        self.cameras = Category.objects.create(name="Cameras", slug="cameras")
+        for name, price, stock, category in [
+            ("Lock A", 150000, 4, self.locks),
+            ("Lock B", 320000, 0, self.locks),
+            ("Camera A", 90000, 2, self.cameras),
+            ("Loose Item", 550000, 1, None),
+        ]:
+            product = Product.objects.create(
+                name=name,
+                sku=name.upper().replace(" ", "-"),
+                price=price,
+                stock_quantity=stock,
+                is_active=True,
+            )
+            if category:
+                product.categories.add(category)
+
+    def test_facets_are_one_query_and_exclude_their_own_filter(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/api/products/facets", {"category": "locks", "in_stock": "true"}
+            )
+        data = response.json()
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(data["all_categories"], 3)
+        self.assertEqual(data["in_stock"], 1)
+        counts = {c["slug"]: c["count"] for c in data["categories"]}
+        self.assertEqual(counts, {"cameras": 1, "locks": 1})
+        buckets = {b["min"]: b["count"] for b in data["price_buckets"]}
+        self.assertEqual(buckets[100000], 1)
+        self.assertEqual(buckets[300000], 0)
+        self.assertEqual(buckets[0], 0)
+
+    def test_in_stock_count_ignores_its_own_filter(self):
+        data = self.client.get("/api/products/facets", {"category": "locks"}).json()
+        self.assertEqual(data["total"], 2)
+        self.assertEqual(data["in_stock"], 1)
+        buckets = {b["min"]: b["count"] for b in data["price_buckets"]}
+        self.assertEqual(buckets[300000], 1)
+
+    def test_products_page_renders_facets(self):
+        response = self.client.get("/products/")
+        self.assertEqual(response.context["facets"]["all_categories"], 4)
+        self.assertContains(response, "pp-products__facet-count")
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0, CATALOG_SNAPSHOT=True)
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        self.locks = Category.objects.create(name="Smart Locks", slug="locks")
+        for index in range(12):
+            product = Product.objects.create(
+                name=f"Snapshot Lock {index % 5}",
+                slug=f"snapshot-lock-{index}",
+                sku=f"SNAP-{index}",
+                price=None if index % 4 == 0 else 100000 + (index % 3) * 50000,
+                stock_quantity=index % 2,
+                is_featured=index % 3 == 0,
+                is_active=index != 11,
+            )
+            if index % 2:
+                product.categories.add(self.locks)
+
+    def _api_ids(self, **params):
+        ids = []
+        cursor = None
+        while True:
+            query = dict(params, limit=5)
+            if cursor:
+                query["cursor"] = cursor
+            response = self.client.get("/api/products", query)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item["id"] for item in response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return ids
+
+    def test_snapshot_pages_match_database_pages(self):
+        cases = [
+            {"ordering": "updated"},
+            {"ordering": "price", "min_price": 120000},
+            {"ordering": "-price", "category": "locks"},
+            {"ordering": "updated_asc", "featured": "true"},
+        ]
+        for params in cases:
+            with self.subTest(**params):
+                with self.settings(CATALOG_SNAPSHOT=False):
+                    expected = self._api_ids(**params)
+                self.assertEqual(self._api_ids(**params), expected)
+
+    def test_shop_filters_match_database(self):
+        snapshot = get_catalog_snapshot()
+        ids = snapshot.select("price", category="locks", in_stock=True, max_price=150000)
+        expected = list(
+            Product.objects.filter(
+                is_active=True,
+                categories__slug="locks",
+                stock_quantity__gt=0,
+                price__lte=150000,
+            )
+            .order_by(*keyset_order_by("price"))
+            .values_list("id", flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual(snapshot.select("updated", category="missing"), [])
+
+    def test_warm_snapshot_page_fetches_only_page_rows(self):
+        self.client.get("/api/products")
+        with self.assertNumQueries(4):
+            # The page rows plus their images, tiers and categories.
+            response = self.client.get("/api/products", {"ordering": "price"})
+        self.assertEqual(len(response.json()), 11)
+
+    def test_snapshot_rebuilds_on_catalog_change(self):
+        before = get_catalog_snapshot()
+        Product.objects.create(name="Fresh Lock", sku="SNAP-NEW", price=90000)
+        after = get_catalog_snapshot()
+        self.assertIsNot(before, after)
+        self.assertEqual(after.select("price")[0], Product.objects.get(sku="SNAP-NEW").id)
+
+    def test_stock_change_refreshes_only_stock(self):
+        before = get_catalog_snapshot()
+        generation = get_catalog_generation()
+        product = Product.objects.get(sku="SNAP-1")
+        self.assertIn(product.id, before.select("price", in_stock=True))
+        reserve_stock([{"product_id": product.id, "quantity": 1, "name": product.name}])
+        self.assertEqual(get_catalog_generation(), generation)
+        after = get_catalog_snapshot()
+        self.assertIs(before, after)
+        self.assertNotIn(product.id, after.select("price", in_stock=True))
+
+
+class PricingEngineTests(TestCase):
+    def setUp(self):
+        self.tiered = Product.objects.create(name="Tiered Lock", sku="TIER-1", price=350000)
+        ProductPriceTier.objects.create(product=self.tiered, min_quantity=20, price=280000)
+        ProductPriceTier.objects.create(product=self.tiered, min_quantity=1, price=320000)
+        ProductPriceTier.objects.create(product=self.tiered, min_quantity=50, price=250000)
+        self.flat = Product.objects.create(name="Flat Lock", sku="FLAT-1", price=90000)
+        self.fallback = Product.objects.create(name="D2Pro Door Lock", sku="D2P-1")
+        self.unpriced = Product.objects.create(name="Mystery Lock", sku="NONE-1")
+
+    def test_prices_resolve_from_one_tier_query(self):
+        products = [self.tiered, self.flat, self.fallback, self.unpriced]
+        with self.assertNumQueries(1):
+            pricing = PricingEngine(products)
+            prices = [
+                pricing.unit_price(self.tiered, quantity) for quantity in (None, 19, 20, 75)
+            ]
+            self.assertEqual(prices, [320000, 320000, 280000, 250000])
+            self.assertEqual(pricing.unit_price(self.flat, 30), 90000)
+            self.assertEqual(pricing.unit_price(self.fallback, 1), 320000)
+            self.assertEqual(pricing.unit_price(self.fallback, 20), 280000)
+            self.assertIsNone(pricing.unit_price(self.unpriced, 1))
+
+    def test_tier_ranges_are_inclusive(self):
+        ranges, savings, first_tier_max = PricingEngine([self.tiered]).tier_ranges(
+            self.tiered
+        )
+        self.assertEqual(
+            [(r["min"], r["max"]) for r in ranges], [(1, 19), (20, 49), (50, None)]
+        )
+        self.assertEqual(savings, 40000)
+        self.assertEqual(first_tier_max, 19)
+        self.assertEqual(
+            PricingEngine([self.fallback]).tier_ranges(self.fallback)[1:], (40000, 19)
+        )
+
+    def test_adding_units_reprices_the_whole_line(self):
+        for quantity in (10, 10):
+            response = self.client.post(
+                "/api/cart/items",
+                data=json.dumps({"product_id": self.tiered.id, "quantity": quantity}),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        line = response.json()["items"][0]
+        self.assertEqual(line["quantity"], 20)
+        self.assertEqual(line["unit_price"], 280000)
+
+
+class CartReconcileTests(TestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create(session_key="reconcile")
+        self.products = [
+            Product.objects.create(name=f"Cart Lock {i}", sku=f"CART-{i}", price=100000)
+            for i in range(4)
+        ]
+        for product in self.products:
+            CartItem.objects.create(
+                cart=self.cart, product=product, quantity=1, unit_price=90000
+            )
+        Product.objects.filter(id=self.products[3].id).update(is_active=False)
+
+    def test_summary_only_reads(self):
+        with CaptureQueriesContext(connection) as queries:
+            summary = cart_summary(self.cart)
+        self.assertTrue(all(q["sql"].startswith("SELECT") for q in queries))
+        self.assertEqual(summary["subtotal"], 300000)
+        self.assertEqual(len(summary["items"]), 3)
+        self.assertEqual(CartItem.objects.filter(unit_price=90000).count(), 4)
+
+    def test_reconcile_writes_in_bulk(self):
+        with CaptureQueriesContext(connection) as queries:
+            reconcile_cart(self.cart)
+        writes = [q["sql"].split()[0] for q in queries if not q["sql"].startswith("SELECT")]
+        self.assertEqual(writes.count("UPDATE"), 1)
+        self.assertEqual(writes.count("DELETE"), 1)
+        self.assertEqual(
+            list(self.cart.items.values_list("unit_price", flat=True).distinct()),
+            [100000],
+        )
+        self.assertEqual(self.cart.items.count(), 3)
+
+
+class CartSummaryQueryTests(TestCase):
+    def _cart_with_lines(self, count):
+        cart = Cart.objects.create(session_key=f"lines-{count}")
+        for index in range(count):
+            product = Product.objects.create(
+                name=f"Line {count}-{index}", sku=f"LINE-{count}-{index}", price=50000
+            )
+            ProductImage.objects.create(product=product, image=f"products/extra-{index}.jpg")
+            ProductImage.objects.create(
+                product=product, image=f"products/line-{index}.jpg", is_primary=True
+            )
+            ProductPriceTier.objects.create(product=product, min_quantity=1, price=45000)
+            CartItem.objects.create(cart=cart, product=product, quantity=2, unit_price=45000)
+        return cart
+
+    def test_summary_query_count_is_constant(self):
+        for count in (1, 10, 50):
+            cart = self._cart_with_lines(count)
+            with self.subTest(lines=count):
+                # Lines with their primary image path, then all price tiers.
+                with self.assertNumQueries(2):
+                    summary = cart_summary(cart)
+                self.assertEqual(len(summary["items"]), count)
+                self.assertTrue(summary["items"][0]["image"].endswith("line-0.jpg"))
+                self.assertEqual(summary["subtotal"], count * 90000)
+
+
+@override_settings(GUEST_CART_STORAGE="session")
+class GuestSessionCartTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Session Lock", sku="SESSION-1", price=150000, stock_quantity=5
+        )
+
+    def _add(self, quantity=1):
+        return self.client.post(
+            "/api/cart/items",
+            data=json.dumps({"product_id": self.product.id, "quantity": quantity}),
+            content_type="application/json",
+        )
+
+    def test_browsing_creates_no_rows_or_session(self):
+        response = self.client.get("/api/cart")
+        self.assertEqual(response.json()["items"], [])
+        self.assertNotIn("sessionid", response.cookies)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_lines_live_in_session_until_checkout(self):
+        self._add(2)
+        response = self.client.patch(
+            f"/api/cart/items/{self.product.id}",
+            data=json.dumps({"quantity": 3}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["items"][0]["line_total"], 450000)
+        self.assertFalse(Cart.objects.exists())
+
+        response = self.client.post(
+            "/api/checkout",
+            data=json.dumps(
+                {
+                    "full_name": "Guest Buyer",
+                    "email": "guest@example.com",
+                    "phone": "08000000000",
+                    "address": "Lagos, Nigeria",
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["subtotal"], 450000)
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(self.client.get("/api/cart").json()["items"], [])
+
+    def test_login_merges_session_lines(self):
+        user = get_user_model().objects.create_user("shopper", password="pw-12345")
+        self._add(2)
+        self.client.login(username="shopper", password="pw-12345")
+        cart = Cart.objects.get(user=user)
+        self.assertEqual(list(cart.items.values_list("quantity", flat=True)), [2])
+        self.assertEqual(len(self.client.get("/api/cart").json()["items"]), 1)
+
+
+@override_settings(GUEST_CART_STORAGE="db")
+class GuestCartMergeTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("merger", password="pw-12345")
+        self.tiered = Product.objects.create(name="Merge Lock", sku="MERGE-1")
+        ProductPriceTier.objects.create(product=self.tiered, min_quantity=1, price=320000)
+        ProductPriceTier.objects.create(product=self.tiered, min_quantity=20, price=280000)
+        self.flat = Product.objects.create(name="Merge Bell", sku="MERGE-2", price=50000)
+        user_cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(
+            cart=user_cart, product=self.tiered, quantity=15, unit_price=320000
+        )
+
+    def _add(self, product, quantity):
+        self.client.post(
+            "/api/cart/items",
+            data=json.dumps({"product_id": product.id, "quantity": quantity}),
+            content_type="application/json",
+        )
+
+    def test_login_upserts_guest_lines_and_deletes_guest_cart(self):
+        self._add(self.tiered, 5)
+        self._add(self.flat, 2)
+        guest_cart = Cart.objects.get(user=None)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.login(username="merger", password="pw-12345")
+        inserts = [q for q in queries if q["sql"].startswith('INSERT INTO "poshapp_cartitem"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertFalse(Cart.objects.filter(id=guest_cart.id).exists())
+        lines = dict(
+            Cart.objects.get(user=self.user).items.values_list("product_id", "unit_price")
+        )
+        self.assertEqual(lines, {self.tiered.id: 280000, self.flat.id: 50000})
+        self.assertEqual(CartItem.objects.get(product=self.tiered).quantity, 20)
+
+
+class PurgeStaleCartsTests(TestCase):
+    def setUp(self):
+        product = Product.objects.create(name="Purge Lock", sku="PURGE-1", price=1000)
+        old = timezone.now() - timedelta(days=45)
+        self.stale = []
+        for index in range(3):
+            cart = Cart.objects.create(session_key=f"stale-{index}")
+            CartItem.objects.create(cart=cart, product=product, quantity=1, unit_price=1000)
+            self.stale.append(cart.id)
+        self.revived = Cart.objects.create(session_key="revived")
+        CartItem.objects.create(
+            cart=self.revived, product=product, quantity=1, unit_price=1000
+        )
+        self.user_cart = Cart.objects.create(
+            user=get_user_model().objects.create_user("keeper")
+        )
+        Cart.objects.update(updated_at=old)
+        CartItem.objects.exclude(cart=self.revived).update(updated_at=old)
+        self.fresh = Cart.objects.create(session_key="fresh")
+
+    def test_dry_run_deletes_nothing(self):
+        out = StringIO()
+        call_command("purge_stale_carts", "--dry-run", stdout=out)
+        self.assertIn("Would purge 3 guest carts", out.getvalue())
+        self.assertEqual(Cart.objects.count(), 6)
+
+    def test_purges_only_stale_guest_carts_in_batches(self):
+        out = StringIO()
+        call_command("purge_stale_carts", "--batch-size", "2", stdout=out)
+        self.assertIn("Purged 2 guest carts...", out.getvalue())
+        self.assertIn("Purged 3 guest carts older than 30 days.", out.getvalue())
+        self.assertFalse(Cart.objects.filter(id__in=self.stale).exists())
+        self.assertEqual(
+            set(Cart.objects.values_list("id", flat=True)),
+            {self.revived.id, self.user_cart.id, self.fresh.id},
+        )
+
+
+class CheckoutServiceTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "wholesale", email="wholesale@example.com", password="pw-12345"
+        )
+        self.client.login(username="wholesale", password="pw-12345")
+        cart = Cart.objects.create(user=self.user)
+        for index in range(50):
+            product = Product.objects.create(
+                name=f"Wholesale {index}",
+                sku=f"WHOLE-{index}",
+                price=10000 + index,
+                stock_quantity=5,
+            )
+            CartItem.objects.create(cart=cart, product=product, quantity=2, unit_price=0)
+
+    def test_fifty_line_order_inserts_lines_in_one_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/checkout",
+                data=json.dumps(
+                    {
+                        "full_name": "Wholesale Buyer",
+                        "email": "wholesale@example.com",
+                        "phone": "08000000000",
+                        "address": "Kano, Nigeria",
+                    }
+                ),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        inserts = [
+            q for q in queries if q["sql"].startswith('INSERT INTO "poshapp_orderitem"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        order = Order.objects.get(id=response.json()["id"])
+        self.assertEqual(order.items.count(), 50)
+        self.assertEqual(order.subtotal, sum(2 * (10000 + i) for i in range(50)))
+        self.assertFalse(CartItem.objects.exists())
+
+
+@override_settings(PAYSTACK_SECRET_KEY="test_secret")
+class StockReservationTests(TestCase):
+    checkout = {
+        "full_name": "Stock Buyer",
+        "email": "stock@example.com",
+        "phone": "08000000000",
+        "address": "Abuja, Nigeria",
+    }
+
+    def setUp(self):
+        self.lock = Product.objects.create(
+            name="Scarce Lock", sku="SCARCE-1", price=320000, stock_quantity=3
+        )
+        self.bell = Product.objects.create(
+            name="Plenty Bell", sku="PLENTY-1", price=50000, stock_quantity=50
+        )
+
+    def _add(self, product, quantity):
+        self.client.post(
+            "/api/cart/items",
+            data=json.dumps({"product_id": product.id, "quantity": quantity}),
+            content_type="application/json",
+        )
+
+    def _stock(self):
+        return list(
+            Product.objects.filter(id__in=[self.lock.id, self.bell.id])
+            .order_by("id")
+            .values_list("stock_quantity", flat=True)
+        )
+
+    def test_checkout_reserves_stock(self):
+        self._add(self.lock, 2)
+        self._add(self.bell, 5)
+        response = self.client.post(
+            "/api/checkout", data=json.dumps(self.checkout), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._stock(), [1, 45])
+        self.assertTrue(Order.objects.get().stock_reserved)
+
+    def test_shortage_rolls_back_the_whole_order(self):
+        self._add(self.bell, 5)
+        self._add(self.lock, 4)
+        response = self.client.post(
+            "/api/checkout", data=json.dumps(self.checkout), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Scarce Lock", response.json()["detail"])
+        self.assertEqual(self._stock(), [3, 50])
+        self.assertFalse(Order.objects.exists())
+
+    def test_out_of_stock_product_is_preordered(self):
+        Product.objects.filter(id=self.lock.id).update(stock_quantity=0)
+        self._add(self.lock, 2)
+        self._add(self.bell, 5)
+        response = self.client.post(
+            "/api/checkout", data=json.dumps(self.checkout), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get()
+        self.assertEqual(
+            dict(order.items.values_list("product_id", "is_preorder")),
+            {self.lock.id: True, self.bell.id: False},
+        )
+        self.assertEqual(self._stock(), [0, 45])
+        # Closing the order returns only the stock it actually reserved.
+        self.assertTrue(fail_order_payment(order))
+        self.assertEqual(self._stock(), [0, 50])
+
+    @patch("poshapp.api.initialize_paystack_transaction")
+    def test_failed_payment_init_releases_stock_once(self, mock_init):
+        mock_init.side_effect = PaystackError("gateway down")
+        self._add(self.lock, 3)
+        response = self.client.post(
+            "/api/payments/init",
+            data=json.dumps(self.checkout),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        order = Order.objects.get()
+        self.assertEqual(order.payment_status, "failed")
+        self.assertEqual(self._stock(), [3, 50])
+        self.assertFalse(release_order_stock(order))
+        self.assertEqual(self._stock(), [3, 50])
+
+    def test_fail_order_payment_leaves_paid_order_alone(self):
+        self._add(self.lock, 1)
+        self.client.post(
+            "/api/checkout", data=json.dumps(self.checkout), content_type="application/json"
+        )
+        order = Order.objects.get()
+        Order.objects.filter(id=order.id).update(payment_status="paid")
+        self.assertFalse(fail_order_payment(order))
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, "paid")
+        self.assertTrue(order.stock_reserved)
+        self.assertEqual(self._stock(), [2, 50])
+
+
+@override_settings(PAYSTACK_SECRET_KEY="test_secret")
+class IdempotentCheckoutTests(TestCase):
+    checkout = {
+        "full_name": "Retry Buyer",
+        "email": "retry@example.com",
+        "phone": "08000000000",
+        "address": "Abuja, Nigeria",
+    }
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Retry Lock", sku="RETRY-1", price=320000, stock_quantity=5
+        )
+        self.client.post(
+            "/api/cart/items",
+            data=json.dumps({"product_id": self.product.id, "quantity": 1}),
+            content_type="application/json",
+        )
+
+    def _init(self, key):
+        return self.client.post(
+            "/api/payments/init",
+            data=json.dumps(self.checkout),
+            content_type="application/json",
+            headers={"Idempotency-Key": key},
+        )
+
+    @patch("poshapp.api.initialize_paystack_transaction")
+    def test_replay_returns_original_order(self, mock_init):
+        mock_init.return_value = {
+            "authorization_url": "https://paystack.test/once",
+            "reference": "ref-once",
+        }
+        first = self._init("key-1")
+        second = self._init("key-1")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(mock_init.call_count, 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+    @patch("poshapp.api.initialize_paystack_transaction")
+    def test_failed_request_releases_key(self, mock_init):
+        mock_init.side_effect = [
+            PaystackError("gateway down"),
+            {"authorization_url": "https://paystack.test/retry", "reference": "ref-retry"},
+        ]
+        self.assertEqual(self._init("key-2").status_code, 400)
+        response = self._init("key-2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["authorization_url"], "https://paystack.test/retry")
+
+    @patch("poshapp.views.initialize_paystack_transaction")
+    def test_form_double_submit_redirects_to_first_payment(self, mock_init):
+        mock_init.return_value = {
+            "authorization_url": "https://paystack.test/form",
+            "reference": "ref-form",
+        }
+        form = {**self.checkout, "idempotency_key": "form-key"}
+        first = self.client.post("/payments/initialize/", data=form)
+        second = self.client.post("/payments/initialize/", data=form)
+        self.assertEqual(first["Location"], "https://paystack.test/form")
+        self.assertEqual(second.status_code, 302)
+        self.assertEqual(second["Location"], "https://paystack.test/form")
+        self.assertEqual(mock_init.call_count, 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+    @patch("poshapp.api.initialize_paystack_transaction")
+    def test_stale_in_flight_claim_is_taken_over(self, mock_init):
+        mock_init.return_value = {
+            "authorization_url": "https://paystack.test/lease",
+            "reference": "ref-lease",
+        }
+        with patch("poshapp.api.complete_idempotency_key"):
+            # The first request dies before storing its response.
+            self._init("key-3")
+        self.assertEqual(self._init("key-3").status_code, 409)
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(self._init("key-3").status_code, 200)
+
+    def test_purge_drops_expired_claims_only(self):
+        now = timezone.now()
+        finished = {"authorization_url": "https://paystack.test/old"}
+        IdempotencyKey.objects.create(key="old-done", response=finished)
+        IdempotencyKey.objects.create(key="recent-done", response=finished)
+        IdempotencyKey.objects.create(key="stale-running")
+        IdempotencyKey.objects.create(key="running")
+        IdempotencyKey.objects.filter(key="old-done").update(created_at=now - timedelta(days=2))
+        IdempotencyKey.objects.filter(key__in=["recent-done", "stale-running"]).update(
+            created_at=now - timedelta(minutes=10)
+        )
+        out = StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Purged 2 idempotency keys.", out.getvalue())
+        self.assertEqual(
+            set(IdempotencyKey.objects.values_list("key", flat=True)), {"recent-done", "running"}
+        )
+
+
+class ExpirePendingOrdersTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Sweep Lock", sku="SWEEP-1", price=1000, stock_quantity=0
+        )
+        self.orders = {}
+        references = [
+            "",
+            "ref-paid",
+            "ref-failed",
+            "ref-abandoned",
+            "ref-error",
+            "ref-unknown",
+            "ref-ongoing",
+        ]
+        for reference in references:
+            order = Order.objects.create(
+                full_name="Sweep Buyer",
+                email="sweep@example.com",
+                phone="08000000000",
+                address="Abuja",
+                payment_reference=reference,
+                stock_reserved=True,
+            )
+            order.items.create(product=self.product, quantity=2, unit_price=1000)
+            self.orders[reference] = order
+        Order.objects.update(created_at=timezone.now() - timedelta(hours=3))
+        self.fresh = Order.objects.create(
+            full_name="Fresh Buyer", email="fresh@example.com", phone="0", address="Lagos"
+        )
+
+    @staticmethod
+    def _verify(reference):
+        if reference == "ref-error":
+            raise PaystackError("timeout")
+        if reference == "ref-unknown":
+            raise PaystackError("Transaction reference not found", status_code=400)
+        status = {
+            "ref-paid": "success",
+            "ref-failed": "failed",
+            "ref-ongoing": "ongoing",
+        }.get(reference, "abandoned")
+        return {"status": True, "data": {"status": status, "amount": 200000}}
+
+    def test_sweeps_stale_pending_orders(self):
+        out = StringIO()
+        with patch(
+            "poshapp.management.commands.expire_pending_orders.verify_paystack_transaction",
+            side_effect=self._verify,
+        ):
+            call_command(
+                "expire_pending_orders", "--batch-size", "2", stdout=out, stderr=StringIO()
+            )
+        self.assertIn("Paid 1, failed 1, expired 3, skipped 2.", out.getvalue())
+        statuses = {
+            reference: Order.objects.get(id=order.id).payment_status
+            for reference, order in self.orders.items()
+        }
+        self.assertEqual(
+            statuses,
+            {
+                "": "expired",
+                "ref-paid": "paid",
+                "ref-failed": "failed",
+                "ref-abandoned": "expired",
+                "ref-error": "pending",
+                "ref-unknown": "expired",
+                "ref-ongoing": "pending",
+            },
+        )
+        self.assertEqual(Order.objects.get(id=self.fresh.id).payment_status, "pending")
+        # Four closed orders each returned two units.
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 8)
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command("expire_pending_orders", "--dry-run", stdout=out)
+        self.assertIn("Would sweep 7 pending orders.", out.getvalue())
+
+
+class FakePaystackServer:
+    """Local HTTP/1.1 stand-in for the Paystack API.
+
+    ``responses`` is a queue of ``(status, body)`` pairs served in order
+    (``{"status": True, "data": {}}`` once it runs dry); ``requests`` and
+    ``connections`` record what the client sent.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        self.connections = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                fake.connections += 1
+
+            def _reply(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                fake.requests.append((self.command, self.path, body))
+                status, payload = (
+                    fake.responses.pop(0) if fake.responses else (200, {"status": True, "data": {}})
+                )
+                raw = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            do_GET = do_POST = _reply
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(PAYSTACK_SECRET_KEY="test_secret", PAYSTACK_RETRY_BACKOFF=0)
+class PaystackClientTests(TestCase):
+    def setUp(self):
+        self.server = FakePaystackServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+
+    def _client(self, **kwargs):
+        client = PaystackClient(self.server.url, retry_backoff=0, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_calls_reuse_one_keep_alive_connection(self):
+        with override_settings(PAYSTACK_BASE_URL=self.server.url):
+            order = Order(id=7, payment_reference="ref-pool")
+            self.server.responses = [
+                (200, {"status": True, "data": {"authorization_url": "https://pay.test/x"}}),
+                (200, {"status": True, "data": {"status": "success"}}),
+            ]
+            payment = initialize_paystack_transaction(
+                order, "pool@example.com", 1000, "NGN", "https://shop.test/cb"
+            )
+            verified = verify_paystack_transaction("ref-pool")
+        self.assertEqual(payment["reference"], "ref-pool")
+        self.assertEqual(verified["data"]["status"], "success")
+        self.assertEqual(self.server.connections, 1)
+        method, path, body = self.server.requests[0]
+        self.assertEqual((method, path), ("POST", "/transaction/initialize"))
+        self.assertEqual(json.loads(body)["amount"], 100000)
+
+    def test_verify_retries_transient_errors(self):
+        client = self._client(max_retries=2)
+        self.server.responses = [(503, {}), (502, {}), (200, {"status": True})]
+        result = client.request("GET", "/transaction/verify/ref", retry=True, name="verify")
+        self.assertEqual(result, {"status": True})
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(client.metrics["verify"]["retries"], 2)
+        self.assertEqual(client.metrics["verify"]["errors"], 0)
+
+    def test_initialize_is_not_retried(self):
+        client = self._client(max_retries=2)
+        self.server.responses = [(503, {"message": "Try again"})]
+        with self.assertRaisesMessage(PaystackError, "Try again (HTTP 503)"):
+            client.request("POST", "/transaction/initialize", payload={"a": 1})
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_error_detail_from_json_body(self):
+        client = self._client()
+        self.server.responses = [
+            (400, {"message": "Invalid key", "code": "bad_key", "meta": {"reason": "test"}})
+        ]
+        with self.assertRaisesMessage(PaystackError, "Invalid key (code bad_key): test (HTTP 400)"):
+            client.request("GET", "/transaction/verify/ref")
+
+
+@override_settings(PAYSTACK_SECRET_KEY="test_secret")
+class AsyncPaymentInitTests(TestCase):
+    checkout = {
+        "full_name": "Async Buyer",
+        "email": "async@example.com",
+        "phone": "08000000000",
+        "address": "Abuja, Nigeria",
+    }
+
+    def setUp(self):
+        self.server = FakePaystackServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.product = Product.objects.create(
+            name="Async Lock", sku="ASYNC-1", price=320000, stock_quantity=5
+        )
+        self.client.post(
+            "/api/cart/items",
+            data=json.dumps({"product_id": self.product.id, "quantity": 2}),
+            content_type="application/json",
+        )
+
+    async def test_async_client_reads_json(self):
+        self.server.responses = [(200, {"status": True, "data": {"ok": 1}})]
+        client = AsyncPaystackClient(self.server.url)
+        result = await client.request("POST", "/transaction/initialize", payload={"a": 1})
+        self.assertEqual(result["data"], {"ok": 1})
+        self.assertEqual(json.loads(self.server.requests[0][2]), {"a": 1})
+
+        self.server.responses = [(401, {"message": "Invalid key"})]
+        with self.assertRaisesMessage(PaystackError, "Invalid key (HTTP 401)"):
+            await client.request("GET", "/transaction/verify/ref")
+
+    def test_api_endpoint(self):
+        self.server.responses = [
+            (
+                200,
+                {
+                    "status": True,
+                    "data": {"authorization_url": "https://pay.test/async", "reference": "ref-async"},
+                },
+            )
+        ]
+        with override_settings(PAYSTACK_BASE_URL=self.server.url):
+            response = self.client.post(
+                "/api/payments/init-async",
+                data=json.dumps(self.checkout),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["authorization_url"], "https://pay.test/async")
+        order = Order.objects.get(id=data["order_id"])
+        self.assertEqual(order.payment_reference, "ref-async")
+        self.assertEqual(json.loads(self.server.requests[0][2])["amount"], 64000000)
+
+    def test_form_view_failure_releases_stock(self):
+        self.server.responses = [(503, {"message": "Gateway down"})]
+        with override_settings(PAYSTACK_BASE_URL=self.server.url):
+            response = self.client.post(
+                "/payments/initialize/async/",
+                data={**self.checkout, "idempotency_key": "async-key"},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Payment initialization failed", response.content.decode())
+        self.assertEqual(Order.objects.get().payment_status, "failed")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 5)
+
+
+@override_settings(PAYSTACK_SECRET_KEY="webhook_secret")
+class PaymentEventInboxTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(
+            full_name="Inbox Buyer",
+            email="inbox@example.com",
+            phone="08000000000",
+            address="Abuja",
+            subtotal=280000,
+            amount=280000,
+            payment_reference="ref-inbox",
+        )
+
+    def _deliver(self, event, reference):
+        payload = json.dumps(
+            {"event": event, "data": {"reference": reference, "amount": 28000000}}
+        ).encode("utf-8")
+        signature = hmac.new(b"webhook_secret", payload, hashlib.sha512).hexdigest()
+        return self.client.post(
+            "/payments/webhook/",
+            data=payload,
+            content_type="application/json",
+            HTTP_X_PAYSTACK_SIGNATURE=signature,
+        )
+
+    @patch("poshapp.webhooks.send_payment_confirmed_email")
+    def test_redeliveries_are_stored_and_applied_once(self, mock_email):
+        for _ in range(3):
+            self.assertEqual(self._deliver("charge.success", "ref-inbox").status_code, 200)
+        self._deliver("transfer.success", "ref-inbox")
+        self.assertEqual(PaymentEvent.objects.count(), 2)
+        mock_email.assert_not_called()
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("process_payment_events", stdout=out)
+        self.assertIn("Processed 2, will retry 0, failed 0.", out.getvalue())
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, "paid")
+        mock_email.assert_called_once()
+        self.assertFalse(PaymentEvent.objects.exclude(status="processed").exists())
+
+    @patch("poshapp.webhooks.mark_order_paid", side_effect=RuntimeError("db down"))
+    def test_failing_event_is_retried_then_failed(self, mock_paid):
+        self._deliver("charge.success", "ref-inbox")
+        for _ in range(2):
+            call_command(
+                "process_payment_events", "--max-attempts", "2", stdout=StringIO(), stderr=StringIO()
+            )
+        payment_event = PaymentEvent.objects.get()
+        self.assertEqual((payment_event.status, payment_event.attempts), ("failed", 2))
+        self.assertEqual(payment_event.last_error, "db down")
+
+        mock_paid.side_effect = None
+        call_command("process_payment_events", "--retry-failed", stdout=StringIO())
+        self.assertEqual(PaymentEvent.objects.get().status, "processed")
+
+
+class MarkOrderPaidTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(
+            full_name="Race Buyer",
+            email="race@example.com",
+            phone="08000000000",
+            address="Abuja",
+            subtotal=280000,
+            amount=280000,
+            payment_reference="ref-race",
+        )
+
+    def test_only_first_caller_transitions(self):
+        data = {"amount": 28000000, "currency": "NGN"}
+        with self.assertNumQueries(1):
+            self.assertTrue(mark_order_paid("ref-race", data))
+        self.assertFalse(mark_order_paid("ref-race", data))
+        self.assertFalse(mark_order_paid("", data))
+        self.order.refresh_from_db()
+        self.assertEqual(
+            (self.order.payment_status, self.order.status, self.order.payment_method),
+            ("paid", "processing", "paystack"),
+        )
+        self.assertIsNotNone(self.order.paid_at)
+
+    def test_late_success_on_expired_order_is_flagged(self):
+        product = Product.objects.create(
+            name="Late Lock", sku="LATE-1", price=280000, stock_quantity=0
+        )
+        self.order.items.create(product=product, quantity=1, unit_price=280000)
+        Order.objects.filter(id=self.order.id).update(stock_reserved=True)
+        self.assertTrue(close_pending_order(self.order, "expired"))
+        for _ in range(2):
+            self.assertFalse(mark_order_paid("ref-race", {"amount": 28000000}))
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.paid_at), ("expired", None))
+        self.assertEqual(self.order.internal_note, LATE_PAYMENT_NOTE)
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 1)
+
+    @override_settings(PAYSTACK_SECRET_KEY="test_secret")
+    @patch("poshapp.webhooks.send_payment_confirmed_email")
+    @patch("poshapp.views.send_payment_confirmed_email")
+    @patch("poshapp.views.verify_paystack_transaction")
+    def test_callback_and_webhook_send_one_email(self, mock_verify, view_email, inbox_email):
+        data = {"status": "success", "reference": "ref-race", "amount": 28000000}
+        mock_verify.return_value = {"status": True, "data": data}
+        PaymentEvent.objects.create(
+            event="charge.success", reference="ref-race", payload={"data": data}
+        )
+        self.client.get("/payments/callback/?reference=ref-race")
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("process_payment_events", stdout=StringIO())
+        self.assertEqual(view_email.call_count + inbox_email.call_count, 1)
+
+
+@override_settings(PAYSTACK_SECRET_KEY="test_secret", PAYSTACK_VERIFY_CACHE_TIMEOUT=60)
+class PaymentCallbackShortCircuitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.order = Order.objects.create(
+            full_name="Callback Buyer",
+            email="callback@example.com",
+            phone="08000000000",
+            address="Abuja",
+            subtotal=280000,
+            amount=280000,
+            payment_reference="ref-settled",
+        )
+
+    @patch("poshapp.views.verify_paystack_transaction")
+    def test_paid_order_skips_verification(self, mock_verify):
+        mark_order_paid("ref-settled", {})
+        response = self.client.get("/payments/callback/?reference=ref-settled")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["payment_success"])
+        mock_verify.assert_not_called()
+
+    @patch("poshapp.webhooks.send_payment_confirmed_email")
+    @patch("poshapp.views.verify_paystack_transaction")
+    def test_unsettled_callback_then_webhook_pays_order(self, mock_verify, mock_email):
+        product = Product.objects.create(
+            name="Callback Lock", sku="CALLBACK-1", price=280000, stock_quantity=0
+        )
+        self.order.items.create(product=product, quantity=1, unit_price=280000)
+        Order.objects.filter(id=self.order.id).update(stock_reserved=True)
+        mock_verify.return_value = {"status": True, "data": {"status": "ongoing"}}
+        response = self.client.get("/payments/callback/?reference=ref-settled")
+        self.assertContains(response, "still processing")
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.stock_reserved), ("pending", True))
+
+        PaymentEvent.objects.create(
+            event="charge.success",
+            reference="ref-settled",
+            payload={"data": {"reference": "ref-settled", "amount": 28000000}},
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("process_payment_events", stdout=StringIO())
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, "paid")
+        self.assertEqual(self.order.internal_note, "")
+        mock_email.assert_called_once()
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 0)
+
+    @patch("poshapp.views.verify_paystack_transaction")
+    def test_unknown_reference_skips_verification(self, mock_verify):
+        response = self.client.get("/payments/callback/?reference=ref-unknown")
+        self.assertEqual(response.status_code, 400)
+        mock_verify.assert_not_called()
+
+    def test_concurrent_verifies_share_one_request(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_verify(reference):
+            calls.append(reference)
+            release.wait(5)
+            return {"status": True, "data": {"status": "success"}}
+
+        results = []
+        with patch("poshapp.payments._verify", side_effect=slow_verify):
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(
+                        verify_paystack_transaction("ref-settled", cached=True)
+                    )
+                )
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            release.set()
+            for thread in threads:
+                thread.join()
+            verify_paystack_transaction("ref-settled", cached=True)
+        self.assertEqual(calls, ["ref-settled"])
+        self.assertEqual(len(results), 4)
+        self.assertEqual(_verify_inflight, {})
+
+    @patch("poshapp.payments._verify")
+    def test_unsettled_answers_are_not_cached(self, mock_verify):
+        mock_verify.return_value = {"status": True, "data": {"status": "ongoing"}}
+        verify_paystack_transaction("ref-settled", cached=True)
+        mock_verify.return_value = {"status": True, "data": {"status": "success"}}
+        response = verify_paystack_transaction("ref-settled", cached=True)
+        self.assertEqual(response["data"]["status"], "success")
+        verify_paystack_transaction("ref-settled", cached=True)
+        self.assertEqual(mock_verify.call_count, 2)
+
+
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.orders = [
+            Order.objects.create(
+                full_name=f"Mail Buyer {index}",
+                email=f"mail{index}@example.com",
+                phone="08000000000",
+                address="Abuja",
+                subtotal=280000,
+                amount=280000,
+            )
+            for index in range(3)
+        ]
+
+    def test_emails_are_queued_then_sent_over_one_connection(self):
+        for order in self.orders:
+            self.assertTrue(send_order_received_email(order))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailOutbox.objects.filter(status="pending").count(), 3)
+
+        out = StringIO()
+        with patch("poshapp.emails.get_connection", wraps=mail.get_connection) as connect:
+            call_command("send_outbox", "--batch-size", "2", stdout=out)
+        self.assertIn("Sent 3, will retry 0, failed 0.", out.getvalue())
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ["mail0@example.com", "mail1@example.com", "mail2@example.com"],
+        )
+        self.assertFalse(EmailOutbox.objects.exclude(status="sent").exists())
+        # Delivered bodies are not kept.
+        self.assertFalse(EmailOutbox.objects.exclude(body="", html_body="").exists())
+
+    def test_failures_back_off_then_fail(self):
+        send_order_received_email(self.orders[0])
+        connection = mail.get_connection()
+        with patch.object(connection, "send_messages", side_effect=OSError("smtp down")), patch(
+            "poshapp.emails.get_connection", return_value=connection
+        ):
+            call_command("send_outbox", "--max-attempts", "2", stdout=StringIO(), stderr=StringIO())
+            row = EmailOutbox.objects.get()
+            self.assertEqual((row.status, row.attempts, row.last_error), ("pending", 1, "smtp down"))
+            self.assertGreater(row.next_attempt_at, timezone.now())
+
+            # Not due yet: nothing is claimed.
+            call_command("send_outbox", stdout=StringIO())
+            self.assertEqual(EmailOutbox.objects.get().attempts, 1)
+
+            EmailOutbox.objects.update(next_attempt_at=timezone.now())
+            call_command("send_outbox", "--max-attempts", "2", stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(EmailOutbox.objects.get().status, "failed")
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_purge_removes_old_sent_and_failed_rows(self):
+        for order in self.orders:
+            send_order_received_email(order)
+        first, second, third = EmailOutbox.objects.order_by("id")
+        EmailOutbox.objects.filter(id=first.id).update(status="sent")
+        EmailOutbox.objects.filter(id=second.id).update(status="failed")
+        EmailOutbox.objects.update(created_at=timezone.now() - timedelta(days=40))
+        out = StringIO()
+        call_command("purge_email_outbox", "--days", "30", stdout=out)
+        self.assertIn("Purged 2 outbox messages older than 30 days.", out.getvalue())
+        self.assertEqual(list(EmailOutbox.objects.values_list("id", flat=True)), [third.id])
+
+    @override_settings(EMAIL_OUTBOX=False)
+    def test_inline_mode_sends_immediately(self):
+        send_order_received_email(self.orders[0])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(EmailOutbox.objects.exists())
+
+
+class EmailRenderingTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(
+            full_name="Ada & Sons",
+            email="ada@example.com",
+            phone="08000000000",
+            address="Abuja",
+            subtotal=640000,
+            amount=640000,
+        )
+        product = Product.objects.create(name="Gate Lock", sku="GATE-1", price=320000)
+        OrderItem.objects.create(order=self.order, product=product, quantity=2, unit_price=320000)
+
+    def test_multipart_render_shares_one_items_query(self):
+        with self.assertNumQueries(1):
+            text, html = render_email(
+                "order_received",
+                order_email_context(self.order, self.order.items.select_related("product")),
+            )
+        self.assertIn("Hello Ada & Sons,", text)
+        self.assertIn("Gate Lock x 2 (NGN 640,000)", text)
+        self.assertIn("Ada &amp; Sons", html)
+        self.assertIn("<table", html)
+
+        order = Order.objects.prefetch_related("items__product").get(id=self.order.id)
+        with self.assertNumQueries(0):
+            render_email("order_paid", order_email_context(order))
+
+    def test_outbox_sends_html_alternative(self):
+        send_order_received_email(self.order)
+        call_command("send_outbox", stdout=StringIO())
+        message = mail.outbox[0]
+        self.assertIn("Gate Lock", message.body)
+        self.assertEqual(message.alternatives[0][1], "text/html")
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("bench_order_emails", "--count", "20", stdout=out)
+        self.assertIn("Rendered 20 order_paid emails", out.getvalue())
+
+
+class BulkOrderResendTests(TestCase):
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user(
+            username="staff", email="staff@example.com", password="pass", is_staff=True
+        )
+        self.client.force_login(self.staff)
+        product = Product.objects.create(name="Resend Lock", sku="RESEND-1", price=320000)
+        self.orders = []
+        for index, payment_status in enumerate(["paid", "paid", "pending"]):
+            order = Order.objects.create(
+                full_name=f"Resend Buyer {index}",
+                email=f"resend{index}@example.com",
+                phone="08000000000",
+                address="Abuja",
+                subtotal=320000,
+                amount=320000,
+                payment_status=payment_status,
+                confirmation_sent_at=timezone.now(),
+            )
+            OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=320000)
+            self.orders.append(order)
+
+    def _resend(self, payload):
+        return self.client.post(
+            "/poshadmin/api/orders/resend/",
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+
+    def test_resend_by_ids_queues_in_bulk(self):
+        ids = [self.orders[0].id, self.orders[2].id, 999999]
+        # session + user, orders, items with products, outbox insert, sent_at update
+        with self.assertNumQueries(6):
+            response = self._resend({"order_ids": ids})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            {row["id"]: row["status"] for row in data["results"]},
+            {ids[0]: "queued", ids[1]: "queued", 999999: "not_found"},
+        )
+        self.assertEqual(data["counts"], {"queued": 2, "not_found": 1})
+        self.assertEqual(
+            sorted(EmailOutbox.objects.values_list("recipient", flat=True)),
+            ["resend0@example.com", "resend2@example.com"],
+        )
+
+    @override_settings(EMAIL_OUTBOX=False)
+    def test_resend_by_filter_sends_over_one_connection(self):
+        with patch("poshapp.emails.get_connection", wraps=mail.get_connection) as connect:
+            response = self._resend({"payment_status": "paid", "email": "order_paid"})
+        self.assertEqual(response.json()["counts"], {"sent": 2})
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertTrue(mail.outbox[0].subject.startswith("Payment confirmed"))
+
+    def test_single_order_resend_keeps_its_contract(self):
+        order = self.orders[0]
+        sent_at = order.confirmation_sent_at
+        response = self.client.post(f"/poshadmin/api/orders/{order.id}/resend/")
+        self.assertEqual(response.json(), {"success": True})
+        # Already confirmed: nothing is queued and the stamp is unchanged.
+        self.assertFalse(EmailOutbox.objects.exists())
+        order.refresh_from_db()
+        self.assertEqual(order.confirmation_sent_at, sent_at)
+
+    def test_payment_email_skips_unpaid_orders(self):
+        ids = [order.id for order in self.orders]
+        data = self._resend({"order_ids": ids, "email": "order_paid"}).json()
+        self.assertEqual(data["counts"], {"queued": 2, "skipped": 1})
+        self.assertEqual(
+            list(
+                Order.objects.filter(payment_confirmation_sent_at__isnull=False)
+                .order_by("id")
+                .values_list("id", flat=True)
+            ),
+            ids[:2],
+        )
+        self.assertFalse(EmailOutbox.objects.filter(order=self.orders[2]).exists())
+
+    def test_rejects_requests_without_a_selection(self):
+        self.assertEqual(self._resend({}).status_code, 400)
+        self.assertEqual(self._resend({"order_ids": [1], "email": "nope"}).status_code, 400)
+        self.assertEqual(self._resend({"order_ids": "123"}).status_code, 400)
+        self.assertEqual(self._resend({"order_ids": [1, "2"]}).status_code, 400)
+        self.assertEqual(self._resend({"status": "bogus"}).status_code, 400)
+        self.assertEqual(
+            self._resend({"status": "new", "payment_status": "bogus"}).status_code, 400
+        )
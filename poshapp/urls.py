@@ -13,6 +13,7 @@ urlpatterns = [
     path("cart/", views.cart_view, name="cart"),
     path("checkout/", views.checkout, name="checkout"),
     path("payments/initialize/", views.payment_initialize, name="payment_initialize"),
+    path("payments/initialize/async/", views.payment_initialize_async, name="payment_initialize_async"),
     path("payments/callback/", views.payment_callback, name="payment_callback"),
     path("payments/webhook/", views.payment_webhook, name="payment_webhook"),
     path("track-order/", views.track_order, name="track_order"),
@@ -58,6 +59,7 @@ urlpatterns = [
     path("poshadmin/api/settings/", views.poshadmin_api_settings, name="poshadmin_api_settings"),
     path("poshadmin/api/orders/<int:pk>/", views.poshadmin_api_order_update, name="poshadmin_api_order_update"),
     path("poshadmin/api/orders/<int:pk>/resend/", views.poshadmin_api_order_resend, name="poshadmin_api_order_resend"),
+    path("poshadmin/api/orders/resend/", views.poshadmin_api_orders_resend, name="poshadmin_api_orders_resend"),
     path("poshadmin/api/customers/<int:pk>/status/", views.poshadmin_api_customer_status, name="poshadmin_api_customer_status"),
     path("poshadmin/api/categories/", views.poshadmin_api_categories, name="poshadmin_api_categories"),
 ]
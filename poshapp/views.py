@@ -1,17 +1,13 @@
 import json
 import logging
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import login, logout as auth_logout
 from django.contrib.admin.views.decorators import staff_member_required
-from django.contrib.auth.tokens import default_token_generator
 from django.db import models, transaction
-from django.http import HttpResponseBadRequest, JsonResponse
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.utils import timezone
 from django.utils.text import slugify
-from django.utils.encoding import force_bytes
-from django.utils.http import urlsafe_base64_encode
-from django.utils.crypto import get_random_string
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.csrf import ensure_csrf_cookie
 
@@ -26,9 +22,31 @@ from .models import (
     SiteSettings,
     User,
 )
-from .cart import cart_summary, get_cart
+from .cart import cart_summary, clear_cart, get_cart, materialize_cart, reconcile_cart
+from .checkout import (
+    EXPIRED_STATUSES,
+    FAILED_STATUSES,
+    InsufficientStock,
+    create_pending_order,
+    fail_order_payment,
+    mark_order_paid,
+    start_order_payment,
+)
+from .catalog import CATALOG_ORDERING, bump_catalog_generation, cached_catalog_read
+from .facets import compute_facets
+from .idempotency import (
+    IdempotencyConflict,
+    claim_idempotency_key,
+    complete_idempotency_key,
+    release_idempotency_key,
+)
+from .pricing import PricingEngine
+from .search import search_products
+from .snapshot import SNAPSHOT_ORDERING, get_catalog_snapshot, products_in_order
+from .webhooks import record_payment_event
 from .payments import (
     PaystackError,
+    ainitialize_paystack_transaction,
     build_paystack_metadata,
     get_paystack_callback_url,
     initialize_paystack_transaction,
@@ -36,9 +54,10 @@ from .payments import (
     verify_paystack_transaction,
 )
 from .emails import (
+    RESENDABLE_EMAILS,
+    resend_order_emails,
     send_order_received_email,
     send_payment_confirmed_email,
-    send_welcome_new_user_email,
 )
 
 logger = logging.getLogger(__name__)
@@ -52,33 +71,87 @@ def logout_view(request):
     return JsonResponse({"error": "Method not allowed"}, status=405)
 
 
-def _get_shop_queryset(request, exclude_id=None):
+def _load_shop_page(
+    category_slug,
+    query,
+    min_price,
+    max_price,
+    in_stock,
+    order_by,
+    page,
+    per_page,
+    exclude_id,
+):
     base_queryset = (
-        Product.objects.prefetch_related("images", "price_tiers", "categories")
-        .filter(is_active=True)
+        Product.objects.filter(is_active=True)
         .order_by("-updated_at", "name")
     )
     if exclude_id:
         base_queryset = base_queryset.exclude(id=exclude_id)
-    categories = Category.objects.filter(is_active=True).order_by("name")
-    category_slug = request.GET.get("category")
+    categories = list(Category.objects.filter(is_active=True).order_by("name"))
     active_category = None
     if category_slug:
-        active_category = categories.filter(slug=category_slug).first()
+        active_category = next((c for c in categories if c.slug == category_slug), None)
         if active_category:
             base_queryset = base_queryset.filter(categories__slug=category_slug)
+    start = (page - 1) * per_page
+    snapshot = None if query else get_catalog_snapshot()
+    if snapshot is not None:
+        ids = snapshot.select(
+            SNAPSHOT_ORDERING.get(order_by, "newest"),
+            category=active_category.slug if active_category else None,
+            min_price=min_price,
+            max_price=max_price,
+            in_stock=in_stock,
+            exclude_id=exclude_id,
+        )
+        return {
+            "products": products_in_order(
+                Product.objects.for_listing(), ids[start : start + per_page]
+            ),
+            "total_count": len(ids),
+            "categories": categories,
+            "active_category": active_category,
+        }
+    if query:
+        base_queryset = search_products(base_queryset, query)
+        if not order_by:
+            base_queryset = base_queryset.order_by("-search_rank", "-updated_at", "name")
+    if min_price is not None:
+        base_queryset = base_queryset.filter(price__gte=min_price)
+    if max_price is not None:
+        base_queryset = base_queryset.filter(price__lte=max_price)
+    if in_stock:
+        base_queryset = base_queryset.filter(stock_quantity__gt=0)
+    if min_price is not None and max_price is not None and min_price > max_price:
+        base_queryset = base_queryset.filter(price__gte=max_price, price__lte=min_price)
+    if order_by:
+        base_queryset = base_queryset.order_by(order_by)
+    total_count = base_queryset.count()
+    products = (
+        list(base_queryset.for_listing()[start : start + per_page])
+        if total_count
+        else []
+    )
+    return {
+        "products": products,
+        "total_count": total_count,
+        "categories": categories,
+        "active_category": active_category,
+    }
+
+
+def _parse_shop_filters(request):
+    """Normalize the shop filter params to (category, q, min, max, in_stock)."""
+    category_slug = request.GET.get("category") or ""
     query = request.GET.get("q", "").strip()
     if not query:
         legacy_product = request.GET.get("product", "").strip()
         if legacy_product:
             query = legacy_product
-    if query:
-        base_queryset = base_queryset.filter(
-            models.Q(name__icontains=query) | models.Q(sku__icontains=query)
-        )
     min_price_raw = request.GET.get("min_price")
     max_price_raw = request.GET.get("max_price")
-    in_stock_raw = request.GET.get("in_stock")
+    in_stock = request.GET.get("in_stock") in {"true", "1", "yes", "on"}
     try:
         min_price = int(min_price_raw) if min_price_raw else None
     except ValueError:
@@ -87,30 +160,24 @@ def _get_shop_queryset(request, exclude_id=None):
         max_price = int(max_price_raw) if max_price_raw else None
     except ValueError:
         max_price = None
-    if min_price is not None:
-        base_queryset = base_queryset.filter(price__gte=min_price)
-    if max_price is not None:
-        base_queryset = base_queryset.filter(price__lte=max_price)
-    if in_stock_raw in {"true", "1", "yes", "on"}:
-        base_queryset = base_queryset.filter(stock_quantity__gt=0)
-    invalid_price_range = False
-    if min_price is not None and max_price is not None and min_price > max_price:
-        invalid_price_range = True
-        min_price, max_price = max_price, min_price
-        base_queryset = base_queryset.filter(price__gte=min_price, price__lte=max_price)
-    ordering = request.GET.get("ordering")
-    ordering_map = {
-        "updated": "-updated_at",
-        "updated_asc": "updated_at",
-        "price": "price",
-        "-price": "-price",
-        "name": "name",
-        "-name": "-name",
-    }
-    order_by = ordering_map.get(ordering)
-    if order_by:
-        base_queryset = base_queryset.order_by(order_by)
-    total_count = base_queryset.count()
+    return category_slug, query, min_price, max_price, in_stock
+
+
+def _get_shop_facets(request, exclude_id=None):
+    filters = _parse_shop_filters(request)
+    return cached_catalog_read(
+        "facets",
+        filters + (exclude_id,),
+        lambda: compute_facets(*filters, exclude_id=exclude_id),
+    )
+
+
+def _get_shop_queryset(request, exclude_id=None):
+    category_slug, query, min_price, max_price, in_stock = _parse_shop_filters(request)
+    invalid_price_range = (
+        min_price is not None and max_price is not None and min_price > max_price
+    )
+    order_by = CATALOG_ORDERING.get(request.GET.get("ordering"))
     per_page_raw = request.GET.get("per_page", "6")
     page_raw = request.GET.get("page", "1")
     try:
@@ -121,9 +188,25 @@ def _get_shop_queryset(request, exclude_id=None):
         page = max(1, int(page_raw))
     except ValueError:
         page = 1
+
+    cache_params = (
+        category_slug,
+        query,
+        min_price,
+        max_price,
+        in_stock,
+        order_by,
+        page,
+        per_page,
+        exclude_id,
+    )
+    result = cached_catalog_read(
+        "shop", cache_params, lambda: _load_shop_page(*cache_params)
+    )
+    products = result["products"]
+    total_count = result["total_count"]
     start = (page - 1) * per_page
     end = start + per_page
-    products = base_queryset[start:end]
     total_pages = (total_count + per_page - 1) // per_page if per_page else 1
 
     filter_count = 0
@@ -131,9 +214,9 @@ def _get_shop_queryset(request, exclude_id=None):
         filter_count += 1
     if query:
         filter_count += 1
-    if min_price_raw or max_price_raw:
+    if request.GET.get("min_price") or request.GET.get("max_price"):
         filter_count += 1
-    if in_stock_raw in {"true", "1", "yes", "on"}:
+    if in_stock:
         filter_count += 1
 
     params = request.GET.copy()
@@ -157,87 +240,14 @@ def _get_shop_queryset(request, exclude_id=None):
         "invalid_price_range": invalid_price_range,
         "filter_count": filter_count,
     }
-    return products, categories, active_category, pagination
-
-
-def _get_or_create_user_from_checkout(email, full_name, phone):
-    """
-    Get existing user by email or create a new one.
-    Returns (user, is_new_user, temp_password, password_reset_url)
-    """
-    user = User.objects.filter(email__iexact=email).first()
-    if user:
-        return user, False, None, None
-    
-    # Create new user using email as username (consistent with signup form)
-    username = email
-    
-    # Parse full name into first and last
-    name_parts = full_name.strip().split(maxsplit=1)
-    first_name = name_parts[0] if name_parts else ""
-    last_name = name_parts[1] if len(name_parts) > 1 else ""
-    
-    temp_password = get_random_string(length=12)
-    user = User.objects.create_user(
-        username=username,
-        email=email,
-        first_name=first_name,
-        last_name=last_name,
-        phone_number=phone,
-        password=temp_password,
-    )
-
-    from django.conf import settings
-    uid = urlsafe_base64_encode(force_bytes(user.pk))
-    token = default_token_generator.make_token(user)
-    password_reset_url = f"{settings.SITE_URL}/accounts/reset/{uid}/{token}/"
-
-    return user, True, temp_password, password_reset_url
-
-
-def _create_pending_order(request, form, summary):
-    with transaction.atomic():
-        user_for_order = request.user if request.user.is_authenticated else None
-        order = Order.objects.create(
-            user=user_for_order,
-            full_name=form.cleaned_data["full_name"],
-            email=form.cleaned_data["email"],
-            phone=form.cleaned_data["phone"],
-            address=form.cleaned_data["address"],
-            notes=form.cleaned_data.get("notes", ""),
-            subtotal=summary["subtotal"],
-            amount=summary["subtotal"],
-            currency=summary["currency"],
-            payment_status="pending",
-            payment_method="paystack",
-        )
-        for item in get_cart(request).items.select_related("product"):
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                unit_price=item.unit_price,
-                currency=item.currency,
-            )
-        temp_password = None
-        password_reset_url = None
-        is_new_user = False
-        if not request.user.is_authenticated:
-            user_for_order, is_new_user, temp_password, password_reset_url = _get_or_create_user_from_checkout(
-                form.cleaned_data["email"],
-                form.cleaned_data["full_name"],
-                form.cleaned_data["phone"],
-            )
-            order.user = user_for_order
-            order.save(update_fields=["user"])
-    return order, is_new_user, temp_password, password_reset_url
+    return products, result["categories"], result["active_category"], pagination
 
 
 @ensure_csrf_cookie
 def home(request):
     products = (
-        Product.objects.filter(is_active=True)
-        .prefetch_related("images", "categories")
+        Product.objects.for_listing()
+        .filter(is_active=True)
         .order_by("-updated_at", "name")
     )
     return render(request, "index.html", {"products": products})
@@ -246,7 +256,7 @@ def home(request):
 @ensure_csrf_cookie
 def shop(request):
     products, categories, active_category, pagination = _get_shop_queryset(request)
-    product = products.first()
+    product = products[0] if products else None
     return render(
         request,
         "shop.html",
@@ -262,41 +272,18 @@ def shop(request):
 
 @ensure_csrf_cookie
 def product_detail(request, slug):
-    product = get_object_or_404(
-        Product.objects.prefetch_related("images", "price_tiers", "categories"),
-        slug=slug,
-        is_active=True,
+    product = cached_catalog_read(
+        "product",
+        (slug,),
+        lambda: Product.objects.prefetch_related("images", "price_tiers", "categories")
+        .filter(slug=slug, is_active=True)
+        .first(),
+    )
+    if product is None:
+        raise Http404("No Product matches the given query.")
+    tier_ranges, tier_savings, first_tier_max = PricingEngine([product]).tier_ranges(
+        product
     )
-    tiers = list(product.price_tiers.all())
-    tier_ranges = []
-    tier_savings = None
-    first_tier_max = None
-    if tiers:
-        for idx, tier in enumerate(tiers):
-            next_min = tiers[idx + 1].min_quantity if idx + 1 < len(tiers) else None
-            max_qty = next_min if next_min else None
-            tier_ranges.append(
-                {
-                    "min": tier.min_quantity,
-                    "max": max_qty,
-                    "price": tier.price,
-                    "currency": tier.currency,
-                }
-            )
-        if len(tiers) > 1 and tiers[1].price < tiers[0].price:
-            tier_savings = tiers[0].price - tiers[1].price
-            first_tier_max = tiers[1].min_quantity
-    else:
-        # Fallback tiering for D2Pro when tiers are missing.
-        slug_lower = (product.slug or "").lower()
-        name_lower = (product.name or "").lower()
-        if "d2pro" in slug_lower or "d2pro" in name_lower:
-            tier_ranges = [
-                {"min": 1, "max": 19, "price": 320000, "currency": "NGN"},
-                {"min": 20, "max": None, "price": 280000, "currency": "NGN"},
-            ]
-            tier_savings = 40000
-            first_tier_max = 19
     products, categories, active_category, pagination = _get_shop_queryset(
         request, exclude_id=product.id
     )
@@ -327,6 +314,7 @@ def products(request):
             "categories": categories,
             "active_category": active_category,
             "pagination": pagination,
+            "facets": _get_shop_facets(request),
         },
     )
 
@@ -366,63 +354,168 @@ def payment_initialize(request):
     if request.method != "POST":
         return redirect("checkout")
 
-    cart = get_cart(request)
-    summary = cart_summary(cart)
-    if not summary["items"]:
-        return render(
+    claim, response = _claim_checkout_form(request)
+    if response:
+        return response
+    order = authorization_url = None
+    try:
+        response, pending = _prepare_form_payment(request)
+        if pending:
+            try:
+                payment = initialize_paystack_transaction(**pending["paystack"])
+            except PaystackError as exc:
+                response = _form_payment_failed(request, pending, exc)
+            else:
+                response = _form_payment_started(pending, payment)
+                order, authorization_url = pending["order"], payment["authorization_url"]
+    finally:
+        _settle_checkout_form(claim, order, authorization_url)
+    return response
+
+
+@ensure_csrf_cookie
+async def payment_initialize_async(request):
+    """``payment_initialize`` for ASGI deployments.
+
+    The Paystack call is awaited on the event loop; only the ORM and
+    template work runs in ``sync_to_async``, so a slow gateway does not
+    hold a worker thread.
+    """
+    if request.method != "POST":
+        return redirect("checkout")
+
+    claim, response = await sync_to_async(_claim_checkout_form)(request)
+    if response:
+        return response
+    order = authorization_url = None
+    try:
+        response, pending = await sync_to_async(_prepare_form_payment)(request)
+        if pending:
+            try:
+                payment = await ainitialize_paystack_transaction(**pending["paystack"])
+            except PaystackError as exc:
+                response = await sync_to_async(_form_payment_failed)(request, pending, exc)
+            else:
+                response = await sync_to_async(_form_payment_started)(pending, payment)
+                order, authorization_url = pending["order"], payment["authorization_url"]
+    finally:
+        await sync_to_async(_settle_checkout_form)(claim, order, authorization_url)
+    return response
+
+
+def _claim_checkout_form(request):
+    """Claim the checkout form's idempotency token.
+
+    The hidden token makes double submits replay the first attempt instead
+    of creating a second order. Returns ``(claim, response)``; when
+    ``response`` is set the request is a replay or a conflict and should be
+    answered with it straight away.
+    """
+    key = request.POST.get("idempotency_key", "").strip()
+    if not key:
+        return None, None
+    try:
+        claim = claim_idempotency_key(request, key)
+    except IdempotencyConflict as exc:
+        return None, render(
             request,
             "checkout.html",
-            {"cart": summary, "form": CheckoutForm(), "empty_cart": True},
+            {
+                "cart": cart_summary(get_cart(request)),
+                "form": CheckoutForm(request.POST),
+                "payment_error": str(exc),
+            },
+        )
+    if claim.response:
+        return claim, redirect(claim.response["authorization_url"])
+    return claim, None
+
+
+def _settle_checkout_form(claim, order, authorization_url):
+    """Remember a successful attempt for replays, or free the token."""
+    if claim is None:
+        return
+    if authorization_url:
+        complete_idempotency_key(claim, order.id, {"authorization_url": authorization_url})
+    else:
+        release_idempotency_key(claim)
+
+
+def _prepare_form_payment(request):
+    """Validate the checkout form and create the pending order.
+
+    Returns ``(response, None)`` when the form cannot proceed, otherwise
+    ``(None, pending)`` with the order and the Paystack initialize
+    arguments.
+    """
+    cart = materialize_cart(request)
+    summary = reconcile_cart(cart)
+    if not summary["items"]:
+        return (
+            render(
+                request,
+                "checkout.html",
+                {"cart": summary, "form": CheckoutForm(), "empty_cart": True},
+            ),
+            None,
         )
 
     form = CheckoutForm(request.POST)
     if not form.is_valid():
-        return render(request, "checkout.html", {"cart": summary, "form": form})
+        return render(request, "checkout.html", {"cart": summary, "form": form}), None
 
-    order, is_new_user, temp_password, password_reset_url = _create_pending_order(request, form, summary)
     try:
-        callback_url = get_paystack_callback_url(request)
-        payment = initialize_paystack_transaction(
-            order,
-            form.cleaned_data["email"],
-            summary["subtotal"],
-            summary["currency"],
-            callback_url,
-            metadata=build_paystack_metadata(order),
+        order, is_new_user, temp_password, password_reset_url = create_pending_order(
+            request, form.cleaned_data, summary
         )
-        order.payment_reference = payment["reference"]
-        order.save(update_fields=["payment_reference"])
-        
-        # Send welcome email for new users or standard order email for existing
-        if is_new_user and temp_password:
-            send_welcome_new_user_email(
-                order.user,
-                order,
-                temp_password,
-                password_reset_url,
-            )
-        else:
-            send_order_received_email(order)
-        
-        return redirect(payment["authorization_url"])
-    except PaystackError as exc:
-        logger.exception("Paystack initialization failed: %s", exc)
-        order.payment_status = "failed"
-        order.save(update_fields=["payment_status"])
-        return render(
-            request,
-            "checkout.html",
-            {
-                "cart": summary,
-                "form": form,
-                "payment_error": (
-                    f"Payment initialization failed: {exc}"
-                    if settings.DEBUG
-                    else "Payment initialization failed. Please try again."
-                ),
-                "order_id": order.id,
-            },
+    except InsufficientStock as exc:
+        return (
+            render(
+                request,
+                "checkout.html",
+                {"cart": summary, "form": form, "payment_error": str(exc)},
+            ),
+            None,
         )
+    return None, {
+        "order": order,
+        "form": form,
+        "summary": summary,
+        "signup": (is_new_user, temp_password, password_reset_url),
+        "paystack": {
+            "order": order,
+            "email": form.cleaned_data["email"],
+            "amount": summary["subtotal"],
+            "currency": summary["currency"],
+            "callback_url": get_paystack_callback_url(request),
+            "metadata": build_paystack_metadata(order),
+        },
+    }
+
+
+def _form_payment_started(pending, payment):
+    start_order_payment(pending["order"], payment["reference"], *pending["signup"])
+    return redirect(payment["authorization_url"])
+
+
+def _form_payment_failed(request, pending, exc):
+    logger.error("Paystack initialization failed: %s", exc, exc_info=exc)
+    order = pending["order"]
+    fail_order_payment(order)
+    return render(
+        request,
+        "checkout.html",
+        {
+            "cart": pending["summary"],
+            "form": pending["form"],
+            "payment_error": (
+                f"Payment initialization failed: {exc}"
+                if settings.DEBUG
+                else "Payment initialization failed. Please try again."
+            ),
+            "order_id": order.id,
+        },
+    )
 
 
 @ensure_csrf_cookie
@@ -493,8 +586,16 @@ def payment_callback(request):
     reference = request.GET.get("reference")
     if not reference:
         return HttpResponseBadRequest("Missing payment reference.")
+    order = Order.objects.filter(payment_reference=reference).first()
+    if not order:
+        return HttpResponseBadRequest("Order not found.")
+    if order.payment_status == "paid":
+        # The webhook got here first; no need to ask Paystack again.
+        clear_cart(get_cart(request))
+        return render(request, "checkout.html", {"order": order, "payment_success": True})
+
     try:
-        verification = verify_paystack_transaction(reference)
+        verification = verify_paystack_transaction(reference, cached=True)
     except PaystackError:
         summary = cart_summary(get_cart(request))
         return render(
@@ -508,11 +609,8 @@ def payment_callback(request):
         )
 
     data = verification.get("data") or {}
-    if data.get("status") != "success":
-        order = Order.objects.filter(payment_reference=reference).first()
-        if order:
-            order.payment_status = "failed"
-            order.save(update_fields=["payment_status"])
+    if data.get("status") in FAILED_STATUSES | EXPIRED_STATUSES:
+        fail_order_payment(order)
         summary = cart_summary(get_cart(request))
         return render(
             request,
@@ -521,33 +619,46 @@ def payment_callback(request):
                 "cart": summary,
                 "form": CheckoutForm(),
                 "payment_error": "Payment failed or was cancelled.",
-                "order_id": order.id if order else None,
+                "order_id": order.id,
+            },
+        )
+    if data.get("status") != "success":
+        # Not settled yet; the webhook or the sweeper will finish the order.
+        return render(
+            request,
+            "checkout.html",
+            {
+                "cart": cart_summary(get_cart(request)),
+                "form": CheckoutForm(),
+                "payment_error": (
+                    "Your payment is still processing. "
+                    "We will email you as soon as it is confirmed."
+                ),
+                "order_id": order.id,
             },
         )
 
-    order = Order.objects.filter(payment_reference=reference).first()
-    if not order:
-        return HttpResponseBadRequest("Order not found.")
-
+    paid_now = mark_order_paid(reference, data)
+    order.refresh_from_db()
+    if paid_now:
+        send_payment_confirmed_email(order)
     if order.payment_status != "paid":
-        amount_kobo = int(data.get("amount") or 0)
-        order.payment_status = "paid"
-        if order.status == "new":
-            order.status = "processing"
-        order.paid_at = timezone.now()
-        if amount_kobo:
-            order.amount = amount_kobo // 100
-        order.currency = data.get("currency") or order.currency
-        update_fields = ["payment_status", "status", "paid_at", "amount", "currency"]
-        if not order.payment_method:
-            order.payment_method = "paystack"
-            update_fields.append("payment_method")
-        order.save(update_fields=update_fields)
-
-    send_payment_confirmed_email(order)
+        # Charged after the order expired; staff have been flagged.
+        return render(
+            request,
+            "checkout.html",
+            {
+                "cart": cart_summary(get_cart(request)),
+                "form": CheckoutForm(),
+                "payment_error": (
+                    "Your payment arrived after this order expired. "
+                    "Our team will contact you to complete or refund it."
+                ),
+                "order_id": order.id,
+            },
+        )
 
-    cart = get_cart(request)
-    cart.items.all().delete()
+    clear_cart(get_cart(request))
 
     return render(
         request,
@@ -568,29 +679,11 @@ def payment_webhook(request):
     except json.JSONDecodeError:
         return HttpResponseBadRequest("Invalid payload.")
 
-    if event.get("event") == "charge.success":
-        data = event.get("data") or {}
-        reference = data.get("reference")
-        if reference:
-            order = Order.objects.filter(payment_reference=reference).first()
-            if order:
-                if order.payment_status != "paid":
-                    amount_kobo = int(data.get("amount") or 0)
-                    order.payment_status = "paid"
-                    if order.status == "new":
-                        order.status = "processing"
-                    order.paid_at = timezone.now()
-                    if amount_kobo:
-                        order.amount = amount_kobo // 100
-                    order.currency = data.get("currency") or order.currency
-                    update_fields = ["payment_status", "status", "paid_at", "amount", "currency"]
-                    if not order.payment_method:
-                        order.payment_method = "paystack"
-                        update_fields.append("payment_method")
-                    order.save(update_fields=update_fields)
-
-                send_payment_confirmed_email(order)
+    if not isinstance(event, dict):
+        return HttpResponseBadRequest("Invalid payload.")
 
+    # Acknowledge fast; process_payment_events applies the event later.
+    record_payment_event(event)
     return JsonResponse({"status": "ok"})
 
 
@@ -1114,6 +1207,8 @@ def poshadmin_api_product_images_order(request, pk):
     order = payload.get("order", [])
     for idx, img_id in enumerate(order):
         ProductImage.objects.filter(product=product, id=img_id).update(display_order=idx)
+    # Queryset updates bypass the save signals that normally invalidate.
+    bump_catalog_generation()
     return JsonResponse({"success": True})
 
 
@@ -1244,6 +1339,78 @@ def poshadmin_api_order_resend(request, pk):
     return JsonResponse({"success": True})
 
 
+# Upper bound on orders re-notified by one bulk resend request.
+BULK_RESEND_LIMIT = 500
+
+
+@staff_member_required
+def poshadmin_api_orders_resend(request):
+    """Resend an email for many orders at once.
+
+    JSON body: ``order_ids`` (list), or ``status`` and/or ``payment_status``
+    filters; ``email`` is ``order_received`` (default) or ``order_paid``.
+    Orders and their lines are loaded in two queries.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    try:
+        payload = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    email = payload.get("email") or "order_received"
+    if email not in RESENDABLE_EMAILS:
+        return JsonResponse({"error": f"Unknown email: {email}"}, status=400)
+
+    orders = Order.objects.prefetch_related(
+        models.Prefetch("items", queryset=OrderItem.objects.select_related("product"))
+    )
+    order_ids = payload.get("order_ids")
+    if order_ids is not None:
+        if not isinstance(order_ids, list) or not all(
+            isinstance(order_id, int) and not isinstance(order_id, bool)
+            for order_id in order_ids
+        ):
+            return JsonResponse({"error": "order_ids must be a list of integers"}, status=400)
+        orders = orders.filter(id__in=order_ids)
+    else:
+        filters = {}
+        for field, choices in (
+            ("status", Order.STATUS_CHOICES),
+            ("payment_status", Order.PAYMENT_STATUS_CHOICES),
+        ):
+            if field not in payload:
+                continue
+            if payload[field] not in {choice[0] for choice in choices}:
+                return JsonResponse({"error": f"Unknown {field}: {payload[field]}"}, status=400)
+            filters[field] = payload[field]
+        if not filters:
+            return JsonResponse(
+                {"error": "Provide order_ids or a status/payment_status filter"}, status=400
+            )
+        orders = orders.filter(**filters)
+    orders = list(orders.order_by("id")[: BULK_RESEND_LIMIT + 1])
+    if len(orders) > BULK_RESEND_LIMIT:
+        return JsonResponse(
+            {"error": f"At most {BULK_RESEND_LIMIT} orders can be resent at once"}, status=400
+        )
+
+    results = resend_order_emails(orders, email)
+    if order_ids is not None:
+        for order_id in order_ids:
+            results.setdefault(order_id, {"status": "not_found"})
+    counts = {}
+    for result in results.values():
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return JsonResponse(
+        {
+            "results": [{"id": order_id, **result} for order_id, result in results.items()],
+            "counts": counts,
+        }
+    )
+
+
 @staff_member_required
 def poshadmin_api_customer_status(request, pk):
     user = get_object_or_404(User, pk=pk, is_staff=False)
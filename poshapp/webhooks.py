@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.utils import timezone
+
+from poshapp.checkout import mark_order_paid
+from poshapp.emails import send_payment_confirmed_email
+from poshapp.models import Order, PaymentEvent
+
+
+def record_payment_event(event):
+    """Store a verified webhook ``event`` in the inbox; redeliveries of an
+    (event, reference) pair already stored are dropped by the database."""
+    data = event.get("data") or {}
+    PaymentEvent.objects.bulk_create(
+        [
+            PaymentEvent(
+                event=str(event.get("event") or "")[:64],
+                reference=str(data.get("reference") or "")[:255],
+                payload=event,
+            )
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def apply_payment_event(payment_event):
+    """Apply one inbox event's order transition.
+
+    Must run inside a transaction; emails go out once it commits.
+    """
+    if payment_event.event != "charge.success" or not payment_event.reference:
+        return
+    data = payment_event.payload.get("data") or {}
+    if mark_order_paid(payment_event.reference, data):
+        order = Order.objects.filter(payment_reference=payment_event.reference).first()
+        transaction.on_commit(lambda: send_payment_confirmed_email(order))
+
+
+def process_payment_events(batch_size=100, max_attempts=5, after_id=0):
+    """Process one batch of pending events with an id above ``after_id``.
+
+    Rows are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the
+    database supports it, so several workers can drain the inbox together.
+    An event that raises is retried on a later run until it has failed
+    ``max_attempts`` times. Returns ``(events, last_id)``; ``events`` is
+    empty once nothing is left.
+    """
+    with transaction.atomic():
+        events = list(
+            PaymentEvent.objects.filter(status="pending", id__gt=after_id)
+            .select_for_update(skip_locked=True)
+            .order_by("id")[:batch_size]
+        )
+        for payment_event in events:
+            payment_event.attempts += 1
+            try:
+                with transaction.atomic():
+                    apply_payment_event(payment_event)
+            except Exception as exc:
+                payment_event.last_error = str(exc)
+                if payment_event.attempts >= max_attempts:
+                    payment_event.status = "failed"
+            else:
+                payment_event.status = "processed"
+                payment_event.processed_at = timezone.now()
+                payment_event.last_error = ""
+        PaymentEvent.objects.bulk_update(
+            events, ["status", "attempts", "last_error", "processed_at"]
+        )
+    return events, events[-1].id if events else after_id
@@ -159,6 +159,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'poshapp.context_processors.static_asset_version',
+                'poshapp.context_processors.payment_initialize_url',
             ],
         },
     },
@@ -188,6 +189,47 @@ DATABASES = {
     )
 }
 
+# Cache
+# LocMemCache is per-process; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# cache (e.g. django.core.cache.backends.redis.RedisCache) so catalog
+# invalidation reaches every gunicorn worker immediately.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "").strip()
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKEND or "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": os.getenv("CACHE_LOCATION", "").strip() or "poshpearl",
+    }
+}
+
+# Seconds a cached catalog listing/detail page may be served (0 disables).
+# Off by default with LocMemCache: the catalog generation lives in each
+# worker's own memory, so an admin edit would stay invisible to the others.
+CATALOG_CACHE_TIMEOUT = config(
+    "CATALOG_CACHE_TIMEOUT", default=300 if CACHE_BACKEND else 0, cast=int
+)
+
+# Resolve unsearched listing pages from a per-worker in-memory snapshot of the
+# active catalog, then fetch only the rows on the page. Rebuilds follow the
+# catalog generation, so like the page cache it needs a shared cache.
+CATALOG_SNAPSHOT = config("CATALOG_SNAPSHOT", default=bool(CACHE_BACKEND), cast=bool)
+
+# Serve search autocomplete from a per-worker in-memory index. Also rebuilt
+# off the catalog generation, so off by default without a shared cache.
+SUGGEST_INDEX = config("SUGGEST_INDEX", default=bool(CACHE_BACKEND), cast=bool)
+
+# Where anonymous carts live: "session" keeps lines in the session payload
+# until checkout or login; "db" creates a Cart row per visitor session.
+GUEST_CART_STORAGE = config("GUEST_CART_STORAGE", default="session")
+
+# Seconds a checkout Idempotency-Key is remembered for replays.
+IDEMPOTENCY_KEY_TTL = config("IDEMPOTENCY_KEY_TTL", default=86400, cast=int)
+# Seconds an unfinished claim holds its key before a retry may take it over.
+IDEMPOTENCY_LEASE_SECONDS = config("IDEMPOTENCY_LEASE_SECONDS", default=300, cast=int)
+
+# Product search: auto (PostgreSQL tsvector / SQLite FTS5 by database),
+# postgres, sqlite, basic (icontains), or a dotted path to a backend class.
+SEARCH_BACKEND = config("SEARCH_BACKEND", default="auto")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -230,7 +272,7 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / "staticfiles"
-STATIC_ASSET_VERSION = os.getenv("STATIC_ASSET_VERSION", "20260219.10")
+STATIC_ASSET_VERSION = os.getenv("STATIC_ASSET_VERSION", "20261017.1")
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
@@ -276,6 +318,17 @@ PAYSTACK_SECRET_KEY = os.getenv("PAYSTACK_SECRET_KEY", "")
 PAYSTACK_PUBLIC_KEY = os.getenv("PAYSTACK_PUBLIC_KEY", "")
 PAYSTACK_BASE_URL = os.getenv("PAYSTACK_BASE_URL", "https://api.paystack.co")
 PAYSTACK_CALLBACK_URL = os.getenv("PAYSTACK_CALLBACK_URL", "")
+# Keep-alive client: timeouts in seconds, retries apply to verify calls only.
+PAYSTACK_CONNECT_TIMEOUT = float(os.getenv("PAYSTACK_CONNECT_TIMEOUT", "5"))
+PAYSTACK_READ_TIMEOUT = float(os.getenv("PAYSTACK_READ_TIMEOUT", "20"))
+PAYSTACK_MAX_RETRIES = int(os.getenv("PAYSTACK_MAX_RETRIES", "2"))
+PAYSTACK_RETRY_BACKOFF = float(os.getenv("PAYSTACK_RETRY_BACKOFF", "0.25"))
+PAYSTACK_POOL_SIZE = int(os.getenv("PAYSTACK_POOL_SIZE", "4"))
+# Seconds the payment callback reuses a verify answer for the same reference.
+PAYSTACK_VERIFY_CACHE_TIMEOUT = int(os.getenv("PAYSTACK_VERIFY_CACHE_TIMEOUT", "10"))
+# Post the checkout form to the async init view; enable when served via
+# project.asgi so Paystack round-trips don't tie up worker threads.
+PAYMENT_INIT_ASYNC = config("PAYMENT_INIT_ASYNC", default=False, cast=bool)
 
 # Email settings (auto-switch: SMTP if host provided, else console for local)
 EMAIL_HOST = config("EMAIL_HOST", default="")
@@ -290,6 +343,9 @@ EMAIL_BACKEND = os.getenv(
 EMAIL_USE_SSL = config("EMAIL_USE_SSL", default=False, cast=bool)
 DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL", default="no-reply@poshpearl.com")
 EMAIL_ALLOW_INSECURE_SSL = config("EMAIL_ALLOW_INSECURE_SSL", default=False, cast=bool)
+# Queue transactional emails in EmailOutbox for `manage.py send_outbox`
+# instead of talking SMTP inside the request.
+EMAIL_OUTBOX = config("EMAIL_OUTBOX", default=True, cast=bool)
 
 # Optional insecure SSL (local/dev only) to bypass MITM cert issues
 if EMAIL_ALLOW_INSECURE_SSL: